@@ -0,0 +1,182 @@
+import logging
+
+from app.games.exceptions import UnregisteredCardException
+from app.games.office_game import CARD_ENDS_SESSION, CARD_JOINS_SESSION, OfficeGame
+from app.utils.async_firebase import AsyncFirebase
+from app.utils.imports import lazy_import
+from app.utils.metrics import metrics
+
+# The game implementations import this module in the threaded mode too
+asyncio = lazy_import('asyncio')
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOfficeGame(OfficeGame):
+    """
+    OfficeGame for an asyncio event loop.
+
+    register_card(), start_session() and end_session() are coroutines that talk to Firebase without blocking the event
+    loop, so one thread can serve many readers. Independent lookups (the pending registration and the card) run
+    concurrently, while the card reads themselves are still applied to the session one at a time. Slack is never
+    called on the way: the messages go through the Slack outbox thread and the players come from the directory sync.
+    """
+
+    def __init__(self, game_name, game_version, min_max_card_count=2, loop=None, services=None, game_type=None):
+        super().__init__(game_name, game_version, min_max_card_count, services=services, game_type=game_type)
+        self.loop = loop or asyncio.get_event_loop()
+        self.async_firebase = AsyncFirebase(self.firebase, loop=self.loop)
+        self.card_lock = asyncio.Lock(loop=self.loop)
+
+    async def _get_pending_registration(self, card_uid):
+        if self.player_cache.is_pending_registrations_synced():
+            return self.player_cache.get_cached_pending_registration(card_uid)
+        return await self.async_firebase.get(f'pending_registrations/{card_uid}')
+
+    async def _get_registered_card(self, card_uid):
+        card = self.player_cache.get_cached_card(card_uid)
+        if card is None and not self.player_cache.is_cards_synced():
+            card = self.player_cache.set_card(card_uid, await self.async_firebase.get(f'cards/{card_uid}'))
+        return card
+
+    async def _get_card_alias(self, card_uid):
+        canonical_uid = self.player_cache.get_cached_card_alias(card_uid)
+        if canonical_uid is None and not self.player_cache.is_card_aliases_synced():
+            canonical_uid = await self.async_firebase.get(f'card_aliases/{card_uid}')
+        return canonical_uid
+
+    async def _get_card(self, card_uid):
+        # Same as PlayerCache.find_card(), the card stored under the UID as it was read wins over the alias index
+        card = await self._get_registered_card(card_uid)
+        canonical_uid = await self._get_card_alias(card_uid) if card is None else None
+        if canonical_uid is not None:
+            card = await self._get_registered_card(canonical_uid)
+        return card
+
+    async def _get_player(self, slack_user_id):
+        player = self.player_cache.get_cached_player(slack_user_id)
+        if player is None:
+            player = await self.async_firebase.get(f'player_profiles/{slack_user_id}')
+            if player is None:
+                # Not copied to player_profiles yet, see PlayerCache.get_player()
+                player = await self.async_firebase.get(f'players/{slack_user_id}', shallow=True)
+            player = self.player_cache.set_player(slack_user_id, player)
+        return player
+
+    async def _get_player_statistics(self, slack_user_id):
+        player_statistics = self.player_cache.get_cached_player_statistics(self.game_slug, slack_user_id)
+        if player_statistics is None:
+            player_statistics = self.player_cache.set_player_statistics(
+                self.game_slug,
+                slack_user_id,
+                await self.async_firebase.get(f'games/{self.game_slug}/player_statistics/{slack_user_id}')
+            )
+        return player_statistics
+
+    async def _check_pending_card_registration(self, card):
+        pending_registration = self._get_valid_pending_registration(
+            card,
+            await self._get_pending_registration(card.get_uid())
+        )
+
+        if pending_registration is None:
+            return False
+
+        # Registering a card is rare (and used for administration), it keeps using the blocking clients
+        await self.loop.run_in_executor(None, self.register_new_game_card, card, pending_registration['user_id'])
+        await self.async_firebase.remove(f'pending_registrations/{card.get_uid()}')
+        self.player_cache.forget_pending_registration(card.get_uid())
+        return True
+
+    async def _get_remote_player_information(self, card):
+        existing_card = await self._get_card(card.get_uid())
+
+        if existing_card is None or 'slack_user_id' not in existing_card:
+            raise UnregisteredCardException(card)
+
+        # The player and the player statistics do not depend on each other, fetch them concurrently
+        slack_user_id = existing_card['slack_user_id']
+        existing_player, existing_player_statistics = await asyncio.gather(
+            self._get_player(slack_user_id),
+            self._get_player_statistics(slack_user_id),
+            loop=self.loop
+        )
+        game_player = self._create_game_player(card, slack_user_id, existing_player, existing_player_statistics)
+
+        self._fill_slack_information(game_player)
+        return game_player
+
+    async def _commit_async(self, updates):
+        if self.journal is not None:
+            # Committing to the local journal does not touch the network
+            self._commit(updates)
+        else:
+            await self.async_firebase.update('', updates)
+
+    async def start_session(self):
+        # Set the start time of the current session in remote
+        await self._commit_async(self._begin_session())
+
+        # Send a notification to listeners
+        self.event_dispatcher.dispatch('on_start_session', list(self.get_current_session().get_players()))
+
+    async def end_session(self, winner_player):
+        session_updates, new_player_statistics, end_session_event = self._finish_session(winner_player)
+
+        # Write the session, the player sessions and statistics and the current session reset in one atomic update
+        await self._commit_async(session_updates)
+
+        self._session_finished(new_player_statistics, end_session_event)
+
+    async def register_card(self, card):
+        async with self.card_lock:
+            try:
+                with metrics.time('tap_stage_seconds', stage='register_card'):
+                    await self._register_card(card)
+            finally:
+                logger.debug(f'Player cache statistics: {self.player_cache.get_stats()}')
+                logger.debug(f'Listener statistics: {self.event_dispatcher.get_stats()}')
+                if self.journal_replayer is not None:
+                    logger.debug(f'Journal statistics: {self.journal_replayer.get_stats()}')
+
+    async def _register_card(self, card):
+        # The pending registration check and the player lookup are independent, run them concurrently
+        is_pending_registration, player = await asyncio.gather(
+            self._check_pending_card_registration(card),
+            self._get_remote_player_information(card),
+            loop=self.loop,
+            return_exceptions=True
+        )
+        if isinstance(is_pending_registration, Exception):
+            raise is_pending_registration
+        if is_pending_registration:
+            return
+        if isinstance(player, UnregisteredCardException):
+            # Send a notification to listeners
+            self.event_dispatcher.dispatch('on_unregistered_card_read', card)
+            return
+        if isinstance(player, Exception):
+            raise player
+
+        card_action = self._handle_player_card(card, player)
+        if card_action == CARD_ENDS_SESSION:
+            # We have a winner! End the session and register the winner
+            await self.end_session(self.get_current_session().get_player_by_card(card))
+        elif card_action == CARD_JOINS_SESSION:
+            # Update the current session in Firebase as well
+            await self._commit_async({
+                f'games/{self.game_slug}/current_session': {
+                    'players': self.get_current_session().get_players_simplified()
+                }
+            })
+
+            self._player_joined(player)
+
+            if self.get_current_session().has_all_needed_players():
+                # We have all the players/cards needed to start the game. Start the actual session
+                await self.start_session()
+
+    async def close(self):
+        """Stop the game and close the HTTP session of the Firebase client"""
+        await self.loop.run_in_executor(None, self.stop)
+        await self.async_firebase.close()
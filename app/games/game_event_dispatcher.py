@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+import time
+
+from app.settings import LISTENER_MAX_BACKLOG, LISTENER_OVERFLOW_POLICY
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Drop the event that could not be queued
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+# Drop the oldest queued event to make room for the new one
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+# Wait until the listener has room for the event (the game will wait for slow listeners)
+OVERFLOW_BLOCK = 'block'
+
+OVERFLOW_POLICIES = [OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK]
+
+
+class GameListenerWorker(threading.Thread):
+    """Delivers the events of a single game listener from its own thread, in the order they were dispatched"""
+
+    def __init__(self, listener, max_backlog, overflow_policy):
+        threading.Thread.__init__(self, name=f'{listener.__class__.__name__}Worker')
+        self.daemon = True
+        self.listener = listener
+        self.overflow_policy = overflow_policy
+        self.events = queue.Queue(maxsize=max_backlog)
+        self.queued_events = 0
+        self.delivered_events = 0
+        self.dropped_events = 0
+        self.failed_events = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, event_name, args, kwargs):
+        event = (event_name, args, kwargs, time.monotonic())
+        self.queued_events += 1
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            self.events.put(event)
+            return
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                self.dropped_events += 1
+                metrics.increment('listener_dropped_events_total', listener=self.listener.__class__.__name__)
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    logger.warning(f'Backlog of {self.listener.__class__.__name__} is full, dropped {event_name}')
+                    return
+            try:
+                dropped_event = self.events.get_nowait()
+                logger.warning(f'Backlog of {self.listener.__class__.__name__} is full, dropped {dropped_event[0]}')
+            except queue.Empty:
+                pass
+
+    def run(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            event_name, args, kwargs, queued_time = event
+            try:
+                getattr(self.listener, event_name)(*args, **kwargs)
+            except Exception:
+                self.failed_events += 1
+                logger.exception(f'{self.listener.__class__.__name__} failed handling {event_name}')
+            latency = time.monotonic() - queued_time
+            metrics.observe('listener_event_seconds', latency, listener=self.listener.__class__.__name__,
+                            event=event_name)
+            self.delivered_events += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def stop(self, timeout=None):
+        """Deliver the events that are already queued and stop the worker"""
+        self.events.put(None)
+        self.join(timeout)
+
+    def get_stats(self):
+        return {
+            'backlog': self.events.qsize(),
+            'queued': self.queued_events,
+            'delivered': self.delivered_events,
+            'dropped': self.dropped_events,
+            'failed': self.failed_events,
+            'average_latency': self.total_latency / self.delivered_events if self.delivered_events else 0.0,
+            'max_latency': self.max_latency
+        }
+
+
+class GameEventDispatcher:
+    """
+    Dispatches game events to the game listeners without blocking the game.
+
+    Every listener gets a bounded backlog and a worker thread, so a slow listener (e.g. one waiting for the Slack API)
+    does not delay card reads or the other listeners.
+    """
+
+    def __init__(self, max_backlog=LISTENER_MAX_BACKLOG, overflow_policy=LISTENER_OVERFLOW_POLICY):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown listener overflow policy {overflow_policy}, expected one of {OVERFLOW_POLICIES}')
+        self.max_backlog = max_backlog
+        self.overflow_policy = overflow_policy
+        self.workers = []
+
+    def add_listener(self, listener):
+        worker = GameListenerWorker(listener, self.max_backlog, self.overflow_policy)
+        worker.start()
+        self.workers.append(worker)
+
+    def get_listeners(self):
+        return [worker.listener for worker in self.workers]
+
+    def dispatch(self, event_name, *args, **kwargs):
+        with metrics.time('tap_stage_seconds', stage='dispatch'):
+            for worker in self.workers:
+                worker.put(event_name, args, kwargs)
+
+    def stop(self, timeout=None):
+        for worker in self.workers:
+            worker.stop(timeout)
+
+    def get_stats(self):
+        return {worker.listener.__class__.__name__: worker.get_stats() for worker in self.workers}
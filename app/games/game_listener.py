@@ -26,12 +26,12 @@ class GameListener:
     def on_start_session(self, players):
         pass
 
-    def on_end_session(self, winner_player, winner_new_elo_rating, winner_new_trueskill_rating,
-                       loser_player, loser_new_elo_rating, loser_new_trueskill_rating):
+    def on_end_session(self, winner_players, loser_players, new_elo_ratings, new_trueskill_ratings):
+        """The new ratings are dictionaries of Slack user ID -> rating, the players still have their old ratings"""
         pass
 
     def on_session_timeout(self, session):
         pass
 
-    def on_register_player(self, player):
+    def on_register_player(self, player, player_number):
         pass
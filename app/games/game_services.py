@@ -0,0 +1,90 @@
+import logging
+
+import requests
+from slacker import Slacker
+
+from app.games.player_cache import PlayerCache
+from app.games.slack_directory_sync import SlackDirectorySync, parse_slack_user
+from app.settings import CACHE_WARM_UP_ENABLED, JOURNAL_ENABLED, JOURNAL_PATH, SLACK_TOKEN
+from app.utils.firebase import get_firebase
+from app.utils.http import MetricsHTTPAdapter
+from app.utils.journal import Journal, JournalReplayer
+from app.utils.slack_outbox import SlackOutbox
+
+logger = logging.getLogger(__name__)
+
+
+class GameServices:
+    """
+    The clients and background workers of the games in a process: Firebase, the player cache, the journal and Slack
+    (the outbox and the directory sync).
+
+    A game creates its own when none is given. When one process serves several tables, their games share one instance,
+    so there is one connection pool, one cache (with one set of streams), one journal and one Slack rate limit.
+    """
+
+    def __init__(self, firebase=None, slack=None, journal_path=JOURNAL_PATH):
+        self.firebase = firebase or get_firebase()
+        self.player_cache = PlayerCache(self.firebase)
+        self.game_slugs = set()
+        self.journal = None
+        self.journal_replayer = None
+        if JOURNAL_ENABLED:
+            # Game results are committed locally first and pushed to Firebase in the background
+            self.journal = Journal(journal_path)
+            # The cache lays the entries left from the last run over Firebase until they are replayed
+            for entry_id, updates in self.journal.get_pending(limit=None):
+                self.player_cache.add_pending_writes(entry_id, updates)
+            self.journal_replayer = JournalReplayer(
+                self.journal,
+                self.firebase,
+                on_done=self.player_cache.remove_pending_writes
+            )
+            self.journal_replayer.start()
+        if slack is None:
+            # Slack requests go through a keep-alive session that records their latency
+            slack_session = requests.Session()
+            slack_session.mount('https://', MetricsHTTPAdapter('slack', endpoint_segment=-1))
+            slack = Slacker(SLACK_TOKEN, session=slack_session)
+        self.slack = slack
+        self.slack_outbox = SlackOutbox(self.slack)
+        self.slack_outbox.start()
+        self.slack_directory_sync = SlackDirectorySync(
+            self.firebase,
+            self.player_cache,
+            self.slack,
+            parse_slack_user,
+            self.commit
+        )
+        self.slack_directory_sync.start()
+
+    def add_game(self, game_slug):
+        """Warm up (if enabled) and watch the player statistics of a game, the cards and players are loaded once"""
+        if CACHE_WARM_UP_ENABLED:
+            self.player_cache.warm_up(game_slug, load_shared=not self.game_slugs)
+        self.player_cache.watch(game_slug)
+        self.game_slugs.add(game_slug)
+
+    def commit(self, updates):
+        """Write a multi-path update, through the journal when it is enabled"""
+        if self.journal is not None:
+            self.player_cache.add_pending_writes(self.journal.append(updates), updates)
+            self.journal_replayer.wake()
+        else:
+            self.firebase.database().update(updates)
+
+    def log_stats(self):
+        logger.debug(f'Player cache statistics: {self.player_cache.get_stats()}')
+        logger.debug(f'Slack outbox statistics: {self.slack_outbox.get_stats()}')
+        logger.debug(f'Slack directory statistics: {self.slack_directory_sync.get_stats()}')
+        if self.journal_replayer is not None:
+            logger.debug(f'Journal statistics: {self.journal_replayer.get_stats()}')
+
+    def stop(self):
+        """Deliver the queued Slack messages, close the streams and the journal, call it after the games stopped"""
+        self.slack_directory_sync.stop()
+        self.slack_outbox.stop()
+        self.player_cache.close()
+        if self.journal is not None:
+            self.journal_replayer.stop()
+            self.journal.close()
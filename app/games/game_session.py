@@ -1,5 +1,6 @@
 import logging
 
+from app.games.game_type import SINGLES
 from app.settings import GAME_PLAYER_REGISTRATION_TIMEOUT
 from app.utils.time import utc_now
 
@@ -7,14 +8,22 @@ logger = logging.getLogger(__name__)
 
 
 class GameSession:
-    def __init__(self, min_max_card_count):
+    def __init__(self, game_type=SINGLES):
+        self.game_type = game_type
+        # In the order the players joined, which decides the teams
         self.players = []
+        # Card UID -> player and Slack user ID -> player, for the membership checks of every card read
+        self.players_by_card_uid = {}
+        self.players_by_slack_user_id = {}
         self.join_times = {}
         self.start_time = None
-        self.min_max_card_count = min_max_card_count
+        # Has the timed out session been removed from Firebase? It stays here until the next card is read
+        self.remote_session_removed = False
+        self.min_max_card_count = game_type.get_player_count()
 
     def __repr__(self):
         return '<GameSession ' \
+               f'game_type={self.game_type.name} ' \
                f'has_started={self.start_time is not None} ' \
                f'start_time={self.start_time} ' \
                f'players={self.players}>'
@@ -24,28 +33,36 @@ class GameSession:
 
     def add_player(self, player):
         self.players.append(player)
+        self.players_by_card_uid[player.get_card().get_uid()] = player
+        self.players_by_slack_user_id[player.get_slack_user_id()] = player
         self.join_times[player.get_slack_user_id()] = utc_now()
 
     def remove_player(self, player):
         self.players.remove(player)
+        self.players_by_card_uid.pop(player.get_card().get_uid(), None)
+        self.players_by_slack_user_id.pop(player.get_slack_user_id(), None)
         self.join_times.pop(player.get_slack_user_id(), None)
 
     def remove_player_by_card(self, card):
-        for player in self.players:
-            if card.get_uid() == player.get_card().get_uid():
-                self.remove_player(player)
+        player = self.get_player_by_card(card)
+        if player is not None:
+            self.remove_player(player)
 
     def get_player(self, i):
         return self.players[i]
 
     def get_player_by_card(self, card):
-        for player in self.players:
-            if card.get_uid() == player.get_card().get_uid():
-                return player
+        return self.players_by_card_uid.get(card.get_uid())
 
     def get_players(self):
         return self.players
 
+    def get_teams(self):
+        return self.game_type.get_teams(self.players)
+
+    def get_team_index(self, player):
+        return self.players.index(player) // self.game_type.team_size
+
     def get_players_simplified(self):
         simplified_players = {}
         for player in self.players:
@@ -67,16 +84,10 @@ class GameSession:
         return (utc_now() - self.start_time).total_seconds()
 
     def is_session_card(self, card):
-        for player in self.players:
-            if card.get_uid() == player.get_card().get_uid():
-                return True
-        return False
+        return card.get_uid() in self.players_by_card_uid
 
     def is_session_player(self, player):
-        for session_player in self.players:
-            if player.get_slack_user_id() == session_player.get_slack_user_id():
-                return True
-        return False
+        return player.get_slack_user_id() in self.players_by_slack_user_id
 
     def should_reset(self):
         if len(self.players) == 0 or self.has_all_needed_players():
@@ -86,6 +97,12 @@ class GameSession:
                 return True
         return False
 
+    def set_remote_session_removed(self):
+        self.remote_session_removed = True
+
+    def is_remote_session_removed(self):
+        return self.remote_session_removed
+
     def start(self):
         # TODO: beep 3 times with buzzer
         self.start_time = utc_now()
@@ -9,6 +9,9 @@ class GameThreadTimer(Thread):
 
     def run(self):
         while not self.stopped.wait(10.0):
-            if self.game.get_current_session().should_reset():
-                # Reset the current session if needed
-                self.game.get_db().child('current_session').remove()
+            session = self.game.get_current_session()
+            if session.should_reset() and not session.is_remote_session_removed():
+                # Reset the current session if needed, once (every removal is a journal entry and a write to Firebase)
+                self.game.remove_current_remote_session()
+                session.set_remote_session_removed()
+            self.game.check_leaderboard()
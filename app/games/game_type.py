@@ -0,0 +1,74 @@
+import trueskill
+
+from app.utils.elo_rating import calculate_new_rating
+
+
+class GameType:
+    """
+    How the players of a session are split into teams and rated.
+
+    The players form the teams in the order they join: with teams of two, the first two cards are the first team. The
+    team of the card that ends the session wins, the other teams share the second place.
+    """
+
+    def __init__(self, name, team_count, team_size=1):
+        self.name = name
+        self.team_count = team_count
+        self.team_size = team_size
+
+    def __repr__(self):
+        return f'<GameType name={self.name} team_count={self.team_count} team_size={self.team_size}>'
+
+    def get_player_count(self):
+        return self.team_count * self.team_size
+
+    def get_teams(self, players):
+        return [players[i:i + self.team_size] for i in range(0, len(players), self.team_size)]
+
+    def rate(self, teams, winner_team, env=None):
+        """
+        Rate a finished session, `teams` is a list of teams of (elo_rating, trueskill Rating) tuples.
+
+        Returns the TrueSkill match quality (before the session) and the new (elo_rating, trueskill Rating) of every
+        player, in the same teams. All the TrueSkill ratings are updated in one call, so the teams are rated together.
+        Every player's Elo rating is updated against the average rating of the other side (the winning team for the
+        losers, all the losers for the winners), which is the plain 1 vs 1 Elo update for singles.
+        """
+        env = env or trueskill.global_env()
+        rating_groups = [[rating for _, rating in team] for team in teams]
+        ranks = [0 if i == winner_team else 1 for i in range(len(teams))]
+        quality = env.quality(rating_groups)
+        new_rating_groups = env.rate(rating_groups, ranks=ranks)
+
+        winner_elo_ratings = [elo_rating for elo_rating, _ in teams[winner_team]]
+        loser_elo_ratings = [elo_rating for i, team in enumerate(teams) if i != winner_team for elo_rating, _ in team]
+        winner_average = sum(winner_elo_ratings) / len(winner_elo_ratings)
+        loser_average = sum(loser_elo_ratings) / len(loser_elo_ratings)
+
+        new_teams = []
+        for i, (team, new_ratings) in enumerate(zip(teams, new_rating_groups)):
+            is_winner = i == winner_team
+            new_teams.append([
+                (calculate_new_rating(elo_rating, loser_average if is_winner else winner_average, is_winner), rating)
+                for (elo_rating, _), rating in zip(team, new_ratings)
+            ])
+        return quality, new_teams
+
+
+SINGLES = GameType('singles', team_count=2)
+DOUBLES = GameType('doubles', team_count=2, team_size=2)
+
+
+def free_for_all(player_count):
+    return GameType('free_for_all', team_count=player_count)
+
+
+def get_game_type(name, player_count):
+    """Returns the game type of a stored session, by its name and amount of players"""
+    if name == SINGLES.name:
+        return SINGLES
+    if name == DOUBLES.name:
+        return DOUBLES
+    if name == 'free_for_all':
+        return free_for_all(player_count)
+    raise ValueError(f'Unknown game type {name}')
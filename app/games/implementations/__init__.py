@@ -0,0 +1,10 @@
+from app.games.implementations.foosball import (AsyncFoosballDoublesGame, AsyncFoosballGame, FoosballDoublesGame,
+                                                FoosballGame)
+from app.games.implementations.ping_pong import AsyncPingPongGame, PingPongGame
+
+# Game slug -> (game, game for the asyncio mode)
+GAMES = {
+    'ping-pong': (PingPongGame, AsyncPingPongGame),
+    'foosball': (FoosballGame, AsyncFoosballGame),
+    'foosball-doubles': (FoosballDoublesGame, AsyncFoosballDoublesGame)
+}
@@ -0,0 +1,45 @@
+from app.games.async_office_game import AsyncOfficeGame
+from app.games.game_type import DOUBLES
+from app.games.office_game import OfficeGame
+
+
+class FoosballGame(OfficeGame):
+    def __init__(self, services=None):
+        super().__init__(
+            game_name='Foosball',
+            game_version='0.1.0',
+            min_max_card_count=2,
+            services=services
+        )
+
+
+class AsyncFoosballGame(AsyncOfficeGame):
+    def __init__(self, loop=None, services=None):
+        super().__init__(
+            game_name='Foosball',
+            game_version='0.1.0',
+            min_max_card_count=2,
+            loop=loop,
+            services=services
+        )
+
+
+class FoosballDoublesGame(OfficeGame):
+    def __init__(self, services=None):
+        super().__init__(
+            game_name='Foosball Doubles',
+            game_version='0.1.0',
+            services=services,
+            game_type=DOUBLES
+        )
+
+
+class AsyncFoosballDoublesGame(AsyncOfficeGame):
+    def __init__(self, loop=None, services=None):
+        super().__init__(
+            game_name='Foosball Doubles',
+            game_version='0.1.0',
+            loop=loop,
+            services=services,
+            game_type=DOUBLES
+        )
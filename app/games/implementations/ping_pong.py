@@ -1,10 +1,23 @@
+from app.games.async_office_game import AsyncOfficeGame
 from app.games.office_game import OfficeGame
 
 
 class PingPongGame(OfficeGame):
-    def __init__(self):
+    def __init__(self, services=None):
         super().__init__(
             game_name='Ping Pong',
             game_version='0.1.0',
-            min_max_card_count=2
+            min_max_card_count=2,
+            services=services
+        )
+
+
+class AsyncPingPongGame(AsyncOfficeGame):
+    def __init__(self, loop=None, services=None):
+        super().__init__(
+            game_name='Ping Pong',
+            game_version='0.1.0',
+            min_max_card_count=2,
+            loop=loop,
+            services=services
         )
@@ -0,0 +1,116 @@
+import bisect
+import logging
+import threading
+
+from app.settings import LEADERBOARD_SIZE
+from app.utils.time import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Rankings of the leaderboard, by the conservative TrueSkill estimate (mu - 3 sigma) and by the Elo rating
+RANKINGS = ['trueskill', 'elo']
+
+
+def _get_scores(player_statistics):
+    trueskill_rating = player_statistics['trueskill_rating']
+    return {
+        'trueskill': trueskill_rating['mu'] - 3 * trueskill_rating['sigma'],
+        'elo': player_statistics['elo_rating']
+    }
+
+
+class Leaderboard:
+    """
+    The top `size` players of a game, stored in games/<game>/leaderboard so displays can read one small document.
+
+    The scores of all the players are kept in sorted lists, which follow the player statistics the player cache keeps
+    in sync (see PlayerCache.add_player_statistics_listener()), so a finished session only moves the players of the
+    session, and the leaderboard is written (in the update of the session) only when its top changed. Players without
+    games are not ranked.
+    """
+
+    def __init__(self, game_slug, size=LEADERBOARD_SIZE):
+        self.game_slug = game_slug
+        self.size = size
+        self.loaded = False
+        # Slack user ID -> the leaderboard entry of the player (scores and statistics)
+        self.entries = {}
+        # Ranking -> sorted list of (-score, slack_user_id)
+        self.rankings = {ranking: [] for ranking in RANKINGS}
+        # The player statistics stream moves the players while the game finishes sessions
+        self.lock = threading.Lock()
+
+    def get_path(self):
+        return f'games/{self.game_slug}/leaderboard'
+
+    def load(self, player_statistics):
+        """Rank all the player statistics of the game (the games/<game>/player_statistics node)"""
+        with self.lock:
+            self.entries = {}
+            self.rankings = {ranking: [] for ranking in RANKINGS}
+            for slack_user_id, statistics in (player_statistics or {}).items():
+                self._set(slack_user_id, statistics)
+            self.loaded = True
+
+    def set(self, slack_user_id, statistics):
+        """Move a player whose statistics changed, ignored until the leaderboard is loaded"""
+        with self.lock:
+            if self.loaded:
+                self._set(slack_user_id, statistics)
+
+    def unload(self):
+        """Forget the ranking, the player statistics are no longer kept in sync"""
+        with self.lock:
+            self.loaded = False
+            self.entries = {}
+            self.rankings = {ranking: [] for ranking in RANKINGS}
+
+    def _set(self, slack_user_id, statistics):
+        self._remove(slack_user_id)
+        if not statistics or not statistics.get('total_games'):
+            return
+        scores = _get_scores(statistics)
+        self.entries[slack_user_id] = {
+            'slack_user_id': slack_user_id,
+            'trueskill_score': scores['trueskill'],
+            'trueskill_rating': statistics['trueskill_rating'],
+            'elo_rating': statistics['elo_rating'],
+            'total_games': statistics['total_games'],
+            'games_won': statistics['games_won'],
+            'games_lost': statistics['games_lost']
+        }
+        for ranking, score in scores.items():
+            bisect.insort(self.rankings[ranking], (-score, slack_user_id))
+
+    def _remove(self, slack_user_id):
+        entry = self.entries.pop(slack_user_id, None)
+        if entry is None:
+            return
+        for ranking, score in [('trueskill', entry['trueskill_score']), ('elo', entry['elo_rating'])]:
+            ranked = self.rankings[ranking]
+            del ranked[bisect.bisect_left(ranked, (-score, slack_user_id))]
+
+    def get_top(self, ranking):
+        return [self.entries[slack_user_id] for _, slack_user_id in self.rankings[ranking][:self.size]]
+
+    def to_node(self):
+        return {
+            'size': self.size,
+            'updated': utc_now().isoformat(),
+            **{ranking: self.get_top(ranking) for ranking in RANKINGS}
+        }
+
+    def update(self, new_player_statistics):
+        """
+        Move the players of a finished session (Slack user ID -> new player statistics), returns the multi-path update
+        of the leaderboard, which is empty when the top did not change (or the leaderboard is not loaded)
+        """
+        with self.lock:
+            if not self.loaded:
+                return {}
+            top_before = {ranking: self.get_top(ranking) for ranking in RANKINGS}
+            for slack_user_id, statistics in new_player_statistics.items():
+                self._set(slack_user_id, statistics)
+            if all(self.get_top(ranking) == top for ranking, top in top_before.items()):
+                return {}
+            return {self.get_path(): self.to_node()}
@@ -22,8 +22,8 @@ class ConsoleListener(GameListener):
     def on_unregistered_card_read(self, card):
         logger.info(f'Unknown card {card} tried to register for a "{self.game.get_name()}" game')
 
-    def on_register_player(self, player):
-        logger.info(f'{player} has registered for a "{self.game.get_name()}" game')
+    def on_register_player(self, player, player_number):
+        logger.info(f'{player} has registered as player #{player_number} for a "{self.game.get_name()}" game')
 
     def on_already_in_session(self, player, card):
         logger.info(f'Player {player} tried to register card {card} to current session'
@@ -36,11 +36,17 @@ class ConsoleListener(GameListener):
     def on_start_session(self, players):
         logger.info(f'New "{self.game.get_name()}" session started with players: {players}')
 
-    def on_end_session(self, winner_player, winner_new_elo_rating, winner_new_trueskill_rating,
-                       loser_player, loser_new_elo_rating, loser_new_trueskill_rating):
+    def on_end_session(self, winner_players, loser_players, new_elo_ratings, new_trueskill_ratings):
+        def format_players(players):
+            return ', '.join(
+                f'{player} [{new_elo_ratings[player.get_slack_user_id()]}] '
+                f'[{new_trueskill_ratings[player.get_slack_user_id()]}]'
+                for player in players
+            )
+
         logger.info(f'"{self.game.get_name()}" session ended. '
-                    f'Winner: {winner_player} [{winner_new_elo_rating}] [{winner_new_trueskill_rating}]. '
-                    f'Loser: {loser_player} [{loser_new_elo_rating}] [{loser_new_trueskill_rating}]')
+                    f'Winner: {format_players(winner_players)}. '
+                    f'Loser: {format_players(loser_players)}')
 
     def on_session_timeout(self, session):
         logger.info(f'Session time ran out. Starting a new session! Session that ran out: {session}')
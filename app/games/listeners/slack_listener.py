@@ -3,7 +3,7 @@ import logging
 import math
 
 from app.games.game_listener import GameListener
-from app.settings import SLACK_CHANNEL, SLACK_DEV_CHANNEL, SLACK_USERNAME
+from app.settings import SLACK_CHANNEL, SLACK_DEV_CHANNEL
 
 logger = logging.getLogger(__name__)
 
@@ -12,23 +12,9 @@ class SlackListener(GameListener):
     def __init__(self, game):
         super().__init__(game)
 
-    def _send_message_to_slack(self, message, channel=SLACK_CHANNEL, attachments=None):
-        if attachments is not None:
-            result = self.game.slack.chat.post_message(
-                channel=channel,
-                username=SLACK_USERNAME,
-                attachments=attachments
-            )
-        else:
-            result = self.game.slack.chat.post_message(
-                channel=channel,
-                username=SLACK_USERNAME,
-                text=message
-            )
-        if result.successful:
-            logger.info(f'Slack message sent to #{channel}: {message}')
-        else:
-            logger.error(f'Failed sending message to slack: {result}')
+    def _send_message_to_slack(self, message, channel=SLACK_CHANNEL, attachments=None, collapse_key=None):
+        # The outbox sends the message in the background, merged with the other messages of the same burst
+        self.game.slack_outbox.post(channel, message, attachments=attachments, collapse_key=collapse_key)
 
     def on_startup(self):
         self._send_message_to_slack(
@@ -52,9 +38,12 @@ class SlackListener(GameListener):
         self._send_message_to_slack(message=f'{player.to_slack_string()} has registrert et nytt kort: {card.get_uid()}')
 
     def on_unregistered_card_read(self, card):
-        self._send_message_to_slack(message=f'Ukjent kort prøvde å spille: {card.get_uid()}')
+        self._send_message_to_slack(
+            message=f'Ukjent kort prøvde å spille: {card.get_uid()}',
+            collapse_key=f'unregistered_card:{card.get_uid()}'
+        )
 
-    def on_register_player(self, player):
+    def on_register_player(self, player, player_number):
         message = f'*{self.game.game_name}* - Spiller registrerte seg for å spille'
         self._send_message_to_slack(
             message=message,
@@ -65,7 +54,7 @@ class SlackListener(GameListener):
                 'color': '#439FE0',
                 'fields': [
                     {
-                        'title': f'Spiller #{ len(self.game.current_session.get_players()) }',
+                        'title': f'Spiller #{player_number}',
                         'value': f'{player.to_slack_string()}\n'
                                  f'Trueskill Level: {math.floor(player.get_trueskill_rating().mu * 10)}',
                         'short': False
@@ -107,10 +96,16 @@ class SlackListener(GameListener):
             }]
         )
 
-    def on_end_session(self, winner_player, winner_new_elo_rating, winner_new_trueskill_rating,
-                       loser_player, loser_new_elo_rating, loser_new_trueskill_rating):
-        winner_trueskill_delta = math.floor((winner_new_trueskill_rating.mu - winner_player.get_trueskill_rating().mu) * 10)
-        loser_trueskill_delta = math.floor((loser_new_trueskill_rating.mu - loser_player.get_trueskill_rating().mu) * 10)
+    def on_end_session(self, winner_players, loser_players, new_elo_ratings, new_trueskill_ratings):
+        def format_players(players):
+            lines = []
+            for player in players:
+                new_trueskill_rating = new_trueskill_ratings[player.get_slack_user_id()]
+                trueskill_delta = math.floor((new_trueskill_rating.mu - player.get_trueskill_rating().mu) * 10)
+                lines.append(f'{player.to_slack_string()}\n'
+                             f'Ny Trueskill level: {math.floor(new_trueskill_rating.mu * 10)} [{trueskill_delta:+d}]')
+            return '\n'.join(lines)
+
         message = f'*{self.game.game_name}* - Spill ferdig'
         self._send_message_to_slack(
             message=message,
@@ -121,17 +116,13 @@ class SlackListener(GameListener):
                 'color': 'good',
                 'fields': [
                     {
-                        'title': 'Vinner',
-                        'value': f'{winner_player.to_slack_string()}\n'
-                                 f'Ny Trueskill level: {math.floor(winner_new_trueskill_rating.mu * 10)} '
-                                 f'[+{winner_trueskill_delta}]',
+                        'title': 'Vinner' if len(winner_players) == 1 else 'Vinnere',
+                        'value': format_players(winner_players),
                         'short': True
                     },
                     {
-                        'title': 'Taper',
-                        'value': f'{loser_player.to_slack_string()}\n'
-                                 f'Ny Trueskill level: {math.floor(loser_new_trueskill_rating.mu * 10)} '
-                                 f'[{loser_trueskill_delta}]',
+                        'title': 'Taper' if len(loser_players) == 1 else 'Tapere',
+                        'value': format_players(loser_players),
                         'short': True
                     }
                 ]
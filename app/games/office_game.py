@@ -4,37 +4,63 @@ from threading import Event
 
 import pytz
 import dateutil.parser
-from slacker import Slacker
 from slugify import slugify
-from trueskill import Rating, rate_1vs1, quality_1vs1
+import trueskill
+from trueskill import Rating
 
 from app.games.exceptions import CardExists, UnregisteredCardException
+from app.games.game_event_dispatcher import GameEventDispatcher
 from app.games.game_player import GamePlayer
+from app.games.game_services import GameServices
 from app.games.game_session import GameSession
 from app.games.game_thread_timer import GameThreadTimer
+from app.games.game_type import SINGLES, free_for_all
+from app.games.leaderboard import Leaderboard
 from app.games.listeners.console_listener import ConsoleListener
 from app.games.listeners.slack_listener import SlackListener
-from app.settings import (GAME_CARD_REGISTRATION_TIMEOUT, GAME_SESSION_TIME,
-                          GAME_START_TIME_BUFFER, SLACK_MESSAGES_ENABLED, SLACK_TOKEN,
-                          SLACK_DEFAULT_USER_AVATAR_URL)
-from app.utils.elo_rating import calculate_new_rating
-from app.utils.firebase import get_firebase
+from app.games.player_cache import get_player_profile
+from app.games.slack_directory_sync import parse_slack_user
+from app.readers.utils.canonical import get_card_aliases
+from app.settings import (CACHE_STREAMING_ENABLED, GAME_CARD_REGISTRATION_TIMEOUT, GAME_SESSION_TIME,
+                          GAME_START_TIME_BUFFER, SLACK_MESSAGES_ENABLED)
+from app.utils.metrics import metrics
 from app.utils.time import utc_now
 
 logger = logging.getLogger(__name__)
 
+# What a card read by a registered player leads to, see _handle_player_card()
+CARD_IGNORED = 0x00
+CARD_ENDS_SESSION = 0x01
+CARD_JOINS_SESSION = 0x02
+
 
 class OfficeGame:
-    def __init__(self, game_name, game_version, min_max_card_count=2):
+    def __init__(self, game_name, game_version, min_max_card_count=2, services=None, game_type=None):
         self.core_version = '0.2.5'
         self.game_name = game_name
         self.game_version = game_version
         self.game_slug = slugify(game_name)
-        self.game_listeners = []
-        self.firebase = get_firebase()
-        self.min_max_card_count = min_max_card_count
-        self.current_session = GameSession(self.min_max_card_count)
-        self.slack = Slacker(SLACK_TOKEN)
+        self.event_dispatcher = GameEventDispatcher()
+        # Shared with the other games of the process (multi-table mode), or owned by this game
+        self.owns_services = services is None
+        self.services = services or GameServices()
+        self.services.add_game(self.game_slug)
+        self.firebase = self.services.firebase
+        self.player_cache = self.services.player_cache
+        self.journal = self.services.journal
+        self.journal_replayer = self.services.journal_replayer
+        self.slack = self.services.slack
+        self.slack_outbox = self.services.slack_outbox
+        self.slack_directory_sync = self.services.slack_directory_sync
+        if game_type is None:
+            game_type = SINGLES if min_max_card_count == 2 else free_for_all(min_max_card_count)
+        self.game_type = game_type
+        self.min_max_card_count = game_type.get_player_count()
+        self.current_session = GameSession(self.game_type)
+        self.leaderboard = Leaderboard(self.game_slug)
+        # The leaderboard follows the player statistics the cache keeps in sync, it is loaded with their snapshot
+        self.player_cache.add_player_statistics_listener(self.game_slug, self.leaderboard)
+        self.check_leaderboard()
         self.add_game_listener(ConsoleListener(self))
         if SLACK_MESSAGES_ENABLED:
             self.add_game_listener(SlackListener(self))
@@ -54,107 +80,118 @@ class OfficeGame:
         # self.stop_flag.set()
 
         # Send a notification to listeners
-        for game_listener in self.game_listeners:
-            game_listener.on_startup()
+        self.event_dispatcher.dispatch('on_startup')
+
+    def check_leaderboard(self):
+        """Without the streams nothing loads the leaderboard, load it now (called again until it succeeds)"""
+        if CACHE_STREAMING_ENABLED or self.leaderboard.loaded:
+            return
+        try:
+            self.leaderboard.load(self.get_db().child('player_statistics').get().val())
+        except Exception:
+            # Sessions do not move the leaderboard until it is loaded
+            logger.exception('Could not load the leaderboard')
 
     def _get_slack_information(self, slack_user_id):
+        slack_information = self.slack_directory_sync.get_slack_information(slack_user_id)
+        if slack_information is not None:
+            return slack_information
+
+        # The user joined Slack after the last directory sync
         slack_user_response = self.slack.users.info(slack_user_id)
         if slack_user_response is None or not slack_user_response.successful:
             logger.error(slack_user_response.error)
             return
-        slack_profile = slack_user_response.body['user']['profile']
-        if 'image_512' in slack_profile.keys():
-            avatar_url = slack_profile['image_512']
-        elif 'image_192' in slack_profile.keys():
-            avatar_url = slack_profile['image_192']
-        elif 'image_72' in slack_profile.keys():
-            avatar_url = slack_profile['image_72']
-        else:
-            avatar_url = SLACK_DEFAULT_USER_AVATAR_URL
+        return self._parse_slack_user(slack_user_response.body['user'])
 
-        return {
-            'slack_username': slack_user_response.body['user']['name'],
-            'slack_first_name': slack_profile['first_name'],
-            'slack_avatar_url': avatar_url
-        }
+    _parse_slack_user = staticmethod(parse_slack_user)
 
-    def _sync_slack_player(self, game_player):
-        slack_information = self._get_slack_information(game_player.get_slack_user_id())
+    @staticmethod
+    def _apply_slack_information(game_player, slack_information):
+        """Set the Slack information on the GamePlayer object, returns the fields to update on the remote player"""
         game_player.set_slack_username(slack_information['slack_username'])
         game_player.set_slack_first_name(slack_information['slack_first_name'])
         game_player.set_slack_avatar_url(slack_information['slack_avatar_url'])
         game_player.update_slack_last_sync()
-        self.firebase.database().child('players').child(game_player.get_slack_user_id()).update({
+        return {
             'slack_username': game_player.get_slack_username(),
             'slack_first_name': game_player.get_slack_first_name(),
             'slack_avatar_url': game_player.get_slack_avatar_url(),
             'slack_last_sync': game_player.get_slack_last_sync().isoformat()
-        })
-        return game_player
+        }
 
     def _check_pending_card_registration(self, card):
-        pending_registration = self.firebase.database()\
-            .child('pending_registrations')\
-            .child(card.get_uid()) \
-            .get().val()
+        pending_registration = self._get_valid_pending_registration(
+            card,
+            self.player_cache.get_pending_registration(card.get_uid())
+        )
 
         if pending_registration is None:
             return False
 
+        self.register_new_game_card(card, pending_registration['user_id'])
+        self.player_cache.remove_pending_registration(card.get_uid())
+        return True
+
+    def _get_valid_pending_registration(self, card, pending_registration):
+        if pending_registration is None:
+            return None
+
         registration_datetime = datetime.fromtimestamp(
             int(pending_registration['timestamp'] / 1000)
         ).replace(tzinfo=pytz.utc)
 
         if (utc_now() - registration_datetime).total_seconds() > GAME_CARD_REGISTRATION_TIMEOUT:
             # Send a notification to listeners
-            for game_listener in self.game_listeners:
-                game_listener.on_pending_card_registration_timeout(pending_registration, card)
-            return False
+            self.event_dispatcher.dispatch('on_pending_card_registration_timeout', pending_registration, card)
+            return None
 
-        self.register_new_game_card(card, pending_registration['user_id'])
-        self.firebase.database() \
-            .child('pending_registrations') \
-            .child(card.get_uid()) \
-            .remove()
-        return True
+        return pending_registration
 
     def _get_remote_player_information(self, card):
-        existing_card = self.firebase.database().child('cards').child(card.get_uid()).get().val()
+        with metrics.time('tap_stage_seconds', stage='card_lookup'):
+            existing_card = self.player_cache.get_card(card.get_uid())
 
         if existing_card is None or 'slack_user_id' not in existing_card:
             raise UnregisteredCardException(card)
 
+        # The card exists and registered to a player, grab the player and the player statistics from the database
+        slack_user_id = existing_card['slack_user_id']
+        with metrics.time('tap_stage_seconds', stage='player_lookup'):
+            existing_player = self.player_cache.get_player(slack_user_id)
+        with metrics.time('tap_stage_seconds', stage='player_statistics_lookup'):
+            existing_player_statistics = self.player_cache.get_player_statistics(self.game_slug, slack_user_id)
+        game_player = self._create_game_player(card, slack_user_id, existing_player, existing_player_statistics)
+
+        with metrics.time('tap_stage_seconds', stage='slack_information'):
+            self._fill_slack_information(game_player)
+        return game_player
+
+    def _fill_slack_information(self, game_player):
+        """
+        Use the Slack directory for a player that has no Slack information stored (yet), the stored information is
+        kept up to date by the background directory sync, so a card read never calls the Slack API
+        """
+        if game_player.has_slack_information():
+            return
+        slack_information = self.slack_directory_sync.get_slack_information(game_player.get_slack_user_id())
+        if slack_information is not None:
+            self._apply_slack_information(game_player, slack_information)
+
+    def _create_game_player(self, card, slack_user_id, existing_player, existing_player_statistics):
         # Initialize the GamePlayer object
         game_player = GamePlayer(card=card)
-        game_player.set_slack_user_id(existing_card['slack_user_id'])
-
-        # The card exists and registered to a player, grab the player from the database
-        existing_player = self.firebase.database()\
-            .child('players')\
-            .child(game_player.get_slack_user_id())\
-            .get().val()
+        game_player.set_slack_user_id(slack_user_id)
 
-        if 'slack_last_sync' not in existing_player.keys():
-            game_player = self._sync_slack_player(game_player)
-        else:
+        if existing_player is not None and 'slack_last_sync' in existing_player.keys():
             # The player exists in the database, add the relevant information to the GamePlayer object
             last_sync = dateutil.parser.parse(existing_player['slack_last_sync']).replace(tzinfo=pytz.utc)
             game_player.set_slack_last_sync(last_sync)
-
-            # Sync Slack information if needed
-            if game_player.should_sync_slack_information():
-                game_player = self._sync_slack_player(game_player)
-            else:
-                game_player.set_slack_username(existing_player['slack_username'])
-                game_player.set_slack_first_name(existing_player['slack_first_name'])
-                game_player.set_slack_avatar_url(existing_player['slack_avatar_url'])
+            game_player.set_slack_username(existing_player['slack_username'])
+            game_player.set_slack_first_name(existing_player['slack_first_name'])
+            game_player.set_slack_avatar_url(existing_player['slack_avatar_url'])
 
         # Check if the player has statistics in the current game_slug
-        existing_player_statistics = self.get_db() \
-            .child('player_statistics') \
-            .child(game_player.get_slack_user_id()) \
-            .get().val()
-
         if existing_player_statistics is not None:
             # The player has statistics stored in the database, add it to the GamePlayer object
             game_player.set_elo_rating(existing_player_statistics['elo_rating'])
@@ -170,6 +207,10 @@ class OfficeGame:
 
         return game_player
 
+    def _commit(self, updates):
+        """Write a multi-path update to Firebase, through the local journal when it is enabled"""
+        self.services.commit(updates)
+
     def get_db(self):
         return self.firebase.database().child('games').child(self.game_slug)
 
@@ -186,28 +227,40 @@ class OfficeGame:
         return self.game_slug
 
     def add_game_listener(self, listener):
-        self.game_listeners.append(listener)
+        self.event_dispatcher.add_listener(listener)
+
+    def get_game_listeners(self):
+        return self.event_dispatcher.get_listeners()
 
     def get_current_session(self):
         return self.current_session
 
     # Used for administration
     def register_new_game_card(self, card, slack_user_id):
-        existing_card = self.firebase.database().child('cards').child(card.get_uid()).get().val()
+        existing_card_uid, existing_card = self.player_cache.find_card(card.get_uid())
 
         if existing_card is None:
             # Card does not exist, insert the card
-            self.firebase.database().child('cards').child(card.get_uid()).set({
+            new_card = {
                 'slack_user_id': slack_user_id,
                 'registration_date': utc_now().isoformat()
+            }
+            # The other forms of the UID go in the alias index, so every reader finds the card with one read
+            aliases = self._get_free_card_aliases(card)
+            self.firebase.database().update({
+                f'cards/{card.get_uid()}': new_card,
+                **{f'card_aliases/{alias}': card.get_uid() for alias in aliases}
             })
+            self.player_cache.set_card(card.get_uid(), new_card)
+            self.player_cache.set_card_aliases(card.get_uid(), aliases)
         else:
             # Card exists in the database
             if 'slack_user_id' not in existing_card:
                 # Card exists, but is not registered to a player, update the owner (player)
-                self.firebase.database().child('cards').child(card.get_uid()).update({
+                self.firebase.database().child('cards').child(existing_card_uid).update({
                     'slack_user_id': slack_user_id
                 })
+                self.player_cache.set_card(existing_card_uid, {**existing_card, 'slack_user_id': slack_user_id})
             elif existing_card['slack_user_id'] == slack_user_id:
                 # The card is already registered to this Slack user, ignore
                 logger.debug(f'Card {card} is already registered under user ID {slack_user_id}, doing nothing')
@@ -217,7 +270,7 @@ class OfficeGame:
                 raise CardExists(card, existing_card['slack_user_id'])
 
         # Does the player exists in the database?
-        existing_player = self.firebase.database().child('players').child(slack_user_id).get().val()
+        existing_player = self.player_cache.get_player(slack_user_id)
 
         if existing_player is not None:
             # Player exists in the database, just append the card to the player
@@ -258,11 +311,16 @@ class OfficeGame:
                 slack_last_sync=new_player['slack_last_sync']
             )
 
-            # Add the new player to the database, with the card added in the card list
-            self.firebase.database().child('players').child(slack_user_id).set(new_player)
+            # Add the new player to the database, with the card added in the card list, and copy the profile fields
+            # to player_profiles for the player caches
+            self.firebase.database().update({
+                f'players/{slack_user_id}': new_player,
+                f'player_profiles/{slack_user_id}': get_player_profile(new_player)
+            })
+            self.player_cache.set_player(slack_user_id, new_player)
 
             # Add the player to the player statistics of the current game_slug
-            self.get_db().child('player_statistics').child(slack_user_id).set({
+            new_player_statistics = {
                 'trueskill_rating': {
                     'mu': Rating().mu,
                     'sigma': Rating().sigma,
@@ -272,241 +330,304 @@ class OfficeGame:
                 'games_won': 0,
                 'games_lost': 0,
                 'seconds_played': 0
-            })
+            }
+            self.get_db().child('player_statistics').child(slack_user_id).set(new_player_statistics)
+            self.player_cache.set_player_statistics(self.game_slug, slack_user_id, new_player_statistics)
 
         # Send a notification to listeners
-        for game_listener in self.game_listeners:
-            game_listener.on_new_card_registration(player, card)
+        self.event_dispatcher.dispatch('on_new_card_registration', player, card)
+
+    def _get_free_card_aliases(self, card):
+        """
+        The aliases of the card that are neither another card nor the alias of another card (the same as
+        index_card_aliases, a read of those is left to the card it already resolves to)
+        """
+        aliases = []
+        for alias in get_card_aliases(card):
+            if self.player_cache.get_registered_card(alias) is not None:
+                continue
+            canonical_uid = self.firebase.database().child('card_aliases').child(alias).get().val()
+            if canonical_uid is not None and canonical_uid != card.get_uid():
+                continue
+            aliases.append(alias)
+        return aliases
 
     def start_session(self):
-        self.get_current_session().start()
-
-        session_players = self.get_current_session().get_players()
-
         # Set the start time of the current session in remote
-        self.get_db().child('current_session').update({
-            'session_started': self.get_current_session().start_time.isoformat(),
-            'trueskill_quality': quality_1vs1(
-                session_players[0].get_trueskill_rating(),
-                session_players[1].get_trueskill_rating()
-            )
-        })
+        self._commit(self._begin_session())
 
         # Send a notification to listeners
-        for game_listener in self.game_listeners:
-            game_listener.on_start_session(self.get_current_session().get_players())
+        self.event_dispatcher.dispatch('on_start_session', list(self.get_current_session().get_players()))
+
+    def _begin_session(self):
+        """Start the local session, returns the multi-path update of the remote current session"""
+        self.get_current_session().start()
+
+        rating_groups = [
+            [player.get_trueskill_rating() for player in team] for team in self.get_current_session().get_teams()
+        ]
+
+        current_session_path = f'games/{self.game_slug}/current_session'
+        return {
+            f'{current_session_path}/session_started': self.get_current_session().start_time.isoformat(),
+            f'{current_session_path}/trueskill_quality': trueskill.quality(rating_groups)
+        }
 
     def end_session(self, winner_player):
+        with metrics.time('tap_stage_seconds', stage='end_session'):
+            session_updates, new_player_statistics, end_session_event = self._finish_session(winner_player)
+
+            # Write the session, the player sessions and statistics and the current session reset in one atomic update
+            with metrics.time('tap_stage_seconds', stage='end_session_commit'):
+                self._commit(session_updates)
+
+            self._session_finished(new_player_statistics, end_session_event)
+
+    def _finish_session(self, winner_player):
+        """
+        Calculate the results of the current session, the team of winner_player wins.
+
+        Returns the multi-path update that stores the results in Firebase, the new player statistics and the
+        arguments of the on_end_session event.
+        """
         end_time = utc_now()
-        all_players = self.get_current_session().get_players().copy()
+        session = self.get_current_session()
+        teams = session.get_teams()
+        winner_team = session.get_team_index(winner_player)
+
+        # Calculate the new ratings of all the players at once
+        with metrics.time('tap_stage_seconds', stage='rating'):
+            quality, new_teams = self.game_type.rate(
+                [[(player.get_elo_rating(), player.get_trueskill_rating()) for player in team] for team in teams],
+                winner_team
+            )
 
-        # Remove the winner from the player list and return the first player (loser for now)
-        self.get_current_session().remove_player(winner_player)
-        loser_player = self.get_current_session().get_player(0)
+        session_seconds = (end_time - session.start_time).total_seconds()
 
-        # Calculate the players new rating
-        winner_elo_rating = calculate_new_rating(
-            player_rating=winner_player.get_elo_rating(),
-            opponent_rating=loser_player.get_elo_rating(),
-            player_won=True
-        )
-        loser_elo_rating = calculate_new_rating(
-            player_rating=loser_player.get_elo_rating(),
-            opponent_rating=winner_player.get_elo_rating(),
-            player_won=False
-        )
+        # Generate the key of the session on the client, so that everything can be written in one update
+        session_key = self.firebase.database().generate_key()
+        game_path = f'games/{self.game_slug}'
 
-        winner_trueskill_rating, loser_trueskill_rating = rate_1vs1(
-            winner_player.get_trueskill_rating(),
-            loser_player.get_trueskill_rating()
-        )
+        results = []
+        for team_index, (team, new_team) in enumerate(zip(teams, new_teams)):
+            for player, (new_elo_rating, new_trueskill_rating) in zip(team, new_team):
+                results.append((player, team_index, team_index == winner_team, new_elo_rating, new_trueskill_rating))
 
-        # Push the current session (which has ended) to the list of sessions in Firebase
-        results = self.get_db().child('sessions').push({
-            'session_started': self.get_current_session().start_time.isoformat(),
+        # Add the current session (which has ended) to the list of sessions in Firebase
+        stored_session = {
+            'session_started': session.start_time.isoformat(),
             'session_ended': end_time.isoformat(),
-            'session_seconds': (end_time - self.get_current_session().start_time).total_seconds(),
-            'trueskill_quality': quality_1vs1(
-                winner_player.get_trueskill_rating(),
-                loser_player.get_trueskill_rating()
-            ),
-            'winner': {
-                'slack_user_id': winner_player.get_slack_user_id(),
-                'trueskill_rating': {
-                    'mu': {
-                        'before': winner_player.get_trueskill_rating().mu,
-                        'after': winner_trueskill_rating.mu,
-                        'delta': winner_trueskill_rating.mu - winner_player.get_trueskill_rating().mu
-                    },
-                    'sigma': {
-                        'before': winner_player.get_trueskill_rating().sigma,
-                        'after': winner_trueskill_rating.sigma,
-                        'delta': winner_trueskill_rating.sigma - winner_player.get_trueskill_rating().sigma
-                    }
-                },
-                'elo_rating': {
-                    'before': winner_player.get_elo_rating(),
-                    'after': winner_elo_rating,
-                    'delta': winner_elo_rating - winner_player.get_elo_rating()
+            'session_seconds': session_seconds,
+            'trueskill_quality': quality
+        }
+        if self.game_type is SINGLES:
+            # One winner and one loser, the format the sessions have always been stored in
+            for player, team_index, is_winner, new_elo_rating, new_trueskill_rating in results:
+                stored_session['winner' if is_winner else 'loser'] = {
+                    'slack_user_id': player.get_slack_user_id(),
+                    **self._get_session_result(player, new_elo_rating, new_trueskill_rating)
                 }
-            },
-            'loser': {
-                'slack_user_id': loser_player.get_slack_user_id(),
+        else:
+            stored_session['game_type'] = self.game_type.name
+            stored_session['winners'] = {}
+            stored_session['losers'] = {}
+            for player, team_index, is_winner, new_elo_rating, new_trueskill_rating in results:
+                stored_session['winners' if is_winner else 'losers'][player.get_slack_user_id()] = {
+                    'team': team_index,
+                    **self._get_session_result(player, new_elo_rating, new_trueskill_rating)
+                }
+        session_updates = {f'{game_path}/sessions/{session_key}': stored_session}
+
+        # Add the session id/pk to the list of sessions for each player and update their statistics
+        new_player_statistics = {}
+        for player, team_index, is_winner, new_elo_rating, new_trueskill_rating in results:
+            session_updates[f'players/{player.get_slack_user_id()}/sessions/{self.game_slug}/{session_key}'] = {
+                'card_uid': player.get_card().get_uid(),
+                'winner': is_winner,
+                'elo_rating': {
+                    'new': new_elo_rating,
+                    'delta': new_elo_rating - player.get_elo_rating()
+                },
                 'trueskill_rating': {
                     'mu': {
-                        'before': loser_player.get_trueskill_rating().mu,
-                        'after': loser_trueskill_rating.mu,
-                        'delta': loser_trueskill_rating.mu - loser_player.get_trueskill_rating().mu
+                        'new': new_trueskill_rating.mu,
+                        'delta': new_trueskill_rating.mu - player.get_trueskill_rating().mu
                     },
                     'sigma': {
-                        'before': loser_player.get_trueskill_rating().sigma,
-                        'after': loser_trueskill_rating.sigma,
-                        'delta': loser_trueskill_rating.sigma - loser_player.get_trueskill_rating().sigma
+                        'new': new_trueskill_rating.sigma,
+                        'delta': new_trueskill_rating.sigma - player.get_trueskill_rating().sigma
                     }
-                },
-                'elo_rating': {
-                    'before': loser_player.get_elo_rating(),
-                    'after': loser_elo_rating,
-                    'delta': loser_elo_rating - loser_player.get_elo_rating()
                 }
             }
-        })
-
-        # Push the current session id/pk to the list of sessions for each card
-        for player in all_players:
-            if player.get_card().get_uid() == winner_player.get_card().get_uid():
-                is_winner = True
-                new_elo_rating = winner_elo_rating
-                new_trueskill_rating = winner_trueskill_rating
-            else:
-                is_winner = False
-                new_elo_rating = loser_elo_rating
-                new_trueskill_rating = loser_trueskill_rating
-            self.firebase.database()\
-                .child('players')\
-                .child(player.get_slack_user_id())\
-                .child('sessions')\
-                .child(self.game_slug)\
-                .child(results['name'])\
-                .set({
-                    'card_uid': player.get_card().get_uid(),
-                    'winner': is_winner,
-                    'elo_rating': {
-                        'new': new_elo_rating,
-                        'delta': new_elo_rating - player.get_elo_rating()
-                    },
-                    'trueskill_rating': {
-                        'mu': {
-                            'new': new_trueskill_rating.mu,
-                            'delta': new_trueskill_rating.mu - player.get_trueskill_rating().mu
-                        },
-                        'sigma': {
-                            'new': new_trueskill_rating.sigma,
-                            'delta': new_trueskill_rating.sigma - player.get_trueskill_rating().sigma
-                        }
-                    }
-                })
-
-            existing_player_statistics = self.get_db()\
-                .child('player_statistics')\
-                .child(player.get_slack_user_id())\
-                .get().val()
 
-            # Set the player statistics
-            self.get_db().child('player_statistics').child(player.get_slack_user_id()).set({
+            # Set the player statistics, based on the statistics fetched when the player registered
+            new_player_statistics[player.get_slack_user_id()] = {
                 'elo_rating': new_elo_rating,
                 'trueskill_rating': {
                     'mu': new_trueskill_rating.mu,
                     'sigma': new_trueskill_rating.sigma
                 },
-                'total_games': existing_player_statistics['total_games'] + 1,
-                'games_won': existing_player_statistics['games_won'] + (1 if is_winner else 0),
-                'games_lost': existing_player_statistics['games_lost'] + (1 if not is_winner else 0),
-                'seconds_played': existing_player_statistics['seconds_played'] + (
-                    end_time - self.get_current_session().start_time).total_seconds()
-            })
+                'total_games': player.get_total_games() + 1,
+                'games_won': player.get_games_won() + (1 if is_winner else 0),
+                'games_lost': player.get_games_lost() + (1 if not is_winner else 0),
+                'seconds_played': player.get_seconds_played() + session_seconds
+            }
+            session_updates[f'{game_path}/player_statistics/{player.get_slack_user_id()}'] = \
+                new_player_statistics[player.get_slack_user_id()]
+
+        # Move the players on the leaderboard, it is written with the session when its top changed
+        session_updates.update(self.leaderboard.update(new_player_statistics))
+
+        # Reset / remove the remote session
+        session_updates[f'{game_path}/current_session'] = None
+
+        end_session_event = {
+            'winner_players': [player for player, _, is_winner, _, _ in results if is_winner],
+            'loser_players': [player for player, _, is_winner, _, _ in results if not is_winner],
+            'new_elo_ratings': {player.get_slack_user_id(): elo_rating for player, _, _, elo_rating, _ in results},
+            'new_trueskill_ratings': {
+                player.get_slack_user_id(): trueskill_rating for player, _, _, _, trueskill_rating in results
+            }
+        }
+
+        return session_updates, new_player_statistics, end_session_event
+
+    @staticmethod
+    def _get_session_result(player, new_elo_rating, new_trueskill_rating):
+        """The ratings of a player before and after a session, as stored in the session"""
+        return {
+            'trueskill_rating': {
+                'mu': {
+                    'before': player.get_trueskill_rating().mu,
+                    'after': new_trueskill_rating.mu,
+                    'delta': new_trueskill_rating.mu - player.get_trueskill_rating().mu
+                },
+                'sigma': {
+                    'before': player.get_trueskill_rating().sigma,
+                    'after': new_trueskill_rating.sigma,
+                    'delta': new_trueskill_rating.sigma - player.get_trueskill_rating().sigma
+                }
+            },
+            'elo_rating': {
+                'before': player.get_elo_rating(),
+                'after': new_elo_rating,
+                'delta': new_elo_rating - player.get_elo_rating()
+            }
+        }
+
+    def _session_finished(self, new_player_statistics, end_session_event):
+        for slack_user_id, player_statistics in new_player_statistics.items():
+            self.player_cache.set_player_statistics(self.game_slug, slack_user_id, player_statistics)
 
         # Send a notification to listeners
-        for game_listener in self.game_listeners:
-            game_listener.on_end_session(
-                winner_player=winner_player,
-                winner_new_elo_rating=winner_elo_rating,
-                winner_new_trueskill_rating=winner_trueskill_rating,
-                loser_player=loser_player,
-                loser_new_elo_rating=loser_elo_rating,
-                loser_new_trueskill_rating=loser_trueskill_rating
-            )
+        self.event_dispatcher.dispatch('on_end_session', **end_session_event)
 
         # Create a new session placeholder (it doesn't start until we call .start())
-        self.current_session = GameSession(self.min_max_card_count)
-
-        # Reset / remove the remote session
-        self.get_db().child('current_session').remove()
+        self.current_session = GameSession(self.game_type)
 
     def get_seconds_left(self):
         return GAME_SESSION_TIME - self.get_current_session().get_seconds_elapsed()
 
     def register_card(self, card):
-        if self._check_pending_card_registration(card):
+        with metrics.time('tap_stage_seconds', stage='register_card'):
+            self._register_card(card)
+
+    def _register_card(self, card):
+        with metrics.time('tap_stage_seconds', stage='pending_registration'):
+            is_pending_registration = self._check_pending_card_registration(card)
+        if is_pending_registration:
+            metrics.increment('card_reads_total', result='pending_registration')
             return
         try:
-            reset_session = False
             player = self._get_remote_player_information(card)
-            if self.get_current_session().has_all_needed_players():
-                if self.get_current_session().is_session_card(card):
-                    # Let's make sure we have a buffer, so that nobody wins by "accident"
-                    if self.get_current_session().get_seconds_elapsed() <= GAME_START_TIME_BUFFER:
-                        return
-                    # We have a winner! End the session and register the winner
-                    self.end_session(self.get_current_session().get_player_by_card(card))
-                    return
-                elif self.get_seconds_left() > 0:
-                    # A new card tried to register whilst there was an active sessions
-                    # Send a notification to listeners
-                    for game_listener in self.game_listeners:
-                        game_listener.on_existing_active_session(player, card)
-                    return
-                else:
-                    # We have a new card, create a new session
-                    reset_session = True
-            elif self.get_current_session().should_reset():
-                reset_session = True
-            elif self.get_current_session().is_session_card(card) \
-                    or self.get_current_session().is_session_player(player):
-                # The player / card already exists in the session
-                # Send a notification to listeners
-                for game_listener in self.game_listeners:
-                    game_listener.on_already_in_session(player, card)
-                return
-
-            if reset_session:
-                # Send a notification to listeners
-                for game_listener in self.game_listeners:
-                    game_listener.on_session_timeout(self.get_current_session())
-                self.current_session = GameSession(self.min_max_card_count)
-
-            # Add player to the session
-            self.get_current_session().add_player(player)
+            card_action = self._handle_player_card(card, player)
+            if card_action == CARD_ENDS_SESSION:
+                metrics.increment('card_reads_total', result='ends_session')
+                # We have a winner! End the session and register the winner
+                self.end_session(self.get_current_session().get_player_by_card(card))
+            elif card_action == CARD_JOINS_SESSION:
+                metrics.increment('card_reads_total', result='joins_session')
+                # Update the current session in Firebase as well
+                with metrics.time('tap_stage_seconds', stage='join_session'):
+                    self._commit({
+                        f'games/{self.game_slug}/current_session': {
+                            'players': self.get_current_session().get_players_simplified()
+                        }
+                    })
 
-            # Update the current session in Firebase as well
-            self.get_db().child('current_session').set({
-                'players': self.get_current_session().get_players_simplified()
-            })
+                    self._player_joined(player)
 
+                if self.get_current_session().has_all_needed_players():
+                    # We have all the players/cards needed to start the game. Start the actual session
+                    with metrics.time('tap_stage_seconds', stage='start_session'):
+                        self.start_session()
+            else:
+                metrics.increment('card_reads_total', result='ignored')
+        except UnregisteredCardException:
+            metrics.increment('card_reads_total', result='unregistered')
+            # Send a notification to listeners
+            self.event_dispatcher.dispatch('on_unregistered_card_read', card)
+        finally:
+            logger.debug(f'Listener statistics: {self.event_dispatcher.get_stats()}')
+            self.services.log_stats()
+
+    def _handle_player_card(self, card, player):
+        """Apply a card read by a registered player to the local session, returns what the card leads to"""
+        reset_session = False
+        if self.get_current_session().has_all_needed_players():
+            if self.get_current_session().is_session_card(card):
+                # Let's make sure we have a buffer, so that nobody wins by "accident"
+                if self.get_current_session().get_seconds_elapsed() <= GAME_START_TIME_BUFFER:
+                    return CARD_IGNORED
+                return CARD_ENDS_SESSION
+            elif self.get_seconds_left() > 0:
+                # A new card tried to register whilst there was an active sessions
+                # Send a notification to listeners
+                self.event_dispatcher.dispatch('on_existing_active_session', player, card)
+                return CARD_IGNORED
+            else:
+                # We have a new card, create a new session
+                reset_session = True
+        elif self.get_current_session().should_reset():
+            reset_session = True
+        elif self.get_current_session().is_session_card(card) \
+                or self.get_current_session().is_session_player(player):
+            # The player / card already exists in the session
             # Send a notification to listeners
-            for game_listener in self.game_listeners:
-                game_listener.on_register_player(player)
+            self.event_dispatcher.dispatch('on_already_in_session', player, card)
+            return CARD_IGNORED
 
-            if self.get_current_session().has_all_needed_players():
-                # We have all the players/cards needed to start the game. Start the actual session
-                self.start_session()
-        except UnregisteredCardException:
+        if reset_session:
             # Send a notification to listeners
-            for game_listener in self.game_listeners:
-                game_listener.on_unregistered_card_read(card)
+            self.event_dispatcher.dispatch('on_session_timeout', self.get_current_session())
+            self.current_session = GameSession(self.game_type)
+
+        # Add player to the session
+        self.get_current_session().add_player(player)
+        return CARD_JOINS_SESSION
+
+    def _player_joined(self, player):
+        # Send a notification to listeners
+        self.event_dispatcher.dispatch(
+            'on_register_player',
+            player,
+            len(self.get_current_session().get_players())
+        )
 
     def get_current_remote_session(self):
         return self.get_db().child('current_session').get().val()
 
     def has_current_remote_session(self):
         return self.get_current_remote_session() is not None
+
+    def remove_current_remote_session(self):
+        self._commit({f'games/{self.game_slug}/current_session': None})
+
+    def stop(self):
+        """Stop the game timer and deliver the pending listener events, then stop the services if the game owns them"""
+        self.stop_flag.set()
+        self.game_timer.join()
+        self.event_dispatcher.stop()
+        # After the listeners, so that their last messages are sent
+        if self.owns_services:
+            self.services.stop()
@@ -0,0 +1,604 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.settings import CACHE_MAX_SIZE, CACHE_STREAMING_ENABLED, CACHE_TTL, CACHE_WARM_UP_WORKERS
+from app.utils.ttl_cache import TTLCache, get_deep_size
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the thread of a closed stream to finish
+STREAM_CLOSE_TIMEOUT = 5.0
+
+# Fields of a player that are copied to player_profiles/<slack user ID>, the node the cache reads and streams (the
+# cards and the sessions of players/<slack user ID> grow with every game played)
+PLAYER_PROFILE_FIELDS = ['slack_username', 'slack_first_name', 'slack_avatar_url', 'slack_last_sync',
+                         'registration_date']
+
+
+def get_player_profile(player):
+    """Returns the profile fields of a player (None stays None)"""
+    if not isinstance(player, dict):
+        return player
+    return {field: value for field, value in player.items() if field in PLAYER_PROFILE_FIELDS}
+
+
+def _set_nested(value, keys, data):
+    """Returns a copy of `value` where `data` is set at the path `keys`, the original value is left untouched"""
+    value = dict(value) if isinstance(value, dict) else {}
+    if len(keys) == 1:
+        if data is None:
+            value.pop(keys[0], None)
+        else:
+            value[keys[0]] = data
+    else:
+        value[keys[0]] = _set_nested(value.get(keys[0]), keys[1:], data)
+    return value
+
+
+def _split_cached_path(path):
+    """Returns the cached node, the child and the keys below the child of a written path, None if it is not cached"""
+    keys = [key for key in path.split('/') if key]
+    if len(keys) >= 2 and keys[0] in ('cards', 'player_profiles'):
+        return keys[0], keys[1], keys[2:]
+    if len(keys) >= 4 and keys[0] == 'games' and keys[2] == 'player_statistics':
+        return '/'.join(keys[:3]), keys[3], keys[4:]
+    return None
+
+
+class PendingWrites:
+    """
+    The writes to the cached nodes of the journal entries that have not reached Firebase yet. Firebase (a stream
+    snapshot after an outage, or a read on a miss) does not have them, so they are laid over every value the cache
+    stores, e.g. the statistics of a game played offline are not lost when the next game starts from the streamed ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Node path -> child -> list of (entry ID, keys below the child, value), in the order of the journal
+        self.writes = {}
+        # The journal is replayed in order, every entry up to this ID has been replayed (or given up on)
+        self.done_entry_id = 0
+
+    def add(self, entry_id, updates):
+        with self.lock:
+            if entry_id <= self.done_entry_id:
+                return
+            for path, value in updates.items():
+                cached_path = _split_cached_path(path)
+                if cached_path is not None:
+                    node_path, key, keys = cached_path
+                    self.writes.setdefault(node_path, {}).setdefault(key, []).append((entry_id, keys, value))
+
+    def remove(self, entry_id):
+        """The entry (and so every entry before it) has been replayed or given up on"""
+        with self.lock:
+            self.done_entry_id = max(self.done_entry_id, entry_id)
+            for node_path, children in list(self.writes.items()):
+                for key, writes in list(children.items()):
+                    writes = [write for write in writes if write[0] > self.done_entry_id]
+                    if writes:
+                        children[key] = writes
+                    else:
+                        del children[key]
+                if not children:
+                    del self.writes[node_path]
+
+    def get_keys(self, node_path):
+        with self.lock:
+            return list(self.writes.get(node_path, {}))
+
+    def apply(self, node_path, key, value):
+        """Returns the value of a child read from Firebase, with the pending writes to it applied"""
+        with self.lock:
+            writes = list(self.writes.get(node_path, {}).get(key, []))
+        for _, keys, data in writes:
+            value = _set_nested(value, keys, data) if keys else data
+        return value
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(writes) for children in self.writes.values() for writes in children.values())
+
+
+class CachedNode:
+    """
+    The cached children of one Firebase node. Children read one at a time are kept in a TTLCache, a complete copy of
+    the node (the snapshot of its stream or a bulk read) is kept in a dict that does not expire, the stream keeps it
+    up to date until clear() drops it. The pending writes of the journal are applied to everything that is stored.
+    """
+
+    def __init__(self, max_size, ttl, path, pending_writes):
+        self.path = path
+        self.pending_writes = pending_writes
+        self.cache = TTLCache(max_size, ttl)
+        # Key -> value of every child of the node, None while the node is not loaded as a whole
+        self.index = None
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        index = self.index
+        return len(index) if index is not None else len(self.cache)
+
+    def __repr__(self):
+        return f'<CachedNode complete={self.is_complete()} cache={self.cache} hits={self.hits} misses={self.misses}>'
+
+    def is_complete(self):
+        return self.index is not None
+
+    def get(self, key):
+        index = self.index
+        if index is None:
+            return self.cache.get(key)
+        value = index.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def peek(self, key):
+        """Same as get(), but does not touch the hit/miss counters"""
+        index = self.index
+        return index.get(key) if index is not None else self.cache.peek(key)
+
+    def add_listener(self, listener):
+        """
+        The listener follows the complete copy of the node: its load(children) is called when the node is loaded as a
+        whole (right away if it already is), set(key, value) when a child changes and unload() when the copy is dropped
+        """
+        with self.lock:
+            self.listeners.append(listener)
+            if self.index is not None:
+                listener.load(self.index)
+
+    def set(self, key, value):
+        """Store a child, returns the value that is stored (with the pending writes applied)"""
+        with self.lock:
+            value = self.pending_writes.apply(self.path, key, value)
+            if self.index is None:
+                self.cache.set(key, value)
+            elif value is None:
+                self.index.pop(key, None)
+            else:
+                self.index[key] = value
+            for listener in self.listeners:
+                listener.set(key, value)
+            return value
+
+    def load(self, values):
+        """Replace the cached children with all the children of the node"""
+        with self.lock:
+            values = dict(values or {})
+            for key in self.pending_writes.get_keys(self.path):
+                values.setdefault(key, None)
+            values = {key: self.pending_writes.apply(self.path, key, value) for key, value in values.items()}
+            self.index = {key: value for key, value in values.items() if value is not None}
+            self.cache.clear()
+            for listener in self.listeners:
+                listener.load(self.index)
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+            self.cache.clear()
+            for listener in self.listeners:
+                listener.unload()
+
+    def get_memory_usage(self):
+        """Approximate amount of bytes used by the cached keys and values (walks every entry, do not call per read)"""
+        index = self.index
+        if index is None:
+            return self.cache.get_memory_usage()
+        return sum(get_deep_size(key) + get_deep_size(value) for key, value in list(index.items()))
+
+    def get_stats(self):
+        cache_stats = self.cache.get_stats()
+        return {
+            **cache_stats,
+            'size': len(self),
+            'complete': self.is_complete(),
+            'hits': cache_stats['hits'] + self.hits,
+            'misses': cache_stats['misses'] + self.misses
+        }
+
+
+class PlayerCache:
+    """
+    Local cache of cards, players and player statistics, keyed by card UID and Slack user ID.
+
+    Lookups are served from memory when possible and fall back to Firebase on a miss. The cache is kept up to date
+    by subscribing to the Firebase streams of the cached nodes, so a card read from a known player does not need any
+    network round trips. The players are read from player_profiles, which holds their profile fields only.
+    """
+
+    def __init__(self, firebase, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.firebase = firebase
+        self.max_size = max_size
+        self.ttl = ttl
+        self.pending_writes = PendingWrites()
+        self.cards = CachedNode(max_size, ttl, 'cards', self.pending_writes)
+        # Alias -> canonical card UID (see app.readers.utils.canonical), a complete mirror of card_aliases
+        self.card_aliases = {}
+        self.card_aliases_synced = False
+        self.players = CachedNode(max_size, ttl, 'player_profiles', self.pending_writes)
+        self.player_statistics = {}
+        # Pending registrations are few, so the stream keeps a complete mirror of them instead of a bounded cache
+        self.pending_registrations = {}
+        self.pending_registrations_synced = False
+        self.pending_registrations_hits = 0
+        self.pending_registrations_misses = 0
+        self.streams = []
+        self.watched_game_slugs = set()
+        self.warm_up_stats = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<PlayerCache cards={self.cards} players={self.players} ' \
+               f'player_statistics={self.player_statistics}>'
+
+    def _get_player_statistics_cache(self, game_slug):
+        with self.lock:
+            if game_slug not in self.player_statistics:
+                self.player_statistics[game_slug] = CachedNode(
+                    self.max_size,
+                    self.ttl,
+                    f'games/{game_slug}/player_statistics',
+                    self.pending_writes
+                )
+            return self.player_statistics[game_slug]
+
+    def watch(self, game_slug=None):
+        """Subscribe to the Firebase streams of the cached nodes (and the player statistics of game_slug)"""
+        if not CACHE_STREAMING_ENABLED:
+            return
+        with self.lock:
+            if not self.streams:
+                self._start_stream(['pending_registrations'], self._handle_pending_registrations_message)
+                self._start_stream(['cards'], self._stream_handler(self.cards))
+                self._start_stream(['card_aliases'], self._handle_card_aliases_message)
+                self._start_stream(['player_profiles'], self._stream_handler(self.players))
+            should_watch_game = game_slug is not None and game_slug not in self.watched_game_slugs
+            if should_watch_game:
+                self.watched_game_slugs.add(game_slug)
+        if should_watch_game:
+            self._start_stream(
+                ['games', game_slug, 'player_statistics'],
+                self._stream_handler(self._get_player_statistics_cache(game_slug))
+            )
+
+    def warm_up(self, game_slug, workers=CACHE_WARM_UP_WORKERS, load_shared=True):
+        """
+        Bulk load the cards, the player profiles and the player statistics of game_slug, so that the first card read
+        of a player does not have to wait for Firebase. Every node is fetched with one read, in parallel. With
+        load_shared=False only the player statistics are loaded, the cards and players came with another game.
+        """
+        started = time.monotonic()
+
+        def load_node(node, path):
+            self._load_node(node, self.firebase.database().child(*path).get().val())
+
+        def load_card_aliases():
+            card_aliases = self.firebase.database().child('card_aliases').get().val()
+            with self.lock:
+                if not self.card_aliases_synced:
+                    # Only the stream keeps the mirror up to date (a snapshot it already sent is at least as recent)
+                    self.card_aliases = dict(card_aliases or {})
+                    self.card_aliases_synced = CACHE_STREAMING_ENABLED
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(
+                load_node,
+                self._get_player_statistics_cache(game_slug),
+                ['games', game_slug, 'player_statistics']
+            )]
+            if load_shared:
+                futures.append(executor.submit(load_node, self.cards, ['cards']))
+                futures.append(executor.submit(load_node, self.players, ['player_profiles']))
+                futures.append(executor.submit(load_card_aliases))
+            for future in futures:
+                future.result()
+
+        player_statistics_cache = self._get_player_statistics_cache(game_slug)
+        self.warm_up_stats = {
+            'seconds': time.monotonic() - started,
+            'cards': len(self.cards),
+            'card_aliases': len(self.card_aliases),
+            'players': len(self.players),
+            'player_statistics': len(player_statistics_cache),
+            'memory_bytes': self.cards.get_memory_usage() + self.players.get_memory_usage() +
+            player_statistics_cache.get_memory_usage()
+        }
+        logger.info(f'Warmed up the player cache: {self.warm_up_stats}')
+        return self.warm_up_stats
+
+    @staticmethod
+    def _load_node(node, values):
+        if not CACHE_STREAMING_ENABLED:
+            # Nothing would keep a complete copy up to date, the children expire like the ones read one at a time
+            for key, value in (values or {}).items():
+                node.set(key, value)
+        elif not node.is_complete():
+            # The stream keeps the copy up to date (a snapshot it already sent is at least as recent)
+            node.load(values)
+
+    def close(self):
+        """Close all the Firebase streams, the complete copies of the nodes are dropped as nothing updates them"""
+        with self.lock:
+            streams, self.streams = self.streams, []
+            self.watched_game_slugs = set()
+            self.pending_registrations_synced = False
+            self.card_aliases_synced = False
+            nodes = [self.cards, self.players] + list(self.player_statistics.values())
+        for node in nodes:
+            node.clear()
+        for stream in streams:
+            try:
+                stream.close()
+            except AttributeError:
+                # pyrebase shuts the socket down before closing it, the stream thread may have closed it in between
+                pass
+            except Exception:
+                logger.exception(f'Could not close Firebase stream {stream}')
+            # close() only waits for the thread when it succeeds
+            stream.thread.join(STREAM_CLOSE_TIMEOUT)
+
+    def _start_stream(self, path, handler):
+        def safe_handler(message):
+            try:
+                handler(message)
+            except Exception:
+                logger.exception(f'Could not apply Firebase stream message for {"/".join(path)}: {message}')
+
+        self.streams.append(self.firebase.database().child(*path).stream(safe_handler))
+
+    def _stream_handler(self, node):
+        def handler(message):
+            event = message.get('event')
+            if event in ('cancel', 'auth_revoked'):
+                # We will no longer receive updates, the cached values can not be trusted
+                node.clear()
+                return
+            if event not in ('put', 'patch'):
+                return
+
+            keys = [key for key in message['path'].split('/') if key]
+            data = message['data']
+            if not keys:
+                if event == 'put':
+                    # The snapshot of the whole node, sent when the stream (re)connects
+                    node.load(data)
+                else:
+                    for key, value in (data or {}).items():
+                        node.set(key, value)
+            elif len(keys) == 1:
+                if event == 'put':
+                    node.set(keys[0], data)
+                else:
+                    existing = node.peek(keys[0])
+                    if existing is not None:
+                        for child_key, child in data.items():
+                            existing = _set_nested(existing, [child_key], child)
+                        node.set(keys[0], existing)
+            else:
+                # A nested change, only apply it if the parent is already cached
+                existing = node.peek(keys[0])
+                if existing is not None:
+                    if event == 'put':
+                        existing = _set_nested(existing, keys[1:], data)
+                    else:
+                        for child_key, child in data.items():
+                            existing = _set_nested(existing, keys[1:] + [child_key], child)
+                    node.set(keys[0], existing)
+        return handler
+
+    def _handle_pending_registrations_message(self, message):
+        event = message.get('event')
+        if event in ('cancel', 'auth_revoked'):
+            self.pending_registrations_synced = False
+            return
+        if event not in ('put', 'patch'):
+            return
+
+        keys = [key for key in message['path'].split('/') if key]
+        data = message['data']
+        with self.lock:
+            if not keys:
+                if event == 'put':
+                    self.pending_registrations = {}
+                    self.pending_registrations_synced = True
+                for card_uid, pending_registration in (data or {}).items():
+                    self._set_pending_registration(card_uid, pending_registration)
+            elif len(keys) == 1 and event == 'put':
+                self._set_pending_registration(keys[0], data)
+            else:
+                existing = self.pending_registrations.get(keys[0])
+                if event == 'put':
+                    existing = _set_nested(existing, keys[1:], data)
+                else:
+                    for child_key, child in data.items():
+                        existing = _set_nested(existing, keys[1:] + [child_key], child)
+                self._set_pending_registration(keys[0], existing)
+
+    def _handle_card_aliases_message(self, message):
+        event = message.get('event')
+        if event in ('cancel', 'auth_revoked'):
+            self.card_aliases_synced = False
+            return
+        if event not in ('put', 'patch'):
+            return
+
+        keys = [key for key in message['path'].split('/') if key]
+        data = message['data']
+        with self.lock:
+            if not keys:
+                if event == 'put':
+                    self.card_aliases = {}
+                    self.card_aliases_synced = True
+                for alias, card_uid in (data or {}).items():
+                    self._set_card_alias(alias, card_uid)
+            else:
+                self._set_card_alias(keys[0], data)
+
+    def _set_card_alias(self, alias, card_uid):
+        if card_uid is None:
+            self.card_aliases.pop(alias, None)
+        else:
+            self.card_aliases[alias] = card_uid
+
+    def set_card_aliases(self, card_uid, aliases):
+        with self.lock:
+            for alias in aliases:
+                self.card_aliases[alias] = card_uid
+
+    def is_card_aliases_synced(self):
+        """Is the local mirror of card_aliases complete and up to date?"""
+        return self.card_aliases_synced
+
+    def get_cached_card_alias(self, card_uid):
+        return self.card_aliases.get(card_uid)
+
+    def get_card_alias(self, card_uid):
+        """Returns the canonical UID of a card UID read in another form, or None"""
+        canonical_uid = self.get_cached_card_alias(card_uid)
+        if canonical_uid is None and not self.is_card_aliases_synced():
+            canonical_uid = self.firebase.database().child('card_aliases').child(card_uid).get().val()
+        return canonical_uid
+
+    def _set_pending_registration(self, card_uid, pending_registration):
+        if pending_registration is None:
+            self.pending_registrations.pop(card_uid, None)
+        else:
+            self.pending_registrations[card_uid] = pending_registration
+
+    def is_pending_registrations_synced(self):
+        """Is the local mirror of the pending registrations complete and up to date?"""
+        return self.pending_registrations_synced
+
+    def get_cached_pending_registration(self, card_uid):
+        self.pending_registrations_hits += 1
+        return self.pending_registrations.get(card_uid)
+
+    def get_pending_registration(self, card_uid):
+        if self.is_pending_registrations_synced():
+            return self.get_cached_pending_registration(card_uid)
+        self.pending_registrations_misses += 1
+        return self.firebase.database().child('pending_registrations').child(card_uid).get().val()
+
+    def remove_pending_registration(self, card_uid):
+        self.firebase.database().child('pending_registrations').child(card_uid).remove()
+        self.forget_pending_registration(card_uid)
+
+    def forget_pending_registration(self, card_uid):
+        """Remove a pending registration from the local mirror only (it has been removed from Firebase)"""
+        with self.lock:
+            self.pending_registrations.pop(card_uid, None)
+
+    def get_cached_card(self, card_uid):
+        return self.cards.get(card_uid)
+
+    def is_cards_synced(self):
+        """Is the complete copy of cards loaded and kept up to date? A card that is not in it is not registered"""
+        return self.cards.is_complete()
+
+    def get_registered_card(self, card_uid):
+        """The card stored under card_uid itself, the aliases are not followed"""
+        card = self.get_cached_card(card_uid)
+        if card is None and not self.is_cards_synced():
+            card = self.set_card(card_uid, self.firebase.database().child('cards').child(card_uid).get().val())
+        return card
+
+    def find_card(self, card_uid):
+        """
+        Returns the UID the card is stored under and the card (None if there is no such card). A card stored under
+        the UID as it was read wins, the alias index is only followed when there is none.
+        """
+        card = self.get_registered_card(card_uid)
+        canonical_uid = self.get_card_alias(card_uid) if card is None else None
+        if canonical_uid is not None:
+            return canonical_uid, self.get_registered_card(canonical_uid)
+        return card_uid, card
+
+    def get_card(self, card_uid):
+        return self.find_card(card_uid)[1]
+
+    def set_card(self, card_uid, card):
+        """Returns the card that is cached (with the pending writes of the journal applied), the same for the others"""
+        return self.cards.set(card_uid, card)
+
+    def get_cached_player(self, slack_user_id):
+        return self.players.get(slack_user_id)
+
+    def get_player(self, slack_user_id):
+        player = self.get_cached_player(slack_user_id)
+        if player is None:
+            player = self.firebase.database().child('player_profiles').child(slack_user_id).get().val()
+            if player is None:
+                # Not copied to player_profiles yet (see index_player_profiles), the shallow query returns the
+                # profile fields without the cards and the sessions
+                player = self.firebase.get_shallow(f'players/{slack_user_id}')
+            player = self.set_player(slack_user_id, player)
+        return player
+
+    def set_player(self, slack_user_id, player):
+        return self.players.set(slack_user_id, get_player_profile(player))
+
+    def update_player(self, slack_user_id, fields):
+        existing = self.players.peek(slack_user_id)
+        if existing is not None:
+            self.set_player(slack_user_id, {**existing, **fields})
+
+    def get_cached_player_statistics(self, game_slug, slack_user_id):
+        return self._get_player_statistics_cache(game_slug).get(slack_user_id)
+
+    def get_player_statistics(self, game_slug, slack_user_id):
+        player_statistics = self.get_cached_player_statistics(game_slug, slack_user_id)
+        if player_statistics is None:
+            player_statistics = self.firebase.database()\
+                .child('games')\
+                .child(game_slug)\
+                .child('player_statistics')\
+                .child(slack_user_id)\
+                .get().val()
+            player_statistics = self.set_player_statistics(game_slug, slack_user_id, player_statistics)
+        return player_statistics
+
+    def set_player_statistics(self, game_slug, slack_user_id, player_statistics):
+        return self._get_player_statistics_cache(game_slug).set(slack_user_id, player_statistics)
+
+    def add_player_statistics_listener(self, game_slug, listener):
+        """Keep the listener (e.g. the Leaderboard) in sync with the player statistics of game_slug, see CachedNode"""
+        self._get_player_statistics_cache(game_slug).add_listener(listener)
+
+    def add_pending_writes(self, entry_id, updates):
+        """The updates of a journal entry, they are laid over what is read from Firebase until it is replayed"""
+        self.pending_writes.add(entry_id, updates)
+
+    def remove_pending_writes(self, entry_id):
+        """The journal entry has been replayed (or given up on), Firebase has its writes (or never will)"""
+        self.pending_writes.remove(entry_id)
+
+    def get_stats(self):
+        return {
+            'pending_writes': len(self.pending_writes),
+            'pending_registrations': {
+                'size': len(self.pending_registrations),
+                'synced': self.pending_registrations_synced,
+                'hits': self.pending_registrations_hits,
+                'misses': self.pending_registrations_misses
+            },
+            'warm_up': self.warm_up_stats,
+            'cards': self.cards.get_stats(),
+            'card_aliases': {
+                'size': len(self.card_aliases),
+                'synced': self.card_aliases_synced
+            },
+            'players': self.players.get_stats(),
+            'player_statistics': {
+                game_slug: cache.get_stats() for game_slug, cache in self.player_statistics.items()
+            }
+        }
@@ -0,0 +1,228 @@
+from collections import namedtuple
+
+from trueskill import Rating
+
+from app.games.game_type import get_game_type
+from app.utils.elo_rating import calculate_new_rating
+from app.utils.firebase import iter_children
+from app.utils.trueskill_rating import TrueSkill1vs1
+
+# Amount of sessions fetched from Firebase per request
+SESSION_PAGE_SIZE = 1000
+# Stored TrueSkill values that differ less than this from the replayed values are considered equal
+TRUESKILL_TOLERANCE = 1e-6
+
+Discrepancy = namedtuple('Discrepancy', ['path', 'expected', 'actual'])
+
+
+def iter_sessions(firebase, game_slug, page_size=SESSION_PAGE_SIZE, start_after=None):
+    """Yields the (key, session) pairs of a game in chronological order (push keys sort by time), page by page"""
+    return iter_children(firebase, f'games/{game_slug}/sessions', start_after=start_after, page_size=page_size)
+
+
+class ReplayedPlayer:
+    __slots__ = ['elo_rating', 'mu', 'sigma', 'total_games', 'games_won', 'games_lost', 'seconds_played']
+
+    def __init__(self):
+        self.elo_rating = 1200
+        self.mu = Rating().mu
+        self.sigma = Rating().sigma
+        self.total_games = 0
+        self.games_won = 0
+        self.games_lost = 0
+        self.seconds_played = 0
+
+    def to_player_statistics(self):
+        return {
+            'elo_rating': self.elo_rating,
+            'trueskill_rating': {
+                'mu': self.mu,
+                'sigma': self.sigma
+            },
+            'total_games': self.total_games,
+            'games_won': self.games_won,
+            'games_lost': self.games_lost,
+            'seconds_played': self.seconds_played
+        }
+
+
+def _get(value, *keys):
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class RatingReplay:
+    """
+    Replays the sessions of a game in chronological order and recalculates the Elo and TrueSkill ratings.
+
+    Every session is compared with the ratings stored in it, all the discrepancies are collected. replay_session()
+    returns the multi-path update that corrects the session (and the player sessions) when it has discrepancies, and
+    get_player_statistics_updates() returns the corrections of the player statistics once all sessions are replayed.
+    """
+
+    def __init__(self, game_slug, env=None):
+        self.game_slug = game_slug
+        self.trueskill = TrueSkill1vs1(env)
+        self.players = {}
+        self.discrepancies = []
+        self.replayed_sessions = 0
+        self.corrected_sessions = 0
+
+    def _get_player(self, slack_user_id):
+        player = self.players.get(slack_user_id)
+        if player is None:
+            player = self.players[slack_user_id] = ReplayedPlayer()
+        return player
+
+    def _compare(self, path, field, expected, actual, tolerance=0):
+        if actual is None or abs(expected - actual) > tolerance:
+            # The path is only built for discrepancies, most comparisons are equal
+            self.discrepancies.append(Discrepancy(f'{path}/{field}', expected, actual))
+            return False
+        return True
+
+    def replay_session(self, session_key, session):
+        if 'winner' in session:
+            quality, results = self._rate_1vs1(session)
+        else:
+            quality, results = self._rate_teams(session)
+
+        session_path = f'games/{self.game_slug}/sessions/{session_key}'
+        # Compare everything (instead of stopping at the first difference) so that every discrepancy is reported
+        is_correct = self._compare(session_path, 'trueskill_quality', quality, session.get('trueskill_quality'),
+                                   TRUESKILL_TOLERANCE)
+        for role, (slack_user_id, player, elo_rating, mu, sigma) in results.items():
+            stored = _get(session, *role.split('/'))
+            role_path = session_path + '/' + role
+            is_correct &= self._compare(role_path, 'elo_rating/before', player.elo_rating,
+                                        _get(stored, 'elo_rating', 'before'))
+            is_correct &= self._compare(role_path, 'elo_rating/after', elo_rating,
+                                        _get(stored, 'elo_rating', 'after'))
+            is_correct &= self._compare(role_path, 'trueskill_rating/mu/before', player.mu,
+                                        _get(stored, 'trueskill_rating', 'mu', 'before'), TRUESKILL_TOLERANCE)
+            is_correct &= self._compare(role_path, 'trueskill_rating/mu/after', mu,
+                                        _get(stored, 'trueskill_rating', 'mu', 'after'), TRUESKILL_TOLERANCE)
+            is_correct &= self._compare(role_path, 'trueskill_rating/sigma/before', player.sigma,
+                                        _get(stored, 'trueskill_rating', 'sigma', 'before'), TRUESKILL_TOLERANCE)
+            is_correct &= self._compare(role_path, 'trueskill_rating/sigma/after', sigma,
+                                        _get(stored, 'trueskill_rating', 'sigma', 'after'), TRUESKILL_TOLERANCE)
+
+        session_updates = {}
+        if not is_correct:
+            session_updates = self._build_session_updates(session_path, session_key, results, quality)
+            self.corrected_sessions += 1
+
+        # Move the players on to their ratings after the session
+        session_seconds = session.get('session_seconds', 0)
+        for role, (slack_user_id, player, elo_rating, mu, sigma) in results.items():
+            player.elo_rating = elo_rating
+            player.mu = mu
+            player.sigma = sigma
+            player.total_games += 1
+            player.seconds_played += session_seconds
+            if role.startswith('winner'):
+                player.games_won += 1
+            else:
+                player.games_lost += 1
+        self.replayed_sessions += 1
+        return session_updates
+
+    def _rate_1vs1(self, session):
+        """Returns the quality and the role -> (slack_user_id, player, elo_rating, mu, sigma) of a singles session"""
+        winner_slack_user_id = session['winner']['slack_user_id']
+        loser_slack_user_id = session['loser']['slack_user_id']
+        winner = self._get_player(winner_slack_user_id)
+        loser = self._get_player(loser_slack_user_id)
+
+        winner_elo_rating = calculate_new_rating(winner.elo_rating, loser.elo_rating, player_won=True)
+        loser_elo_rating = calculate_new_rating(loser.elo_rating, winner.elo_rating, player_won=False)
+        winner_mu, winner_sigma, loser_mu, loser_sigma = self.trueskill.rate(
+            winner.mu, winner.sigma, loser.mu, loser.sigma
+        )
+        quality = self.trueskill.quality(winner.mu, winner.sigma, loser.mu, loser.sigma)
+        return quality, {
+            'winner': (winner_slack_user_id, winner, winner_elo_rating, winner_mu, winner_sigma),
+            'loser': (loser_slack_user_id, loser, loser_elo_rating, loser_mu, loser_sigma)
+        }
+
+    def _rate_teams(self, session):
+        """Same as _rate_1vs1(), for the sessions of the other game types (winners and losers with their team)"""
+        team_roles = {}
+        for role in ['winners', 'losers']:
+            for slack_user_id, stored in sorted((session.get(role) or {}).items()):
+                team_roles.setdefault(stored['team'], []).append((f'{role}/{slack_user_id}', slack_user_id))
+        team_indexes = sorted(team_roles)
+        winner_team = next(i for i, team_index in enumerate(team_indexes)
+                           if team_roles[team_index][0][0].startswith('winners/'))
+        teams = [
+            [(role, slack_user_id, self._get_player(slack_user_id)) for role, slack_user_id in team_roles[team_index]]
+            for team_index in team_indexes
+        ]
+        game_type = get_game_type(session['game_type'], sum(len(team) for team in teams))
+        quality, new_teams = game_type.rate(
+            [[(player.elo_rating, Rating(player.mu, player.sigma)) for _, _, player in team] for team in teams],
+            winner_team,
+            env=self.trueskill.env
+        )
+        results = {}
+        for team, new_team in zip(teams, new_teams):
+            for (role, slack_user_id, player), (elo_rating, rating) in zip(team, new_team):
+                results[role] = (slack_user_id, player, elo_rating, rating.mu, rating.sigma)
+        return quality, results
+
+    def _build_session_updates(self, session_path, session_key, results, quality):
+        session_updates = {f'{session_path}/trueskill_quality': quality}
+        for role, (slack_user_id, player, elo_rating, mu, sigma) in results.items():
+            session_updates[f'{session_path}/{role}/elo_rating'] = {
+                'before': player.elo_rating,
+                'after': elo_rating,
+                'delta': elo_rating - player.elo_rating
+            }
+            session_updates[f'{session_path}/{role}/trueskill_rating'] = {
+                'mu': {'before': player.mu, 'after': mu, 'delta': mu - player.mu},
+                'sigma': {'before': player.sigma, 'after': sigma, 'delta': sigma - player.sigma}
+            }
+            player_session_path = f'players/{slack_user_id}/sessions/{self.game_slug}/{session_key}'
+            session_updates[f'{player_session_path}/elo_rating'] = {
+                'new': elo_rating,
+                'delta': elo_rating - player.elo_rating
+            }
+            session_updates[f'{player_session_path}/trueskill_rating'] = {
+                'mu': {'new': mu, 'delta': mu - player.mu},
+                'sigma': {'new': sigma, 'delta': sigma - player.sigma}
+            }
+        return session_updates
+
+    def get_player_statistics_updates(self, stored_player_statistics):
+        """
+        Compare the replayed player statistics with the stored ones, returns the multi-path update that corrects them.
+
+        Players that have statistics, but no sessions, are expected to have the initial statistics.
+        """
+        player_statistics_updates = {}
+        stored_player_statistics = stored_player_statistics or {}
+        for slack_user_id in set(self.players) | set(stored_player_statistics):
+            expected = (self.players.get(slack_user_id) or ReplayedPlayer()).to_player_statistics()
+            stored = stored_player_statistics.get(slack_user_id)
+            path = f'games/{self.game_slug}/player_statistics/{slack_user_id}'
+            if stored is None:
+                self.discrepancies.append(Discrepancy(path, expected, None))
+                player_statistics_updates[path] = expected
+                continue
+            if not self._compare(path, 'elo_rating', expected['elo_rating'], _get(stored, 'elo_rating')):
+                player_statistics_updates[f'{path}/elo_rating'] = expected['elo_rating']
+            is_trueskill_correct = True
+            for field in ['mu', 'sigma']:
+                is_trueskill_correct &= self._compare(path, f'trueskill_rating/{field}',
+                                                      expected['trueskill_rating'][field],
+                                                      _get(stored, 'trueskill_rating', field), TRUESKILL_TOLERANCE)
+            if not is_trueskill_correct:
+                player_statistics_updates[f'{path}/trueskill_rating'] = expected['trueskill_rating']
+            for field in ['total_games', 'games_won', 'games_lost']:
+                if not self._compare(path, field, expected[field], _get(stored, field)):
+                    player_statistics_updates[f'{path}/{field}'] = expected[field]
+            # The seconds played are not checked, old sessions do not have a duration
+        return player_statistics_updates
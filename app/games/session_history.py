@@ -0,0 +1,193 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import dateutil.parser
+import pytz
+
+from app.utils.elo_rating import import_numpy
+
+# Columns of an export and their NumPy types: the times in UTC, the players as indexes into the players of the export
+# and NaN for the values old sessions do not have
+COLUMNS = [
+    ('key', 'S20'),
+    ('session_started', '<M8[us]'),
+    ('session_ended', '<M8[us]'),
+    ('session_seconds', '<f8'),
+    ('winner', '<i4'),
+    ('loser', '<i4'),
+    ('winner_elo_before', '<f8'),
+    ('winner_elo_after', '<f8'),
+    ('loser_elo_before', '<f8'),
+    ('loser_elo_after', '<f8'),
+    ('winner_mu_before', '<f8'),
+    ('winner_mu_after', '<f8'),
+    ('winner_sigma_before', '<f8'),
+    ('winner_sigma_after', '<f8'),
+    ('loser_mu_before', '<f8'),
+    ('loser_mu_after', '<f8'),
+    ('loser_sigma_before', '<f8'),
+    ('loser_sigma_after', '<f8'),
+    ('trueskill_quality', '<f8')
+]
+META_FILE = 'meta.json'
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+# Value of the missing times (NaT)
+MISSING_TIME = -2 ** 63
+
+
+def _get(value, *keys):
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _to_microseconds(isoformat):
+    if not isoformat:
+        return MISSING_TIME
+    time = dateutil.parser.parse(isoformat)
+    if time.tzinfo is None:
+        time = pytz.utc.localize(time)
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def _to_float(value):
+    return float('nan') if value is None else float(value)
+
+
+def _get_column_path(directory, column):
+    return os.path.join(directory, f'{column}.bin')
+
+
+class SessionHistoryWriter:
+    """
+    Appends the 1 vs 1 sessions of a game to a columnar export: one raw little-endian file per column and a meta.json
+    with the amount of rows, the players and the largest key of the exported sessions.
+
+    The rows are only counted once meta.json is written, the columns are cut back to that amount before appending, so
+    an interrupted export is continued by the next one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = self._load_meta()
+        self.player_indexes = {slack_user_id: i for i, slack_user_id in enumerate(self.meta['players'])}
+        self.rows = []
+        self.skipped_sessions = 0
+        # Keys of the exported sessions that are read again, see skip_exported_after()
+        self.exported_keys = set()
+
+    def _load_meta(self):
+        meta_path = os.path.join(self.directory, META_FILE)
+        if not os.path.exists(meta_path):
+            return {'rows': 0, 'players': [], 'last_key': None, 'columns': COLUMNS}
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if [tuple(column) for column in meta['columns']] != COLUMNS:
+            raise ValueError(f'The export in {self.directory} has other columns, export to a new directory')
+        return meta
+
+    def get_last_key(self):
+        return self.meta['last_key']
+
+    def skip_exported_after(self, key):
+        """Skip the sessions after key that are already in the export, when the export is read from key again"""
+        if key is None or not self.meta['rows']:
+            return
+        np = import_numpy()
+        keys = np.fromfile(_get_column_path(self.directory, 'key'), dtype='S20', count=self.meta['rows'])
+        self.exported_keys = {exported_key.decode('utf-8') for exported_key in keys[keys > key.encode('utf-8')]}
+
+    def _get_player_index(self, slack_user_id):
+        index = self.player_indexes.get(slack_user_id)
+        if index is None:
+            index = self.player_indexes[slack_user_id] = len(self.meta['players'])
+            self.meta['players'].append(slack_user_id)
+        return index
+
+    def append(self, session_key, session):
+        if session_key in self.exported_keys:
+            return
+        if 'winner' not in session:
+            # Sessions with teams do not fit in the winner and loser columns
+            self.skipped_sessions += 1
+        else:
+            winner = session['winner']
+            loser = session['loser']
+            self.rows.append((
+                session_key.encode('utf-8'),
+                _to_microseconds(session.get('session_started')),
+                _to_microseconds(session.get('session_ended')),
+                _to_float(session.get('session_seconds')),
+                self._get_player_index(winner['slack_user_id']),
+                self._get_player_index(loser['slack_user_id']),
+                _to_float(_get(winner, 'elo_rating', 'before')),
+                _to_float(_get(winner, 'elo_rating', 'after')),
+                _to_float(_get(loser, 'elo_rating', 'before')),
+                _to_float(_get(loser, 'elo_rating', 'after')),
+                _to_float(_get(winner, 'trueskill_rating', 'mu', 'before')),
+                _to_float(_get(winner, 'trueskill_rating', 'mu', 'after')),
+                _to_float(_get(winner, 'trueskill_rating', 'sigma', 'before')),
+                _to_float(_get(winner, 'trueskill_rating', 'sigma', 'after')),
+                _to_float(_get(loser, 'trueskill_rating', 'mu', 'before')),
+                _to_float(_get(loser, 'trueskill_rating', 'mu', 'after')),
+                _to_float(_get(loser, 'trueskill_rating', 'sigma', 'before')),
+                _to_float(_get(loser, 'trueskill_rating', 'sigma', 'after')),
+                _to_float(session.get('trueskill_quality'))
+            ))
+        # Sessions replayed from a journal are added with older keys, the last key is the largest one
+        if self.meta['last_key'] is None or session_key > self.meta['last_key']:
+            self.meta['last_key'] = session_key
+
+    def flush(self):
+        """Append the collected rows to the column files and count them in meta.json"""
+        np = import_numpy()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        table = np.array(self.rows, dtype=[(column, dtype) for column, dtype in COLUMNS])
+        for column, dtype in COLUMNS:
+            with open(_get_column_path(self.directory, column), 'ab') as column_file:
+                column_file.truncate(self.meta['rows'] * np.dtype(dtype).itemsize)
+                column_file.write(np.ascontiguousarray(table[column]).tobytes())
+        self.meta['rows'] += len(self.rows)
+        self.rows = []
+        meta_path = os.path.join(self.directory, META_FILE)
+        with open(f'{meta_path}.tmp', 'w') as meta_file:
+            json.dump(self.meta, meta_file)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+
+class SessionHistory:
+    """
+    Read-only view of an export, every column is a memory-mapped NumPy array, e.g.
+
+        history = SessionHistory('exports/ping-pong')
+        wins = np.bincount(history['winner'], minlength=len(history.players))
+    """
+
+    def __init__(self, directory):
+        np = import_numpy()
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.players = meta['players']
+        self.player_indexes = {slack_user_id: i for i, slack_user_id in enumerate(self.players)}
+        self.rows = meta['rows']
+        self.columns = {}
+        for column, dtype in meta['columns']:
+            if self.rows:
+                # Rows of an interrupted export (after meta.json was written) are left out
+                self.columns[column] = np.memmap(_get_column_path(directory, column), dtype=dtype, mode='r',
+                                                 shape=(self.rows,))
+            else:
+                self.columns[column] = np.empty(0, dtype=dtype)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def get_player_index(self, slack_user_id):
+        return self.player_indexes[slack_user_id]
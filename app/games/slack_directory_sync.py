@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+from app.games.player_cache import get_player_profile
+from app.settings import SLACK_DEFAULT_USER_AVATAR_URL, SLACK_SYNC_INTERVAL
+from app.utils.time import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Fields of a player that are kept in sync with the Slack directory
+SLACK_FIELDS = ['slack_username', 'slack_first_name', 'slack_avatar_url']
+# Amount of Slack users fetched per users.list request
+SLACK_USERS_PAGE_SIZE = 200
+
+
+def parse_slack_user(slack_user):
+    """Returns the Slack information of a player from a Slack user object"""
+    slack_profile = slack_user['profile']
+    if 'image_512' in slack_profile.keys():
+        avatar_url = slack_profile['image_512']
+    elif 'image_192' in slack_profile.keys():
+        avatar_url = slack_profile['image_192']
+    elif 'image_72' in slack_profile.keys():
+        avatar_url = slack_profile['image_72']
+    else:
+        avatar_url = SLACK_DEFAULT_USER_AVATAR_URL
+
+    return {
+        'slack_username': slack_user['name'],
+        'slack_first_name': slack_profile['first_name'],
+        'slack_avatar_url': avatar_url
+    }
+
+
+class SlackDirectorySync(threading.Thread):
+    """
+    Keeps the Slack information of the players up to date in the background.
+
+    Every `interval` seconds the whole Slack directory is fetched with users.list (page by page), compared with the
+    stored players, and only the players that changed are written, in one multi-path update. Card reads never have to
+    call the Slack API, they use the stored information (or the directory, for new players).
+    """
+
+    def __init__(self, firebase, player_cache, slack, parse_slack_user, commit, interval=SLACK_SYNC_INTERVAL):
+        threading.Thread.__init__(self, name='SlackDirectorySync')
+        self.daemon = True
+        self.firebase = firebase
+        self.player_cache = player_cache
+        self.slack = slack
+        self.parse_slack_user = parse_slack_user
+        self.commit = commit
+        self.interval = int(interval)
+        self.stopped = threading.Event()
+        # Slack user ID -> the Slack information of the user, as of the last sync
+        self.directory = {}
+        self.syncs = 0
+        self.updated_players = 0
+        self.last_sync_seconds = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+            except Exception:
+                logger.exception('Could not sync the Slack directory')
+            self.stopped.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.join(timeout)
+
+    def get_slack_information(self, slack_user_id):
+        """Returns the Slack information of the user from the last sync, or None if the user is not known (yet)"""
+        return self.directory.get(slack_user_id)
+
+    def _fetch_directory(self):
+        directory = {}
+        cursor = None
+        while True:
+            params = {'limit': SLACK_USERS_PAGE_SIZE, 'presence': 0}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.slack.users.get('users.list', params=params)
+            for slack_user in response.body['members']:
+                if slack_user.get('deleted') or slack_user.get('is_bot'):
+                    continue
+                try:
+                    directory[slack_user['id']] = self.parse_slack_user(slack_user)
+                except KeyError:
+                    # e.g. users without a first name, they keep their stored information
+                    logger.debug(f'Could not parse the Slack user {slack_user.get("id")}')
+            cursor = response.body.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                return directory
+
+    def _get_stored_player(self, slack_user_id):
+        player = self.player_cache.players.peek(slack_user_id)
+        if player is None:
+            # The shallow query returns the profile fields without the cards and the session history
+            player = self.firebase.get_shallow(f'players/{slack_user_id}')
+        return player
+
+    def sync(self):
+        started = time.monotonic()
+        self.directory = self._fetch_directory()
+
+        updates = {}
+        changed_players = {}
+        for slack_user_id in self.firebase.get_shallow('players') or {}:
+            slack_information = self.directory.get(slack_user_id)
+            if slack_information is None:
+                continue
+            player = self._get_stored_player(slack_user_id) or {}
+            changed_fields = {
+                field: slack_information[field]
+                for field in SLACK_FIELDS
+                if player.get(field) != slack_information[field]
+            }
+            if not changed_fields:
+                continue
+            changed_fields['slack_last_sync'] = utc_now().isoformat()
+            changed_players[slack_user_id] = changed_fields
+            for field, value in changed_fields.items():
+                updates[f'players/{slack_user_id}/{field}'] = value
+            # The whole profile, so a player that was not copied to player_profiles yet gets a complete one
+            updates[f'player_profiles/{slack_user_id}'] = get_player_profile({**player, **changed_fields})
+
+        if updates:
+            self.commit(updates)
+            for slack_user_id, changed_fields in changed_players.items():
+                self.player_cache.update_player(slack_user_id, changed_fields)
+
+        self.syncs += 1
+        self.updated_players += len(changed_players)
+        self.last_sync_seconds = time.monotonic() - started
+        logger.info(f'Synced {len(self.directory)} Slack users in {self.last_sync_seconds:.2f} seconds, '
+                    f'updated {len(changed_players)} players')
+
+    def get_stats(self):
+        return {
+            'syncs': self.syncs,
+            'directory_size': len(self.directory),
+            'updated_players': self.updated_players,
+            'last_sync_seconds': self.last_sync_seconds
+        }
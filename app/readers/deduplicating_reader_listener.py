@@ -0,0 +1,63 @@
+import time
+from collections import deque
+
+from app.readers.reader_listener import ReaderListener
+from app.settings import CARD_DEDUPLICATION_WINDOW
+from app.utils.metrics import metrics
+
+
+class DeduplicatingReaderListener(ReaderListener):
+    """
+    Passes the card reads on to `listener`, except the repeats of a card within `window` seconds (a card held on the
+    reader a moment too long), so a repeat never reaches Firebase or ends a session twice. A suppressed read restarts
+    the window of the card.
+
+    The cards read within the window are kept in a dict (card UID -> when the window ends) and in a queue ordered by
+    when the windows end, from which the ended windows are dropped, so every read takes constant time. Not thread safe,
+    every reader (thread) gets its own.
+    """
+
+    def __init__(self, listener, window=CARD_DEDUPLICATION_WINDOW, clock=time.monotonic):
+        self.listener = listener
+        self.window = window
+        self.clock = clock
+        self.window_ends = {}
+        # (when the window ends, card UID), a card that is read again is queued again instead of being moved
+        self.expiry_queue = deque()
+        self.passed_reads = 0
+        self.suppressed_reads = 0
+
+    def _expire(self, now):
+        while self.expiry_queue and self.expiry_queue[0][0] <= now:
+            window_end, card_uid = self.expiry_queue.popleft()
+            # Only the last queued window of the card counts
+            if self.window_ends.get(card_uid) == window_end:
+                del self.window_ends[card_uid]
+
+    def is_repeat(self, card_uid):
+        """Is the card read within the window of its last read? Starts a new window for the card either way"""
+        now = self.clock()
+        self._expire(now)
+        is_repeat = card_uid in self.window_ends
+        window_end = now + self.window
+        self.window_ends[card_uid] = window_end
+        self.expiry_queue.append((window_end, card_uid))
+        return is_repeat
+
+    def handle_card_read(self, card):
+        if self.window > 0 and self.is_repeat(card.get_uid()):
+            self.suppressed_reads += 1
+            metrics.increment('card_reads_suppressed_total')
+            return
+        self.passed_reads += 1
+        self.listener.handle_card_read(card)
+
+    def handle_data(self, message):
+        self.listener.handle_data(message)
+
+    def get_stats(self):
+        return {
+            'passed_reads': self.passed_reads,
+            'suppressed_reads': self.suppressed_reads,
+            'cards_in_window': len(self.window_ends)
+        }
@@ -16,6 +16,11 @@ class ReaderNotFound(Exception):
         )
 
 
+class ReaderLocationNotFound(Exception):
+    def __init__(self, location):
+        super(ReaderLocationNotFound, self).__init__(f'No reader found at {location}')
+
+
 class ReaderCouldNotConnect(Exception):
     def __init__(self, reader_port, error):
         super(ReaderCouldNotConnect, self).__init__(
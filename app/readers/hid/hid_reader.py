@@ -1,14 +1,23 @@
+import functools
+import logging
+import os
 import selectors
 import threading
+import time
 from datetime import datetime
 
 import evdev
-from evdev import InputDevice, categorize, ecodes
+from evdev import InputDevice, ecodes
 
-from app.readers.exceptions import ReaderNotFound
+from app.readers.exceptions import ReaderLocationNotFound, ReaderNotFound
+from app.readers.hid.sysfs import discover_ports
 from app.readers.nfc.cards.mifare_classic import MifareClassicCard
 from app.readers.port import Port
-from app.utils.time import utc_now
+from app.readers.utils.canonical import REVERSED_DECIMAL, canonicalize_uid
+from app.settings import READER_DECIMAL_UID_LOCATIONS
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 SCAN_CODES = {
     # Scancode: ASCIICode
@@ -20,6 +29,47 @@ SCAN_CODES = {
     50: 'M', 51: ',', 52: '.', 53: '/', 54: 'RSHFT', 56: 'LALT', 100: 'RALT'
 }
 
+EV_KEY = ecodes.EV_KEY
+KEY_DOWN = 1
+# The enter key ends the data of a card, the shift key is left out
+KEY_ENTER = 28
+KEY_LEFT_SHIFT = 42
+# Scancode -> the bytes it adds to the data (None for the keys that add nothing), indexed by the code of the event
+SCAN_CODE_TABLE = [None] * (ecodes.KEY_MAX + 1)
+for _scan_code, _characters in SCAN_CODES.items():
+    if _characters is not None and _scan_code not in (KEY_ENTER, KEY_LEFT_SHIFT):
+        SCAN_CODE_TABLE[_scan_code] = _characters.encode('ascii')
+# Longer data is garbage (e.g. a keyboard that is not a reader), the buffer is reset when it would grow beyond it
+MAX_DATA_LENGTH = 64
+
+
+class ReaderState:
+    """The data that is being read from one reader device, in a buffer that is allocated once"""
+
+    def __init__(self, reader_device, port=None, decimal_uids=False):
+        self.reader_device = reader_device
+        self.port = port
+        # Does the reader type the NFC UID as 10 decimal digits (see READER_DECIMAL_UID_LOCATIONS)?
+        self.decimal_uids = decimal_uids
+        self.buffer = bytearray(MAX_DATA_LENGTH)
+        self.length = 0
+        # When the first key of the data that is being read arrived
+        self.scan_started = None
+
+    def append(self, characters):
+        end = self.length + len(characters)
+        if end > MAX_DATA_LENGTH:
+            self.length = 0
+            return
+        self.buffer[self.length:end] = characters
+        self.length = end
+
+    def take(self):
+        """Returns the data read so far and empties the buffer"""
+        data_string = self.buffer[:self.length].decode('ascii')
+        self.length = 0
+        return data_string
+
 
 class HIDReader:
     @staticmethod
@@ -37,97 +87,241 @@ class HIDReader:
         except StopIteration:
             raise ReaderNotFound(vendor_id, product_id, serial_number)
 
+    @staticmethod
+    def matches_location(port, location):
+        """Is the port at the device path (symlinks are resolved) or the physical location?"""
+        return port.location == location or os.path.realpath(port.path) == os.path.realpath(location)
+
+    @staticmethod
+    def find_readers_at(locations):
+        """
+        Returns the readers at the given device paths (e.g. /dev/input/by-path/...-event-kbd, symlinks are resolved)
+        or physical locations (e.g. usb-3f980000.usb-1.2/input0), so a reader can be tied to the table it is mounted on
+        """
+        ports = HIDReader.get_ports()
+        readers = []
+        for location in locations:
+            matching_ports = [port for port in ports if HIDReader.matches_location(port, location)]
+            if not matching_ports:
+                raise ReaderLocationNotFound(location)
+            readers.extend(port for port in matching_ports if port not in readers)
+        return readers
+
     @staticmethod
     def get_ports():
-        ports = []
+        ports = discover_ports()
+        if ports:
+            return ports
+        # Without sysfs (e.g. a container that only has /dev/input), every device has to be opened for its IDs
         for device in [evdev.InputDevice(fn) for fn in evdev.list_devices()]:
             ports.append(Port(
                 path=device.fn,
                 vendor_id=device.info.vendor,
                 product_id=device.info.product,
-                serial_number=None  # Not supported with evdev
+                serial_number=None,  # Not supported with evdev
+                location=device.phys
             ))
         return ports
 
-    def __init__(self, hid_ports, read_delay=1):
+    def __init__(self, hid_ports):
         self.hid_ports = hid_ports
-        self.reader_devices = []
+        # File descriptor -> ReaderState of the reader device
+        self.reader_states = {}
         self.selector = selectors.DefaultSelector()
-        self.read_delay = read_delay
+        # The event loop the readers are read from (see attach()), or None when they are read by the worker thread
+        self.loop = None
         self.connected = False
         self._reader_alive = None
+        self._reader_error = None
+        self._wakeup_fds = None
         self.receiver_thread = None
         self.reader_listeners = []
-        self.reader_buffer_strings = []
-        self.reader_last_received = []
-        self.reader_last_read_time = []
-
-        for i in range(len(hid_ports)):
-            self.reader_buffer_strings.append('')
-            self.reader_last_received.append(None)
-            self.reader_last_read_time.append(utc_now())
 
     def add_read_listener(self, listener):
         self.reader_listeners.append(listener)
 
+    def add_reader_device(self, reader_device, port=None):
+        """Start keeping the state of a reader device, returns the ReaderState"""
+        reader_state = ReaderState(reader_device, port, self._types_decimal_uids(port))
+        self.reader_states[reader_device.fd] = reader_state
+        return reader_state
+
+    @staticmethod
+    def _types_decimal_uids(port):
+        return any(
+            location == '*' or (port is not None and HIDReader.matches_location(port, location))
+            for location in READER_DECIMAL_UID_LOCATIONS
+        )
+
+    def _watch(self, fd, callback):
+        """Call callback when fd can be read, from the worker thread or the event loop"""
+        if self.loop is not None:
+            self.loop.add_reader(fd, callback)
+        else:
+            self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def _unwatch(self, fd):
+        if self.loop is not None:
+            self.loop.remove_reader(fd)
+        else:
+            self.selector.unregister(fd)
+
+    def open_port(self, port):
+        """Grab the reader at the port and start reading it"""
+        reader_device = InputDevice(port.path)
+        try:
+            reader_device.grab()
+        except OSError:
+            reader_device.close()
+            raise
+        self.add_reader_device(reader_device, port)
+        self._watch(reader_device.fd, functools.partial(self._read_device, reader_device.fd))
+        logger.info(f'Reading {port}')
+
+    def close_reader_device(self, fd):
+        """Stop reading the reader device and release it"""
+        reader_state = self.reader_states.pop(fd)
+        self._unwatch(fd)
+        try:
+            reader_state.reader_device.ungrab()
+        except OSError:
+            # The reader has been unplugged
+            pass
+        reader_state.reader_device.close()
+        logger.info(f'Stopped reading {reader_state.port}')
+
     def connect(self):
-        """Connect to the reader and start the worker threads"""
+        """Connect to the reader, start the worker thread and block until the reader stops"""
+        self.start()
+        self.join()
+
+    def start(self):
+        """Connect to the reader and start the worker thread"""
         self.connected = True
 
-        for port in self.hid_ports:
-            reader_device = InputDevice(port.path)
-            reader_device.grab()
-            self.reader_devices.append(reader_device)
-            self.selector.register(reader_device, selectors.EVENT_READ)
+        # Writing to this pipe wakes up the reader thread when it should stop
+        self._wakeup_fds = os.pipe()
+        self._watch(self._wakeup_fds[0], self._handle_wakeup)
 
+        self._open_ports()
         self._start_reader()
 
-        while self.connected:
-            pass
+    def _open_ports(self):
+        for port in self.hid_ports:
+            self.open_port(port)
+
+    def join(self, timeout=None):
+        """Wait for the worker thread to stop, re-raises the exception that stopped it (if any)"""
+        self.receiver_thread.join(timeout)
+        if self._reader_error is not None:
+            raise self._reader_error
+
+    def disconnect(self):
+        """Stop the worker thread and release the readers"""
+        if self.receiver_thread is not None:
+            self._stop_reader()
+        for fd in list(self.reader_states):
+            self.close_reader_device(fd)
+        if self._wakeup_fds is not None:
+            self._unwatch(self._wakeup_fds[0])
+            for fd in self._wakeup_fds:
+                os.close(fd)
+            self._wakeup_fds = None
+        self.connected = False
 
     def _start_reader(self):
         """Start reader thread"""
         self._reader_alive = True
+        self._reader_error = None
         # start hid->console thread
-        self.reader()
-        # TODO: Enable threading when stable
-        # self.receiver_thread = threading.Thread(target=self.reader, name='rx')
-        # self.receiver_thread.daemon = True
-        # self.receiver_thread.start()
+        self.receiver_thread = threading.Thread(target=self.reader, name='rx')
+        self.receiver_thread.daemon = True
+        self.receiver_thread.start()
 
     def _stop_reader(self):
         """Stop reader thread only, wait for clean exit of thread"""
         self._reader_alive = False
-        self.receiver_thread.join()
+        os.write(self._wakeup_fds[1], b'\0')
+        if threading.current_thread() is not self.receiver_thread:
+            self.receiver_thread.join()
+
+    def _handle_wakeup(self):
+        os.read(self._wakeup_fds[0], 512)
+
+    def attach(self, loop):
+        """Connect to the reader and read it from an asyncio event loop instead of a worker thread"""
+        self.connected = True
+        self.loop = loop
+        self._open_ports()
+
+    def detach(self, loop):
+        """Stop reading from the asyncio event loop and release the readers"""
+        for fd in list(self.reader_states):
+            self.close_reader_device(fd)
+        self.loop = None
+        self.connected = False
+
+    def _get_select_timeout(self):
+        """Seconds the worker thread waits for the readers before it calls _after_select() anyway, None is forever"""
+        return None
+
+    def _after_select(self):
+        pass
 
     def reader(self):
         try:
             while self.connected and self._reader_alive:
-                for key, mask in self.selector.select():
-                    reader_device = key.fileobj
-                    reader_index = self.reader_devices.index(reader_device)
-                    for event in reader_device.read():
-                        if event.type == ecodes.EV_KEY:
-                            data = categorize(event)  # Save the event temporarily to introspect it
-                            if data.keystate == 1:  # Down events only
-                                if data.scancode in SCAN_CODES:
-                                    if (data.scancode != 42) and (data.scancode != 28):
-                                        self.reader_buffer_strings[reader_index] += SCAN_CODES.get(data.scancode)
-                                    if data.scancode == 28:
-                                        data_string = self.reader_buffer_strings[reader_index]
-                                        # TODO: Add more checks
-                                        if len(data_string) == 8:
-                                            for listener in self.reader_listeners:
-                                                listener.handle_card_read(MifareClassicCard(data_string))
-                                        else:
-                                            for listener in self.reader_listeners:
-                                                listener.handle_data(data_string)
-                                        self.reader_buffer_strings[reader_index] = ''
+                for key, mask in self.selector.select(self._get_select_timeout()):
+                    key.data()
+                self._after_select()
 
         except Exception as e:
             self.connected = False
             # TODO: Handle exception (reconnect?) instead of re-raise
-            raise
+            self._reader_error = e
+
+    def _read_device(self, fd):
+        reader_state = self.reader_states[fd]
+        try:
+            events = list(reader_state.reader_device.read())
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._handle_reader_error(fd, e)
+            return
+        for event in events:
+            # Only the key down events matter, decoded from the code of the event (evdev.categorize() is not needed)
+            if event.type != EV_KEY or event.value != KEY_DOWN:
+                continue
+            if event.code == KEY_ENTER:
+                self._handle_data(reader_state)
+                continue
+            characters = SCAN_CODE_TABLE[event.code]
+            if characters is not None:
+                if reader_state.scan_started is None:
+                    reader_state.scan_started = time.perf_counter()
+                reader_state.append(characters)
+
+    def _handle_reader_error(self, fd, error):
+        """A reader could not be read (e.g. it was unplugged), the fixed set of readers can not go on without it"""
+        raise error
 
-    def _should_read(self, reader_index):
-        return (utc_now() - self.reader_last_read_time[reader_index]).total_seconds() > self.read_delay
+    def _handle_data(self, reader_state):
+        data_string = reader_state.take()
+        if reader_state.scan_started is not None:
+            # From the first key of the card to the enter key
+            metrics.observe('tap_stage_seconds', time.perf_counter() - reader_state.scan_started, stage='hid_scan')
+            reader_state.scan_started = None
+        # TODO: Add more checks
+        with metrics.time('tap_stage_seconds', stage='hid_listeners'):
+            if len(data_string) == 8:
+                card = MifareClassicCard(data_string)
+            elif reader_state.decimal_uids and len(data_string) == 10 and data_string.isdigit():
+                # A reader set up to type the UID as 10 decimal digits
+                card = MifareClassicCard(canonicalize_uid(data_string, REVERSED_DECIMAL))
+            else:
+                for listener in self.reader_listeners:
+                    listener.handle_data(data_string)
+                return
+            for listener in self.reader_listeners:
+                listener.handle_card_read(card)
@@ -0,0 +1,132 @@
+import logging
+import time
+
+from app.readers.hid.hid_reader import HIDReader
+from app.readers.hid.sysfs import UEVENT_BUFFER_SIZE, discover_ports, is_evdev_uevent, open_uevent_socket, parse_uevent
+from app.settings import READER_RESCAN_INTERVAL
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def match_vendor_product(vendor_id, product_id):
+    """Matches the readers with the vendor and product ID (hex strings, e.g. 0xffff)"""
+    vendor_id, product_id = int(vendor_id, 16), int(product_id, 16)
+    return lambda port: port.vendor_id == vendor_id and port.product_id == product_id
+
+
+def match_locations(locations):
+    """Matches the readers at the device paths or physical locations, see HIDReader.find_readers_at()"""
+    return lambda port: any(HIDReader.matches_location(port, location) for location in locations)
+
+
+class HIDReaderManager(HIDReader):
+    """
+    Reads every reader that matches `port_matcher`, also the ones that are plugged in while it runs.
+
+    The readers are found in sysfs, without opening the other input devices. The kernel uevents (netlink) tell when an
+    input device is added or removed, so a reader that comes back after a USB glitch is grabbed and read again right
+    away, and the readers are rescanned every `rescan_interval` seconds when the uevents are not available (or missed).
+    A reader that can not be read any more is let go instead of stopping the other readers.
+    """
+
+    def __init__(self, port_matcher, rescan_interval=READER_RESCAN_INTERVAL):
+        super().__init__([])
+        self.port_matcher = port_matcher
+        self.rescan_interval = rescan_interval
+        self.next_rescan = None
+        self.uevent_socket = None
+        self._rescan_handle = None
+
+    def _open_ports(self):
+        self.uevent_socket = open_uevent_socket()
+        if self.uevent_socket is not None:
+            self._watch(self.uevent_socket.fileno(), self._handle_uevents)
+        else:
+            logger.warning(f'Kernel uevents are not available, rescanning the readers every {self.rescan_interval}s')
+        self.rescan()
+        if self.loop is not None:
+            self._schedule_rescan()
+
+    def _close_uevent_socket(self):
+        if self.uevent_socket is not None:
+            self._unwatch(self.uevent_socket.fileno())
+            self.uevent_socket.close()
+            self.uevent_socket = None
+
+    def disconnect(self):
+        super().disconnect()
+        self._close_uevent_socket()
+
+    def detach(self, loop):
+        if self._rescan_handle is not None:
+            self._rescan_handle.cancel()
+            self._rescan_handle = None
+        self._close_uevent_socket()
+        super().detach(loop)
+
+    def get_matching_ports(self):
+        return [port for port in discover_ports() if self.port_matcher(port)]
+
+    def rescan(self):
+        """Open the matching readers that are not read yet and let go of the ones that are gone"""
+        started = time.perf_counter()
+        self.next_rescan = time.monotonic() + self.rescan_interval
+        ports = self.get_matching_ports()
+        paths = {port.path for port in ports}
+        opened_paths = {}
+        for fd, reader_state in list(self.reader_states.items()):
+            if reader_state.port.path in paths:
+                opened_paths[reader_state.port.path] = fd
+            else:
+                self.close_reader_device(fd)
+                metrics.increment('reader_changes_total', change='removed')
+        for port in ports:
+            if port.path in opened_paths:
+                continue
+            try:
+                self.open_port(port)
+                metrics.increment('reader_changes_total', change='added')
+            except OSError as e:
+                # The device node is not ready (or not accessible) yet, the next rescan tries again
+                logger.warning(f'Could not open {port}: {e}')
+        metrics.observe('reader_rescan_seconds', time.perf_counter() - started)
+
+    def _handle_uevents(self):
+        should_rescan = False
+        while True:
+            try:
+                data = self.uevent_socket.recv(UEVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                # e.g. ENOBUFS when uevents were dropped, rescan to be sure nothing was missed
+                logger.warning(f'Could not receive the kernel uevents: {e}')
+                should_rescan = True
+                break
+            action, properties = parse_uevent(data)
+            if is_evdev_uevent(properties) and action in ('add', 'remove'):
+                logger.debug(f'Kernel uevent: {action} {properties["DEVNAME"]}')
+                should_rescan = True
+        if should_rescan:
+            self.rescan()
+
+    def _handle_reader_error(self, fd, error):
+        # The reader was most likely unplugged, the uevent (or the next rescan) brings it back
+        logger.warning(f'Could not read {self.reader_states[fd].port}, letting it go: {error}')
+        self.close_reader_device(fd)
+        metrics.increment('reader_changes_total', change='failed')
+
+    def _get_select_timeout(self):
+        return max(0.0, self.next_rescan - time.monotonic())
+
+    def _after_select(self):
+        if time.monotonic() >= self.next_rescan:
+            self.rescan()
+
+    def _schedule_rescan(self):
+        def rescan():
+            self.rescan()
+            self._schedule_rescan()
+
+        self._rescan_handle = self.loop.call_later(self.rescan_interval, rescan)
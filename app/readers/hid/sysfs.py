@@ -0,0 +1,79 @@
+"""
+Finds the input devices in sysfs and follows the kernel uevents of them being plugged in and unplugged, without opening
+the device nodes (opening every input device to read its IDs is slow and disturbs the devices that are in use).
+"""
+import os
+import socket
+
+from app.readers.port import Port
+
+SYSFS_INPUT = '/sys/class/input'
+DEV_INPUT = '/dev/input'
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of the uevents sent by the kernel (udev resends them in group 2)
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 16 * 1024
+
+
+def _read_attribute(device_path, *names):
+    with open(os.path.join(device_path, *names)) as attribute_file:
+        return attribute_file.read().strip()
+
+
+def discover_ports(sysfs_input=SYSFS_INPUT):
+    """Returns a Port for every evdev node (eventN), with the IDs and the physical location from sysfs"""
+    ports = []
+    try:
+        names = os.listdir(sysfs_input)
+    except OSError:
+        return ports
+    for name in sorted(names):
+        if not name.startswith('event'):
+            continue
+        device_path = os.path.join(sysfs_input, name, 'device')
+        try:
+            vendor_id = int(_read_attribute(device_path, 'id', 'vendor'), 16)
+            product_id = int(_read_attribute(device_path, 'id', 'product'), 16)
+            location = _read_attribute(device_path, 'phys')
+        except (OSError, ValueError):
+            # The device is being removed, or it is not a real input device
+            continue
+        ports.append(Port(
+            path=os.path.join(DEV_INPUT, name),
+            vendor_id=vendor_id,
+            product_id=product_id,
+            serial_number=None,
+            location=location or None
+        ))
+    return ports
+
+
+def open_uevent_socket():
+    """Returns a non-blocking socket that receives the kernel uevents, or None when netlink is not available"""
+    try:
+        uevent_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+    except (AttributeError, OSError):
+        return None
+    try:
+        uevent_socket.bind((0, UEVENT_KERNEL_GROUP))
+        uevent_socket.setblocking(False)
+    except OSError:
+        uevent_socket.close()
+        return None
+    return uevent_socket
+
+
+def parse_uevent(data):
+    """Returns (action, properties) of a kernel uevent, e.g. ('add', {'SUBSYSTEM': 'input', 'DEVNAME': ...})"""
+    header, *fields = data.split(b'\0')
+    action = header.split(b'@', 1)[0].decode('ascii', errors='replace')
+    properties = {}
+    for field in fields:
+        key, separator, value = field.partition(b'=')
+        if separator:
+            properties[key.decode('ascii', errors='replace')] = value.decode('utf-8', errors='replace')
+    return action, properties
+
+
+def is_evdev_uevent(properties):
+    return properties.get('SUBSYSTEM') == 'input' and properties.get('DEVNAME', '').startswith('input/event')
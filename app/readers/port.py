@@ -1,9 +1,11 @@
 class Port:
-    def __init__(self, path, vendor_id, product_id, serial_number):
+    def __init__(self, path, vendor_id, product_id, serial_number, location=None):
         self.path = path
         self.vendor_id = vendor_id
         self.product_id = product_id
         self.serial_number = serial_number
+        # Physical location of the reader (e.g. usb-3f980000.usb-1.2/input0), it stays the same across reboots
+        self.location = location
 
     def __repr__(self):
         return f'<Port ' \
@@ -11,4 +13,5 @@ class Port:
                f'vendor_id={self.vendor_id} ' \
                f'product_id={self.product_id} ' \
                f'serial_number={self.serial_number} ' \
+               f'location={self.location} ' \
                f'>'
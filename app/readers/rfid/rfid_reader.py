@@ -7,29 +7,51 @@ from app.readers.rfid.cards.em4200 import EM4200Card
 from app.readers.serial.serial_reader import SerialReader
 from app.utils.time import utc_now
 
+LINE_SEPARATOR = b'\r\n'
+# A line longer than this is garbage (e.g. noise on the line), the buffer is reset when it grows beyond it
+MAX_LINE_LENGTH = 64
+
 
 class RFIDReader(SerialReader):
     def reader(self):
         try:
             while self.connected and self._reader_alive:
-                if not self._should_read():
+                # read all that is there or wait for one byte (until the timeout or cancel_read)
+                data = self.serial_instance.read(self.serial_instance.in_waiting or 1)
+                if not data:
                     continue
-                # read all that is there or wait for one byte
-                self.reader_buffer_string += self.serial_instance\
-                    .read(self.serial_instance.in_waiting or 1)\
-                    .decode('UTF-8')
-                if '\r\n' in self.reader_buffer_string:
-                    lines = self.reader_buffer_string.split('\r\n')
-                    self.reader_last_received = lines[-2]
-                    self.reader_buffer_string = lines[-1]
-                    self.reader_last_read_time = utc_now()
-                    if self.reader_last_received[:1] == ID_TYPE_EM4200:
-                        for reader_listener in self.reader_listeners:
-                            reader_listener.handle_card_read(EM4200Card(self.reader_last_received[1:]))
-                    else:
-                        for reader_listener in self.reader_listeners:
-                            reader_listener.handle_data(self.reader_last_received)
-        except serial.SerialException:
+                self._handle_data(data)
+        except serial.SerialException as e:
             self.connected = False
             # TODO: Handle exception (reconnect?) instead of re-raise
-            raise
+            self._reader_error = e
+
+    def _handle_data(self, data):
+        self.reader_buffer += data
+        line_end = self.reader_buffer.rfind(LINE_SEPARATOR)
+        if line_end == -1:
+            if len(self.reader_buffer) > MAX_LINE_LENGTH:
+                self.reader_buffer.clear()
+            return
+        if not self._should_read():
+            # The reader repeats the card for as long as it is held over it, the complete lines received
+            # within the debounce window are dropped without decoding them
+            del self.reader_buffer[:line_end + len(LINE_SEPARATOR)]
+            return
+        lines = self.reader_buffer[:line_end].split(LINE_SEPARATOR)
+        del self.reader_buffer[:line_end + len(LINE_SEPARATOR)]
+        for line in lines:
+            self._handle_line(line.decode('UTF-8', errors='replace'))
+
+    def _handle_line(self, line):
+        self.reader_last_received = line
+        if line[:1] == ID_TYPE_EM4200:
+            # Only the first card within the debounce window is passed on to the listeners
+            if not self._should_read():
+                return
+            self.reader_last_read_time = utc_now()
+            for reader_listener in self.reader_listeners:
+                reader_listener.handle_card_read(EM4200Card(line[1:]))
+        else:
+            for reader_listener in self.reader_listeners:
+                reader_listener.handle_data(line)
@@ -53,9 +53,10 @@ class SerialReader:
         self.read_delay = read_delay
         self.connected = False
         self._reader_alive = None
+        self._reader_error = None
         self.receiver_thread = None
         self.reader_listeners = []
-        self.reader_buffer_string = ''
+        self.reader_buffer = bytearray()
         self.reader_last_received = None
         self.reader_last_read_time = utc_now()
 
@@ -79,17 +80,50 @@ class SerialReader:
         self.reader_listeners.append(listener)
 
     def connect(self):
-        """Connect to the reader and start the worker threads"""
+        """Connect to the reader, start the worker thread and block until the reader stops"""
+        self.start()
+        self.join()
+
+    def start(self):
+        """Connect to the reader and start the worker thread"""
         self.serial_instance.open()
         self.connected = True
         self._start_reader()
 
-        while self.connected:
-            pass
+    def join(self, timeout=None):
+        """Wait for the worker thread to stop, re-raises the exception that stopped it (if any)"""
+        self.receiver_thread.join(timeout)
+        if self._reader_error is not None:
+            raise self._reader_error
+
+    def disconnect(self):
+        """Stop the worker thread and close the serial port"""
+        if self.receiver_thread is not None:
+            self._stop_reader()
+        self.serial_instance.close()
+        self.connected = False
+
+    def attach(self, loop):
+        """Connect to the reader and read it from an asyncio event loop instead of a worker thread"""
+        self.serial_instance.open()
+        self.connected = True
+        loop.add_reader(self.serial_instance.fileno(), self._read_available)
+
+    def detach(self, loop):
+        """Stop reading from the asyncio event loop and close the serial port"""
+        loop.remove_reader(self.serial_instance.fileno())
+        self.serial_instance.close()
+        self.connected = False
+
+    def _read_available(self):
+        data = self.serial_instance.read(self.serial_instance.in_waiting)
+        if data:
+            self._handle_data(data)
 
     def _start_reader(self):
         """Start reader thread"""
         self._reader_alive = True
+        self._reader_error = None
         # start serial->console thread
         self.receiver_thread = threading.Thread(target=self.reader, name='rx')
         self.receiver_thread.daemon = True
@@ -100,10 +134,14 @@ class SerialReader:
         self._reader_alive = False
         if hasattr(self.serial_instance, 'cancel_read'):
             self.serial_instance.cancel_read()
-        self.receiver_thread.join()
+        if threading.current_thread() is not self.receiver_thread:
+            self.receiver_thread.join()
 
     def reader(self):
         raise NotImplementedError
 
+    def _handle_data(self, data):
+        raise NotImplementedError
+
     def _should_read(self):
         return (utc_now() - self.reader_last_read_time).total_seconds() > self.read_delay
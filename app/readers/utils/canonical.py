@@ -0,0 +1,129 @@
+"""
+The same card shows up as different UIDs depending on the reader and how it is set up, e.g. the NUID 04A1B2C3 of a
+MIFARE card is typed as C3B2A104 or as the decimal 3283263748 by other readers. Every read is converted to one
+canonical key, the UID as the HID readers type it (hex, most significant byte first, upper case), which is the key of
+the card in Firebase. The other forms of a registered card are stored in card_aliases/<alias> -> canonical UID.
+"""
+from app.readers.utils.card import NFC_CARD
+from app.readers.utils.utils import BIT_REVERSE_TABLE
+
+# Hex, most significant byte first (the canonical form)
+NUID = 0x00
+# Hex, least significant byte first
+REVERSED_NUID = 0x01
+# Decimal of the bytes in reverse order, e.g. the 10 digits typed by readers set up for "10 digit decimal" (read back
+# as at least 4 bytes, the zero bytes at the end of a longer UID are lost)
+REVERSED_DECIMAL = 0x02
+# Hex, the bits of every byte reversed (readers that shift the bits out least significant bit first)
+LSB_FIRST = 0x03
+
+FORMATS = {
+    'nuid': NUID,
+    'reversed_nuid': REVERSED_NUID,
+    'reversed_decimal': REVERSED_DECIMAL,
+    'lsb_first': LSB_FIRST
+}
+# The forms stored in the alias index of a card
+ALIAS_FORMATS = [REVERSED_NUID, REVERSED_DECIMAL, LSB_FIRST]
+
+
+def _decimal_to_bytes(decimal):
+    value = int(decimal)
+    return value.to_bytes(max(4, (value.bit_length() + 7) // 8), 'little')
+
+
+def _check_format(uid_format):
+    if uid_format not in FORMATS.values():
+        raise ValueError(f'Unknown UID format {uid_format}')
+
+
+def to_bytes(uid, uid_format=NUID):
+    """Returns the bytes of the UID, most significant byte first"""
+    _check_format(uid_format)
+    if uid_format == REVERSED_DECIMAL:
+        return _decimal_to_bytes(uid)
+    data = bytes.fromhex(uid)
+    if uid_format == REVERSED_NUID:
+        return data[::-1]
+    if uid_format == LSB_FIRST:
+        return data.translate(BIT_REVERSE_TABLE)
+    return data
+
+
+def from_bytes(data, uid_format=NUID):
+    """Returns the UID bytes (most significant byte first) in the given format"""
+    _check_format(uid_format)
+    if uid_format == REVERSED_DECIMAL:
+        return str(int.from_bytes(data, 'little'))
+    if uid_format == REVERSED_NUID:
+        data = data[::-1]
+    elif uid_format == LSB_FIRST:
+        data = data.translate(BIT_REVERSE_TABLE)
+    return data.hex().upper()
+
+
+def canonicalize_uid(uid, uid_format=NUID):
+    return from_bytes(to_bytes(uid, uid_format))
+
+
+def get_aliases(canonical_uid):
+    """Returns the other forms of a canonical UID, an empty list when it is not a hex UID"""
+    try:
+        data = to_bytes(canonical_uid)
+    except ValueError:
+        return []
+    aliases = []
+    for uid_format in ALIAS_FORMATS:
+        alias = from_bytes(data, uid_format)
+        if alias != canonical_uid and alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def get_card_aliases(card):
+    # Only the NFC UIDs are read in several forms, an RFID card is always read as Wiegand 32
+    return get_aliases(card.get_uid()) if card.get_card_type() == NFC_CARD else []
+
+
+def _split(hex_data, lengths):
+    uids = []
+    offset = 0
+    for length in lengths:
+        uids.append(hex_data[offset:offset + 2 * length])
+        offset += 2 * length
+    return uids
+
+
+def _check_hex_uids(uids):
+    for uid in uids:
+        if len(uid) % 2:
+            raise ValueError(f'{uid} is not a whole number of bytes')
+
+
+def canonicalize_uids(uids, uid_format=NUID):
+    """
+    canonicalize_uid() for many UIDs at once (imports and migrations): the UIDs are decoded into one buffer, which is
+    converted with a single pass through the lookup table (or reversal) and encoded back to hex in one go
+    """
+    _check_format(uid_format)
+    if uid_format == REVERSED_DECIMAL:
+        parts = [_decimal_to_bytes(uid) for uid in uids]
+        return _split(b''.join(parts).hex().upper(), [len(part) for part in parts])
+    uids = list(uids)
+    _check_hex_uids(uids)
+    lengths = [len(uid) // 2 for uid in uids]
+    data = bytes.fromhex(''.join(uids))
+    if uid_format == REVERSED_NUID:
+        # Reversing the buffer reverses the bytes of every UID and the order of the UIDs
+        return _split(data[::-1].hex().upper(), lengths[::-1])[::-1]
+    if uid_format == LSB_FIRST:
+        data = data.translate(BIT_REVERSE_TABLE)
+    return _split(data.hex().upper(), lengths)
+
+
+def convert_uids(canonical_uids, uid_format):
+    """The reverse of canonicalize_uids(), returns the canonical UIDs in the given format"""
+    if uid_format == REVERSED_DECIMAL:
+        return [str(int.from_bytes(bytes.fromhex(uid), 'little')) for uid in canonical_uids]
+    # Reversing the bytes or the bits of every byte is its own inverse
+    return canonicalize_uids(canonical_uids, uid_format)
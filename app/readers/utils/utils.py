@@ -1,5 +1,11 @@
+# Byte -> the byte with its bits in reverse order, and byte -> the byte with its nibbles swapped, for bytes.translate()
+BIT_REVERSE_TABLE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+NIBBLE_SWAP_TABLE = bytes((i << 4 & 0xF0) | (i >> 4) for i in range(256))
+
+
 def reverse_hex_nibbles(hex_string):
-    return ''.join([''.join(reversed(hex_string[i:(i + 2)])) for i in range(0, len(hex_string), 2)])
+    """Swap the two hex digits of every byte, e.g. 04A1 -> 401A (returned in upper case)"""
+    return bytes.fromhex(hex_string).translate(NIBBLE_SWAP_TABLE).hex().upper()
 
 
 def reverse_decimal(decimal):
@@ -15,12 +21,6 @@ def reversed_decimal_to_nuid(reversed_decimal):
 
 
 def msb_to_lsb(msb):
-    new_value = 0
-    for part in range(0, 8):
-        old_part = msb >> part * 8 & 0xFF
-        new_part = 0
-        for i in range(0, 8):
-            if old_part & (2 ** i) & 0xFF > 0:
-                new_part += (2 ** (7 - i))
-        new_value += new_part << part * 8
-    return new_value
+    """Reverse the bits of every byte of the (up to 8 bytes) value"""
+    data = (msb & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'little')
+    return int.from_bytes(data.translate(BIT_REVERSE_TABLE), 'little')
@@ -1,5 +1,13 @@
+import json
 import os
 
+# Game that is played at the table (the slug of one of the games in app/games/implementations)
+GAME_SLUG = os.environ.get('OG_GAME_SLUG', 'ping-pong')
+# Tables served by this process, a JSON object of game slug -> reader locations, e.g.
+# {"ping-pong": ["usb-3f980000.usb-1.2/input0"], "foosball": ["/dev/input/by-path/...-event-kbd"]}
+# When empty, every reader with the vendor and product ID below is used for the game of OG_GAME_SLUG
+TABLES = json.loads(os.environ.get('OG_TABLES', '{}'))
+
 # Amount of seconds before a player can win, this functions as a buffer, so that nobody wins by "accident"
 # Used by register_card() in office_game.py
 GAME_START_TIME_BUFFER = int(os.environ.get('OG_GAME_START_TIME_BUFFER', 10))
@@ -10,6 +18,9 @@ GAME_PLAYER_REGISTRATION_TIMEOUT = int(os.environ.get('OG_GAME_PLAYER_REGISTRATI
 # Amount of seconds before a game session runs out (in the case when players forget to register a winner)
 GAME_SESSION_TIME = int(os.environ.get('OG_GAME_SESSION_TIME', 15 * 60))
 
+# Amount of players on the leaderboard of a game (games/<game>/leaderboard)
+LEADERBOARD_SIZE = int(os.environ.get('OG_LEADERBOARD_SIZE', 10))
+
 # Firebase details
 FIREBASE_API_KEY = os.environ.get('OG_FIREBASE_API_KEY', None)
 FIREBASE_DATABASE_URL = os.environ.get('OG_FIREBASE_DATABASE_URL', None)
@@ -28,10 +39,25 @@ FIREBASE_AUTH_PROVIDER_X509_CERT_URL = os.environ.get(
     'https://www.googleapis.com/oauth2/v1/certs'
 )
 FIREBASE_CLIENT_X509_CERT_URL = os.environ.get('OG_FIREBASE_CLIENT_X509_CERT_URL', None)
+# Amount of seconds before a request to Firebase times out
+FIREBASE_TIMEOUT = int(os.environ.get('OG_FIREBASE_TIMEOUT', 10))
+# Amount of seconds before connecting to Firebase times out
+FIREBASE_CONNECT_TIMEOUT = int(os.environ.get('OG_FIREBASE_CONNECT_TIMEOUT', 5))
+# Maximum amount of open (keep-alive) connections to Firebase
+FIREBASE_POOL_SIZE = int(os.environ.get('OG_FIREBASE_POOL_SIZE', 10))
+# Amount of seconds before the access token expires that it is refreshed in the background
+FIREBASE_TOKEN_REFRESH_MARGIN = int(os.environ.get('OG_FIREBASE_TOKEN_REFRESH_MARGIN', 5 * 60))
 
 # Reader details
 READER_VENDOR_ID = os.environ.get('OG_READER_VENDOR_ID', '0xffff')
 READER_PRODUCT_ID = os.environ.get('OG_READER_PRODUCT_ID', '0x0035')
+# Locations (or device paths) of the readers set up to type the NFC UID as 10 decimal digits, ["*"] for all readers.
+# The 10 digit reads of the other readers are passed on as data, e.g. the 125 kHz EM readers type 10 digits as well
+READER_DECIMAL_UID_LOCATIONS = json.loads(os.environ.get('OG_READER_DECIMAL_UID_LOCATIONS', '[]'))
+# Amount of seconds between scans for readers that were plugged in or unplugged, in case the kernel uevents are missed
+READER_RESCAN_INTERVAL = float(os.environ.get('OG_READER_RESCAN_INTERVAL', 5.0))
+# Amount of seconds a card read again is ignored (a card held on the reader a moment too long), 0 passes every read
+CARD_DEDUPLICATION_WINDOW = float(os.environ.get('OG_CARD_DEDUPLICATION_WINDOW', 2.0))
 
 # Sentry details
 SENTRY_DSN = os.environ.get('OG_SENTRY_DSN', None)
@@ -46,3 +72,56 @@ SLACK_USERNAME = os.environ.get('OG_SLACK_USERNAME', 'Kontor Spill')
 SLACK_AVATAR_URL = os.environ.get('OG_SLACK_AVATAR_URL', None)
 SLACK_DEFAULT_USER_AVATAR_URL = os.environ.get('OG_SLACK_DEFAULT_USER_AVATAR_URL', 'https://capralifecycle.github.io/office-games-viewer/capra.png')
 SLACK_SYNC_INTERVAL = os.environ.get('OG_SLACK_SYNC_INTERVAL', 3600)
+# Amount of seconds a Slack message waits for other messages to the same channel, to send them as one post
+SLACK_OUTBOX_COALESCE_SECONDS = float(os.environ.get('OG_SLACK_OUTBOX_COALESCE_SECONDS', 1.0))
+# Maximum amount of Slack messages waiting to be sent per channel, the oldest message is dropped when it is full
+SLACK_OUTBOX_MAX_SIZE = int(os.environ.get('OG_SLACK_OUTBOX_MAX_SIZE', 100))
+# Amount of times a Slack message is sent before it is given up (when rate limited or Slack can not be reached)
+SLACK_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OG_SLACK_OUTBOX_MAX_ATTEMPTS', 5))
+# Maximum amount of seconds between attempts to send a Slack message when Slack can not be reached
+SLACK_OUTBOX_MAX_RETRY_INTERVAL = int(os.environ.get('OG_SLACK_OUTBOX_MAX_RETRY_INTERVAL', 60))
+
+# Cache details
+# Amount of seconds a card, player or player statistic read on its own is cached (streamed nodes do not expire)
+CACHE_TTL = int(os.environ.get('OG_CACHE_TTL', 60 * 60))
+# Maximum amount of entries in each of the caches (cards, players and player statistics per game)
+CACHE_MAX_SIZE = int(os.environ.get('OG_CACHE_MAX_SIZE', 5000))
+# Keep the cache up to date by subscribing to Firebase streams?
+CACHE_STREAMING_ENABLED = os.environ.get('OG_CACHE_STREAMING_ENABLED', 'True').lower() == 'true'
+# Bulk load the cards, players and player statistics into the cache when the game starts?
+CACHE_WARM_UP_ENABLED = os.environ.get('OG_CACHE_WARM_UP_ENABLED', 'False').lower() == 'true'
+# Amount of parallel requests used to warm up the cache
+CACHE_WARM_UP_WORKERS = int(os.environ.get('OG_CACHE_WARM_UP_WORKERS', 8))
+
+# Listener details
+# Maximum amount of game events waiting to be handled by a listener
+LISTENER_MAX_BACKLOG = int(os.environ.get('OG_LISTENER_MAX_BACKLOG', 100))
+# What to do when the backlog of a listener is full: drop_oldest, drop_newest or block
+LISTENER_OVERFLOW_POLICY = os.environ.get('OG_LISTENER_OVERFLOW_POLICY', 'drop_oldest')
+
+# Journal details
+# Commit the game results to a local journal first and push them to Firebase in the background?
+JOURNAL_ENABLED = os.environ.get('OG_JOURNAL_ENABLED', 'True').lower() == 'true'
+# Path of the SQLite database of the journal, on the persistent data volume of the device (/data on resin.io), the
+# results that are only in the journal must survive a restart of the container
+JOURNAL_PATH = os.environ.get('OG_JOURNAL_PATH', '/data/journal.sqlite3')
+# Maximum amount of seconds between attempts to push the journal when Firebase can not be reached
+JOURNAL_MAX_RETRY_INTERVAL = int(os.environ.get('OG_JOURNAL_MAX_RETRY_INTERVAL', 60))
+# Amount of times an entry that Firebase rejects (a 4xx response other than 401 and 429) is retried before it is set
+# aside, the other errors are retried until the entry goes through
+JOURNAL_MAX_ATTEMPTS = int(os.environ.get('OG_JOURNAL_MAX_ATTEMPTS', 5))
+# Seconds of history the incremental exports and backups read again, the results replayed from a journal are added
+# with the (older) keys of the time they were played. Keep it above the longest time a device can be offline.
+HISTORY_RESUME_MARGIN = int(os.environ.get('OG_HISTORY_RESUME_MARGIN', 7 * 24 * 60 * 60))
+
+# Metrics details
+# Address the metrics endpoint (Prometheus text format, /metrics) listens on
+METRICS_HOST = os.environ.get('OG_METRICS_HOST', '127.0.0.1')
+# Port of the metrics endpoint, 0 disables it
+METRICS_PORT = int(os.environ.get('OG_METRICS_PORT', 9464))
+# Amount of seconds between the metrics summaries in the log, 0 disables them
+METRICS_LOG_INTERVAL = int(os.environ.get('OG_METRICS_LOG_INTERVAL', 300))
+
+# Asyncio details
+# Run the game, the readers and the Firebase/Slack requests on an asyncio event loop instead of threads?
+ASYNC_MODE = os.environ.get('OG_ASYNC_MODE', 'False').lower() == 'true'
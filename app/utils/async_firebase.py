@@ -0,0 +1,66 @@
+import json
+
+from app.settings import FIREBASE_POOL_SIZE, FIREBASE_TIMEOUT
+from app.utils.imports import lazy_import
+
+# Only the asyncio mode needs them
+asyncio = lazy_import('asyncio')
+aiohttp = lazy_import('aiohttp')
+
+
+class AsyncFirebase:
+    """Minimal asyncio client for the Firebase Realtime Database REST API"""
+
+    def __init__(self, firebase, loop=None):
+        # The pyrebase application provides the database URL and the service account credentials
+        self.firebase = firebase
+        self.database_url = firebase.database_url.rstrip('/')
+        self.loop = loop or asyncio.get_event_loop()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=FIREBASE_POOL_SIZE, loop=self.loop),
+            loop=self.loop
+        )
+
+    async def _build_headers(self):
+        headers = {'content-type': 'application/json; charset=UTF-8'}
+        if self.firebase.credentials:
+            # The access token is cached by the credentials, it only blocks when the token has to be refreshed
+            access_token = await self.loop.run_in_executor(
+                None,
+                lambda: self.firebase.credentials.get_access_token().access_token
+            )
+            headers['Authorization'] = f'Bearer {access_token}'
+        return headers
+
+    async def _request(self, method, path, data=None, params=None):
+        url = f'{self.database_url}/{path.strip("/")}.json'
+        async with self.session.request(
+                method,
+                url,
+                params=params,
+                data=json.dumps(data).encode('utf-8') if data is not None else None,
+                headers=await self._build_headers(),
+                timeout=FIREBASE_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def get(self, path, shallow=False):
+        return await self._request('GET', path, params={'shallow': 'true'} if shallow else None)
+
+    async def set(self, path, data):
+        return await self._request('PUT', path, data)
+
+    async def update(self, path, data):
+        return await self._request('PATCH', path, data)
+
+    async def push(self, path, data):
+        return await self._request('POST', path, data)
+
+    async def remove(self, path):
+        return await self._request('DELETE', path)
+
+    def generate_key(self):
+        return self.firebase.database().generate_key()
+
+    async def close(self):
+        await self.session.close()
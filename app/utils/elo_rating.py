@@ -1,3 +1,14 @@
+from collections import namedtuple
+
+# Ratings closer than this to .5 are rounded with calculate_new_rating() in the batch calculation, so that a last bit
+# difference of NumPy's power() can not round them the other way
+ROUNDING_GUARD = 1e-9
+
+EloTrajectories = namedtuple('EloTrajectories', [
+    'winner_ratings_before', 'winner_ratings', 'loser_ratings_before', 'loser_ratings', 'final_ratings'
+])
+
+
 # From https://github.com/rshk/elo/blob/master/elo.py
 def expected(a, b):
     """
@@ -19,10 +30,82 @@ def elo(old, exp, score, k=32):
     return old + k * (score - exp)
 
 
-def calculate_new_rating(player_rating, opponent_rating, player_won):
+def calculate_new_rating(player_rating, opponent_rating, player_won, k=32):
     return round(elo(
         player_rating,
         expected(player_rating, opponent_rating),
         1 if player_won else 0,
-        k=32
+        k=k
     ))
+
+
+def import_numpy():
+    """Returns numpy, it is only needed by the batch calculations (and not installed on the readers)"""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('The batch rating calculations need NumPy: pip install numpy')
+    return numpy
+
+
+def get_session_layers(winners, losers):
+    """
+    Split chronologically ordered 1 vs 1 sessions into layers that can be calculated at the same time.
+
+    A session is in the layer after the last session of both its players, so the sessions of a layer have no players
+    in common and every player still gets its sessions in chronological order. Returns a list of index arrays.
+    """
+    np = import_numpy()
+    player_layers = {}
+    layers = np.empty(len(winners), dtype=np.int64)
+    for i, (winner, loser) in enumerate(zip(winners.tolist(), losers.tolist())):
+        layer = max(player_layers.get(winner, -1), player_layers.get(loser, -1)) + 1
+        layers[i] = player_layers[winner] = player_layers[loser] = layer
+    order = np.argsort(layers, kind='stable')
+    boundaries = np.flatnonzero(np.diff(layers[order])) + 1
+    return np.split(order, boundaries)
+
+
+def calculate_rating_trajectories(winners, losers, player_count, k_factors=(32,), initial_rating=1200):
+    """
+    Calculate the Elo ratings of a whole history of 1 vs 1 sessions, for several K-factors at once.
+
+    `winners` and `losers` are the player indices (0 to player_count - 1) of the sessions in chronological order.
+    Returns EloTrajectories with the ratings of the players before and after every session, as arrays of
+    (K-factor, session), and the final ratings as an array of (K-factor, player). The ratings are the same, bit for
+    bit, as calculate_new_rating() applied session by session.
+    """
+    np = import_numpy()
+    winners = np.asarray(winners, dtype=np.int64)
+    losers = np.asarray(losers, dtype=np.int64)
+    k = np.asarray(k_factors, dtype=np.float64)[:, np.newaxis]
+    ratings = np.full((len(k_factors), player_count), initial_rating, dtype=np.int64)
+    shape = (len(k_factors), len(winners))
+    trajectories = EloTrajectories(*[np.empty(shape, dtype=np.int64) for _ in range(4)], final_ratings=ratings)
+
+    def round_ratings(new_ratings, player_ratings, opponent_ratings, player_won):
+        rounded = np.rint(new_ratings).astype(np.int64)
+        for i, j in zip(*np.nonzero(np.abs(new_ratings - np.floor(new_ratings) - 0.5) < ROUNDING_GUARD)):
+            rounded[i, j] = calculate_new_rating(int(player_ratings[i, j]), int(opponent_ratings[i, j]), player_won,
+                                                 k=k_factors[i])
+        return rounded
+
+    for layer in get_session_layers(winners, losers):
+        layer_winners = winners[layer]
+        layer_losers = losers[layer]
+        winner_ratings = ratings[:, layer_winners]
+        loser_ratings = ratings[:, layer_losers]
+        # The same operations in the same order as expected() and elo()
+        winner_expected = 1 / (1 + 10 ** ((loser_ratings - winner_ratings) / 400))
+        loser_expected = 1 / (1 + 10 ** ((winner_ratings - loser_ratings) / 400))
+        new_winner_ratings = round_ratings(winner_ratings + k * (1 - winner_expected), winner_ratings, loser_ratings,
+                                           True)
+        new_loser_ratings = round_ratings(loser_ratings + k * (0 - loser_expected), loser_ratings, winner_ratings,
+                                          False)
+        ratings[:, layer_winners] = new_winner_ratings
+        ratings[:, layer_losers] = new_loser_ratings
+        trajectories.winner_ratings_before[:, layer] = winner_ratings
+        trajectories.winner_ratings[:, layer] = new_winner_ratings
+        trajectories.loser_ratings_before[:, layer] = loser_ratings
+        trajectories.loser_ratings[:, layer] = new_loser_ratings
+    return trajectories
@@ -1,26 +1,220 @@
+import datetime
+import logging
+import threading
+
+import httplib2
+from oauth2client.client import AccessTokenInfo
 from pyrebase import pyrebase
 
 from app.settings import (FIREBASE_API_KEY, FIREBASE_AUTH_DOMAIN, FIREBASE_AUTH_PROVIDER_X509_CERT_URL,
                           FIREBASE_AUTH_URI, FIREBASE_CLIENT_EMAIL, FIREBASE_CLIENT_ID, FIREBASE_CLIENT_X509_CERT_URL,
-                          FIREBASE_DATABASE_URL, FIREBASE_PRIVATE_KEY, FIREBASE_PRIVATE_KEY_ID, FIREBASE_STORAGE_BUCKET,
-                          FIREBASE_TOKEN_URI, FIREBASE_TYPE)
+                          FIREBASE_CONNECT_TIMEOUT, FIREBASE_DATABASE_URL, FIREBASE_POOL_SIZE, FIREBASE_PRIVATE_KEY,
+                          FIREBASE_PRIVATE_KEY_ID, FIREBASE_STORAGE_BUCKET, FIREBASE_TIMEOUT,
+                          FIREBASE_TOKEN_REFRESH_MARGIN, FIREBASE_TOKEN_URI, FIREBASE_TYPE)
+from app.utils.http import MetricsHTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_firebase = None
+_firebase_lock = threading.Lock()
+# Characters of push keys, the first 8 characters of a key are its creation time in milliseconds
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
+class RefreshAheadCredentials:
+    """
+    Wraps the service account credentials and refreshes the access token in the background shortly before it expires,
+    so requests do not have to wait for a token exchange. Everything else is delegated to the wrapped credentials.
+    """
+
+    def __init__(self, credentials, refresh_margin=FIREBASE_TOKEN_REFRESH_MARGIN):
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        # Only used (and reused) for the token exchange, httplib2 keeps the connection to the token endpoint open
+        self.http = httplib2.Http(timeout=FIREBASE_TIMEOUT)
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_thread_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.credentials, name)
+
+    def _get_seconds_left(self):
+        if self.credentials.access_token is None or self.credentials.token_expiry is None:
+            return 0
+        # oauth2client stores the expiry as a naive UTC datetime
+        return (self.credentials.token_expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def _refresh(self):
+        with self.refresh_lock:
+            # Another thread may have refreshed the token while we were waiting for the lock
+            if self._get_seconds_left() > self.refresh_margin:
+                return
+            self.credentials.refresh(self.http)
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            # The token is still valid, the next request will try again
+            logger.exception('Could not refresh the Firebase access token')
+
+    def get_access_token(self, http=None):
+        seconds_left = self._get_seconds_left()
+        if seconds_left <= 0:
+            self._refresh()
+        elif seconds_left <= self.refresh_margin:
+            with self.refresh_thread_lock:
+                if self.refresh_thread is None or not self.refresh_thread.is_alive():
+                    self.refresh_thread = threading.Thread(target=self._refresh_in_background, name='TokenRefresh')
+                    self.refresh_thread.daemon = True
+                    self.refresh_thread.start()
+        return AccessTokenInfo(
+            access_token=self.credentials.access_token,
+            expires_in=int(self._get_seconds_left())
+        )
+
+
+class PooledFirebase(pyrebase.Firebase):
+    """
+    pyrebase application that is shared by the whole process.
+
+    Requests go through a keep-alive connection pool with timeouts, the access token is refreshed ahead of time and
+    every thread reuses its own Database object instead of creating a new one for every access.
+    """
+
+    def __init__(self, config):
+        super(PooledFirebase, self).__init__(config)
+        adapter = MetricsHTTPAdapter(
+            'firebase',
+            timeout=(FIREBASE_CONNECT_TIMEOUT, FIREBASE_TIMEOUT),
+            pool_connections=FIREBASE_POOL_SIZE,
+            pool_maxsize=FIREBASE_POOL_SIZE,
+            max_retries=3
+        )
+        for scheme in ('http://', 'https://'):
+            self.requests.mount(scheme, adapter)
+        if self.credentials:
+            self.credentials = RefreshAheadCredentials(self.credentials)
+        self.local = threading.local()
+
+    def database(self):
+        database = getattr(self.local, 'database', None)
+        if database is None:
+            database = super(PooledFirebase, self).database()
+            self.local.database = database
+        # A query that failed half way leaves its path behind, every access starts from the root
+        database.path = ''
+        database.build_query = {}
+        return database
+
+    def get_shallow(self, path):
+        """
+        Shallow query of the node at path, objects are truncated to True and primitives are returned as they are.
+
+        pyrebase only returns the keys of a shallow query, this keeps the values.
+        """
+        database = self.database()
+        response = self.requests.get(
+            f'{database.database_url}{path.strip("/")}.json',
+            params={'shallow': 'true'},
+            headers=database.build_headers()
+        )
+        response.raise_for_status()
+        return response.json()
 
 
 def get_firebase():
-    return pyrebase.initialize_app({
-        'apiKey': FIREBASE_API_KEY,
-        'databaseURL': FIREBASE_DATABASE_URL,
-        'storageBucket': FIREBASE_STORAGE_BUCKET,
-        'authDomain': FIREBASE_AUTH_DOMAIN,
-        'serviceAccount': {
-            'type': FIREBASE_TYPE,
-            'private_key_id': FIREBASE_PRIVATE_KEY_ID,
-            'private_key': FIREBASE_PRIVATE_KEY.replace('\\n', '\n'),
-            'client_email': FIREBASE_CLIENT_EMAIL,
-            'client_id': FIREBASE_CLIENT_ID,
-            'auth_uri': FIREBASE_AUTH_URI,
-            'token_uri': FIREBASE_TOKEN_URI,
-            'auth_provider_x509_cert_url': FIREBASE_AUTH_PROVIDER_X509_CERT_URL,
-            'client_x509_cert_url': FIREBASE_CLIENT_X509_CERT_URL
-        }
-    })
\ No newline at end of file
+    """Returns the Firebase application of the process, it is created on the first call"""
+    global _firebase
+    with _firebase_lock:
+        if _firebase is None:
+            _firebase = PooledFirebase({
+                'apiKey': FIREBASE_API_KEY,
+                'databaseURL': FIREBASE_DATABASE_URL,
+                'storageBucket': FIREBASE_STORAGE_BUCKET,
+                'authDomain': FIREBASE_AUTH_DOMAIN,
+                'serviceAccount': {
+                    'type': FIREBASE_TYPE,
+                    'private_key_id': FIREBASE_PRIVATE_KEY_ID,
+                    'private_key': FIREBASE_PRIVATE_KEY.replace('\\n', '\n'),
+                    'client_email': FIREBASE_CLIENT_EMAIL,
+                    'client_id': FIREBASE_CLIENT_ID,
+                    'auth_uri': FIREBASE_AUTH_URI,
+                    'token_uri': FIREBASE_TOKEN_URI,
+                    'auth_provider_x509_cert_url': FIREBASE_AUTH_PROVIDER_X509_CERT_URL,
+                    'client_x509_cert_url': FIREBASE_CLIENT_X509_CERT_URL
+                }
+            })
+        return _firebase
+
+
+def iter_children(firebase, path, start_after=None, page_size=1000):
+    """Yields the (key, value) pairs of the children of path in key order, fetched page by page"""
+    last_key = start_after
+    while True:
+        query = firebase.database().child(path).order_by_key()
+        if last_key is not None:
+            # start_at() is inclusive, the first child of the page is the last child of the previous page
+            query = query.start_at(last_key).limit_to_first(page_size + 1)
+        else:
+            query = query.limit_to_first(page_size)
+        page = query.get().val()
+        if not page:
+            return
+        children = [(key, value) for key, value in page.items() if key != last_key]
+        if not children:
+            return
+        yield from children
+        last_key = children[-1][0]
+
+
+def get_push_key_time(key):
+    """Returns the creation time of a push key in milliseconds since the epoch, None for other keys"""
+    if len(key) != 20 or any(char not in PUSH_CHARS for char in key):
+        return None
+    milliseconds = 0
+    for char in key[:8]:
+        milliseconds = milliseconds * 64 + PUSH_CHARS.index(char)
+    return milliseconds
+
+
+def get_resume_key(last_key, margin):
+    """
+    Returns the key to continue reading a history after: `margin` seconds of push keys before last_key. The results
+    replayed from a journal keep the key of the time they were played, they are added before the last key read.
+    """
+    milliseconds = get_push_key_time(last_key) if last_key is not None else None
+    if milliseconds is None:
+        return last_key
+    milliseconds = max(milliseconds - int(margin * 1000), 0)
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[milliseconds % 64])
+        milliseconds //= 64
+    # Sorts before every push key created at that time
+    return ''.join(reversed(time_chars))
+
+
+class BatchedUpdate:
+    """Collects multi-path updates and writes them to Firebase in batches of (at most about) `batch_size` paths"""
+
+    def __init__(self, firebase, batch_size=500):
+        self.firebase = firebase
+        self.batch_size = batch_size
+        self.updates = {}
+        self.written_paths = 0
+        self.requests = 0
+
+    def update(self, updates):
+        self.updates.update(updates)
+        if len(self.updates) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.updates:
+            return
+        self.firebase.database().update(self.updates)
+        self.written_paths += len(self.updates)
+        self.requests += 1
+        self.updates = {}
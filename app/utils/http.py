@@ -0,0 +1,50 @@
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from app.utils.metrics import metrics
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout, requests waits forever for a response unless a timeout is given"""
+
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super(TimeoutHTTPAdapter, self).send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+class MetricsHTTPAdapter(TimeoutHTTPAdapter):
+    """
+    Records the latency of every request in the http_request_seconds histogram of `service`, per method and endpoint,
+    and counts the failed requests. The endpoint is the path segment at `endpoint_segment` (e.g. the top level
+    Firebase node, or the Slack API method), so the amount of label values stays small.
+    """
+
+    def __init__(self, service, endpoint_segment=0, timeout=None, *args, **kwargs):
+        self.service = service
+        self.endpoint_segment = endpoint_segment
+        super(MetricsHTTPAdapter, self).__init__(timeout, *args, **kwargs)
+
+    def _get_endpoint(self, request):
+        path = urlparse(request.url).path
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        segments = [segment for segment in path.split('/') if segment]
+        # The root of the Firebase database (multi-path updates)
+        return segments[self.endpoint_segment] if segments else '/'
+
+    def send(self, request, **kwargs):
+        endpoint = self._get_endpoint(request)
+        try:
+            with metrics.time('http_request_seconds', service=self.service, method=request.method, endpoint=endpoint):
+                response = super(MetricsHTTPAdapter, self).send(request, **kwargs)
+        except Exception:
+            metrics.increment('http_errors_total', service=self.service, endpoint=endpoint, status='error')
+            raise
+        if response.status_code >= 400:
+            metrics.increment('http_errors_total', service=self.service, endpoint=endpoint,
+                              status=response.status_code)
+        return response
@@ -0,0 +1,115 @@
+import importlib.abc
+import importlib.util
+import sys
+import threading
+import time
+
+
+class MissingModule:
+    """Stands in for a module that is not installed, the ImportError is raised when the module is used"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        raise ModuleNotFoundError(f'No module named {self._name!r}', name=self._name)
+
+
+def lazy_import(name):
+    """
+    Returns the module `name`, which is only loaded when one of its attributes is used for the first time. For the
+    modules that are slow to import and only needed by some commands or modes (e.g. aiohttp for the asyncio mode).
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, import_timer):
+        self.loader = loader
+        self.import_timer = import_timer
+
+    def __getattr__(self, name):
+        # get_source(), is_package() and friends of the wrapped loader
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.import_timer.start(module.__name__)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.import_timer.stop(module.__name__)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Measures how long every module takes to import, by itself and with the modules it imports. It goes first in
+    sys.meta_path and wraps the loaders the other finders return, see run.py --import-times.
+    """
+
+    def __init__(self):
+        # Module -> (seconds with the modules it imports, seconds by itself)
+        self.times = {}
+        self.local = threading.local()
+
+    @classmethod
+    def install(cls):
+        import_timer = cls()
+        sys.meta_path.insert(0, import_timer)
+        return import_timer
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = TimedLoader(spec.loader, self)
+        return spec
+
+    def _get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def start(self, name):
+        # [started, seconds spent importing the modules it imports]
+        self._get_stack().append([time.perf_counter(), 0.0])
+
+    def stop(self, name):
+        stack = self._get_stack()
+        started, children_seconds = stack.pop()
+        seconds = time.perf_counter() - started
+        if stack:
+            stack[-1][1] += seconds
+        self.times[name] = (seconds, seconds - children_seconds)
+
+    def get_total_seconds(self):
+        return sum(own_seconds for _, own_seconds in self.times.values())
+
+    def format_report(self, limit=30):
+        lines = [f'{"Cumulative ms":>14}{"Self ms":>10}  Module']
+        by_cumulative_time = sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (seconds, own_seconds) in by_cumulative_time[:limit]:
+            lines.append(f'{seconds * 1000:>14.1f}{own_seconds * 1000:>10.1f}  {name}')
+        lines.append(f'{len(self.times)} modules imported in {self.get_total_seconds() * 1000:.1f} ms')
+        return '\n'.join(lines)
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from requests.exceptions import HTTPError
+
+from app.settings import JOURNAL_MAX_ATTEMPTS, JOURNAL_MAX_RETRY_INTERVAL, JOURNAL_PATH
+
+logger = logging.getLogger(__name__)
+
+# Statuses in the 4xx range that do not reject the update itself: the access token expired or the requests are rate
+# limited, the update succeeds when it is sent again later
+RETRIED_CLIENT_ERROR_STATUSES = {401, 429}
+
+
+def _get_status_code(error):
+    # pyrebase wraps the HTTPError of requests in another HTTPError, without the response
+    response = getattr(error, 'response', None)
+    if response is None and error.args and isinstance(error.args[0], HTTPError):
+        response = error.args[0].response
+    return response.status_code if response is not None else None
+
+
+def is_rejection(error):
+    """Did Firebase reject the update (a 4xx response other than 401 and 429), so sending it again will not help?"""
+    if not isinstance(error, HTTPError):
+        return False
+    status_code = _get_status_code(error)
+    return status_code is not None and 400 <= status_code < 500 and status_code not in RETRIED_CLIENT_ERROR_STATUSES
+
+
+class Journal:
+    """
+    Durable local journal of Firebase multi-path updates, stored in SQLite (WAL mode).
+
+    An update is committed to the journal before it is sent to Firebase, so it survives network outages and restarts
+    of the client. Entries are replayed in the order they were appended.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        logger.info(f'Journal at {self.path}')
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Results are the one thing we can not lose, wait for the disk on every commit
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'created REAL NOT NULL, '
+            'updates TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'failed INTEGER NOT NULL DEFAULT 0, '
+            'last_error TEXT)'
+        )
+
+    def append(self, updates):
+        with self.lock:
+            cursor = self.connection.execute(
+                'INSERT INTO entries (created, updates) VALUES (?, ?)',
+                (time.time(), json.dumps(updates))
+            )
+            return cursor.lastrowid
+
+    def get_pending(self, limit=100):
+        """Returns the oldest entries that have not been replayed yet, as (id, updates) tuples (limit=None for all)"""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, updates FROM entries WHERE failed = 0 ORDER BY id LIMIT ?',
+                (limit if limit is not None else -1,)
+            ).fetchall()
+        return [(entry_id, json.loads(updates)) for entry_id, updates in rows]
+
+    def remove(self, entry_id):
+        with self.lock:
+            self.connection.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+
+    def record_error(self, entry_id, error, max_attempts=JOURNAL_MAX_ATTEMPTS):
+        """Count a failed replay of the entry, returns True if the entry has been given up on"""
+        with self.lock:
+            self.connection.execute(
+                'UPDATE entries SET attempts = attempts + 1, last_error = ?, failed = attempts + 1 >= ? WHERE id = ?',
+                (str(error), max_attempts, entry_id)
+            )
+            failed, = self.connection.execute('SELECT failed FROM entries WHERE id = ?', (entry_id,)).fetchone()
+        return bool(failed)
+
+    def get_stats(self):
+        with self.lock:
+            pending, failed = self.connection.execute(
+                'SELECT COALESCE(SUM(failed = 0), 0), COALESCE(SUM(failed = 1), 0) FROM entries'
+            ).fetchone()
+        return {
+            'pending': pending,
+            'failed': failed
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JournalReplayer(threading.Thread):
+    """
+    Pushes the journal entries to Firebase in the background, in order.
+
+    The updates carry client generated keys and absolute values, so replaying an entry that already reached Firebase
+    (e.g. the connection dropped before the response) writes the same data again. A failing entry stops the replay and
+    is retried with an exponential backoff, for as long as it takes (network errors, 5xx, 401 and 429 responses and
+    anything unexpected), so the entries after it never overtake it. Only an entry Firebase rejects (another 4xx
+    response) is set aside, after JOURNAL_MAX_ATTEMPTS attempts, so it does not hold up the rest forever. on_done is
+    called with the ID of every entry that has been replayed or set aside.
+    """
+
+    def __init__(self, journal, firebase, max_retry_interval=JOURNAL_MAX_RETRY_INTERVAL, on_done=None):
+        threading.Thread.__init__(self, name='JournalReplayer')
+        self.daemon = True
+        self.journal = journal
+        self.firebase = firebase
+        self.max_retry_interval = max_retry_interval
+        self.on_done = on_done
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.replayed_entries = 0
+        self.failed_entries = 0
+        self.last_error = None
+
+    def wake(self):
+        """Replay the journal now instead of waiting for the next retry"""
+        self.wakeup.set()
+
+    def run(self):
+        retry_interval = 1
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                if self._replay():
+                    retry_interval = 1
+                    self.wakeup.wait()
+                    continue
+            except Exception as e:
+                # Firebase can not be reached or fails, keep the entries and try again later
+                self.last_error = e
+                logger.warning(f'Could not replay the journal, retrying in {retry_interval} seconds: {e}')
+            # New entries do not mean that Firebase is back, only stop() interrupts the backoff
+            self.stopped.wait(retry_interval)
+            retry_interval = min(retry_interval * 2, self.max_retry_interval)
+
+    def _replay(self):
+        """Replay the pending entries in order, returns False if an entry failed and the rest has to wait"""
+        while not self.stopped.is_set():
+            entries = self.journal.get_pending()
+            if not entries:
+                return True
+            for entry_id, updates in entries:
+                if self.stopped.is_set():
+                    return True
+                try:
+                    self.firebase.database().update(updates)
+                except Exception as e:
+                    if not is_rejection(e):
+                        raise
+                    self.last_error = e
+                    if not self.journal.record_error(entry_id, e):
+                        logger.warning(f'Firebase rejected journal entry #{entry_id}: {e}')
+                        return False
+                    # Set aside, the entries after it go on
+                    self.failed_entries += 1
+                    logger.error(f'Gave up replaying journal entry #{entry_id}: {e}')
+                    self._done(entry_id)
+                    continue
+                self.journal.remove(entry_id)
+                self.replayed_entries += 1
+                self._done(entry_id)
+        return True
+
+    def _done(self, entry_id):
+        if self.on_done is not None:
+            self.on_done(entry_id)
+
+    def stop(self, timeout=None):
+        """Stop replaying, the remaining entries are replayed the next time the client starts"""
+        self.stopped.set()
+        self.wakeup.set()
+        self.join(timeout)
+
+    def get_stats(self):
+        return {
+            **self.journal.get_stats(),
+            'replayed': self.replayed_entries,
+            'given_up': self.failed_entries,
+            'last_error': str(self.last_error) if self.last_error is not None else None
+        }
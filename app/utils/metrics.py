@@ -0,0 +1,237 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from app.settings import METRICS_HOST, METRICS_LOG_INTERVAL, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the metric names
+METRICS_PREFIX = 'officegames'
+# Upper bounds (in seconds) of the histogram buckets, from a cached lookup to a request that timed out
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels, extra_label=None):
+    labels = list(labels) + ([extra_label] if extra_label is not None else [])
+    if not labels:
+        return ''
+    formatted = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels
+    )
+    return '{' + formatted + '}'
+
+
+class Histogram:
+    __slots__ = ['buckets', 'counts', 'sum', 'count', 'lock']
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def get_quantile(self, quantile):
+        """Upper bound of the bucket the quantile falls in (the largest bucket bound for the +Inf bucket)"""
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return 0.0
+        rank = quantile * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Timer:
+    """Context manager that observes the seconds spent in it"""
+
+    __slots__ = ['histogram', 'started']
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metrics:
+    """
+    Process wide histograms and counters, identified by a name and labels.
+
+    Recording is a dictionary lookup and a short lock, so it can be used on the card read path. The metrics are
+    exposed in the Prometheus text format (see MetricsServer) and logged periodically (see MetricsLogger).
+    """
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def time(self, name, **labels):
+        return Timer(self.histogram(name, **labels))
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def render_prometheus(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), histogram in histograms:
+            metric_name = f'{self.prefix}_{name}'
+            if name != last_name:
+                lines.append(f'# TYPE {metric_name} histogram')
+                last_name = name
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total = histogram.sum
+                count = histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric_name}_bucket{_format_labels(labels, ("le", repr(bound)))} {cumulative}')
+            lines.append(f'{metric_name}_bucket{_format_labels(labels, ("le", "+Inf"))} {count}')
+            lines.append(f'{metric_name}_sum{_format_labels(labels)} {total!r}')
+            lines.append(f'{metric_name}_count{_format_labels(labels)} {count}')
+
+        last_name = None
+        for (name, labels), value in counters:
+            metric_name = f'{self.prefix}_{name}'
+            if name != last_name:
+                lines.append(f'# TYPE {metric_name} counter')
+                last_name = name
+            lines.append(f'{metric_name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def get_summary(self):
+        """One line per metric with the count, the average and the (bucket) p50/p95/p99 in milliseconds"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        for (name, labels), histogram in histograms:
+            if not histogram.count:
+                continue
+            lines.append(
+                f'{name}{_format_labels(labels)}: count={histogram.count} '
+                f'avg={histogram.sum / histogram.count * 1000:.1f}ms '
+                f'p50<={histogram.get_quantile(0.5) * 1000:g}ms '
+                f'p95<={histogram.get_quantile(0.95) * 1000:g}ms '
+                f'p99<={histogram.get_quantile(0.99) * 1000:g}ms'
+            )
+        for (name, labels), value in counters:
+            lines.append(f'{name}{_format_labels(labels)}: {value}')
+        return lines
+
+
+metrics = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(threading.Thread):
+    """Serves the metrics in the Prometheus text format on http://<host>:<port>/metrics"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        threading.Thread.__init__(self, name='MetricsServer')
+        self.daemon = True
+        self.server = HTTPServer((host, port), MetricsRequestHandler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLogger(threading.Thread):
+    """Logs a summary of the metrics every `interval` seconds"""
+
+    def __init__(self, interval=METRICS_LOG_INTERVAL):
+        threading.Thread.__init__(self, name='MetricsLogger')
+        self.daemon = True
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            summary = metrics.get_summary()
+            if summary:
+                logger.info('Metrics:\n' + '\n'.join(summary))
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_metrics():
+    """Start the metrics endpoint and the periodic summary (the ones that are enabled), returns the started threads"""
+    threads = []
+    if METRICS_PORT:
+        try:
+            threads.append(MetricsServer())
+        except OSError:
+            logger.exception(f'Could not serve the metrics on {METRICS_HOST}:{METRICS_PORT}')
+    if METRICS_LOG_INTERVAL:
+        threads.append(MetricsLogger())
+    for thread in threads:
+        thread.start()
+    return threads
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+from app.settings import (SLACK_OUTBOX_COALESCE_SECONDS, SLACK_OUTBOX_MAX_ATTEMPTS, SLACK_OUTBOX_MAX_RETRY_INTERVAL,
+                          SLACK_OUTBOX_MAX_SIZE, SLACK_USERNAME)
+
+logger = logging.getLogger(__name__)
+
+# Slack does not show more than 20 attachments in one message, it is also the maximum amount of merged messages
+MAX_MESSAGES_PER_POST = 20
+# Seconds to wait after a 429 response without a Retry-After header
+DEFAULT_RETRY_AFTER = 20
+
+
+class OutboxMessage:
+    __slots__ = ['text', 'attachments', 'collapse_key', 'count', 'queued_time', 'attempts']
+
+    def __init__(self, text, attachments, collapse_key):
+        self.text = text
+        self.attachments = attachments
+        self.collapse_key = collapse_key
+        # Amount of identical messages collapsed into this one
+        self.count = 1
+        self.queued_time = time.monotonic()
+        self.attempts = 0
+
+    def get_text(self):
+        return self.text if self.count == 1 else f'{self.text} (x{self.count})'
+
+
+class SlackOutbox(threading.Thread):
+    """
+    Posts Slack messages from a background thread, with a queue per channel.
+
+    A message waits `coalesce_seconds` before it is posted, so that a burst of messages to the same channel is sent as
+    one post: attachments are merged into one message, texts are joined, and messages with the same collapse key
+    (e.g. the same unknown card read over and over) are collapsed into one with a counter. A channel that is rate
+    limited waits for the Retry-After of Slack (or an exponential backoff on network errors) while the other channels
+    keep going.
+    """
+
+    def __init__(self, slack, username=SLACK_USERNAME, coalesce_seconds=SLACK_OUTBOX_COALESCE_SECONDS,
+                 max_size=SLACK_OUTBOX_MAX_SIZE, max_attempts=SLACK_OUTBOX_MAX_ATTEMPTS,
+                 max_retry_interval=SLACK_OUTBOX_MAX_RETRY_INTERVAL):
+        threading.Thread.__init__(self, name='SlackOutbox')
+        self.daemon = True
+        self.slack = slack
+        self.username = username
+        self.coalesce_seconds = coalesce_seconds
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.max_retry_interval = max_retry_interval
+        self.condition = threading.Condition()
+        self.stopped = False
+        # Channel -> queued messages, in the order the channels got their first message
+        self.channels = OrderedDict()
+        # Channel -> monotonic time before which the channel is not posted to (rate limits and backoff)
+        self.not_before = {}
+        self.queued_messages = 0
+        self.sent_messages = 0
+        self.sent_posts = 0
+        self.collapsed_messages = 0
+        self.dropped_messages = 0
+        self.failed_messages = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.requests = 0
+        self.total_request_seconds = 0.0
+
+    def post(self, channel, text, attachments=None, collapse_key=None):
+        """Queue a message, `text` is used as the log line (and fallback) when the message has attachments"""
+        with self.condition:
+            messages = self.channels.setdefault(channel, deque())
+            self.queued_messages += 1
+            if collapse_key is not None:
+                for message in messages:
+                    if message.collapse_key == collapse_key:
+                        message.count += 1
+                        self.collapsed_messages += 1
+                        return
+            if len(messages) >= self.max_size:
+                dropped_message = messages.popleft()
+                self.dropped_messages += dropped_message.count
+                logger.warning(f'Slack outbox of {channel} is full, dropped: {dropped_message.get_text()}')
+            messages.append(OutboxMessage(text, attachments, collapse_key))
+            self.condition.notify()
+
+    def _get_ready_channel(self):
+        """Returns (channel, None) for the next channel to post to, or (None, seconds to wait) when none is ready"""
+        now = time.monotonic()
+        wait = None
+        for channel, messages in self.channels.items():
+            if not messages:
+                continue
+            if self.stopped:
+                # Stopping flushes the queues right away, every message gets one last attempt
+                return channel, None
+            ready_time = max(self.not_before.get(channel, 0), messages[0].queued_time + self.coalesce_seconds)
+            if ready_time <= now:
+                return channel, None
+            wait = ready_time - now if wait is None else min(wait, ready_time - now)
+        return None, wait
+
+    def _take_batch(self, channel):
+        """Take the first message of the channel and the following messages of the same kind that fit in one post"""
+        messages = self.channels[channel]
+        batch = [messages.popleft()]
+        has_attachments = batch[0].attachments is not None
+        while messages and len(batch) < MAX_MESSAGES_PER_POST and \
+                (messages[0].attachments is not None) == has_attachments:
+            batch.append(messages.popleft())
+        return batch
+
+    def run(self):
+        while True:
+            with self.condition:
+                channel, wait = self._get_ready_channel()
+                while channel is None:
+                    if self.stopped and wait is None:
+                        return
+                    self.condition.wait(wait)
+                    channel, wait = self._get_ready_channel()
+                batch = self._take_batch(channel)
+            self._send(channel, batch)
+
+    def _send(self, channel, batch):
+        if batch[0].attachments is not None:
+            kwargs = {'attachments': [attachment for message in batch for attachment in message.attachments]}
+        else:
+            kwargs = {'text': '\n'.join(message.get_text() for message in batch)}
+        log_text = ' | '.join(message.get_text() for message in batch)
+
+        started = time.monotonic()
+        try:
+            self.slack.chat.post_message(channel=channel, username=self.username, **kwargs)
+        except HTTPError as e:
+            if e.response is None or e.response.status_code != 429:
+                self._fail(channel, batch, e)
+                return
+            self.rate_limited += 1
+            retry_after = int(e.response.headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+            self._retry(channel, batch, retry_after, e)
+            return
+        except (ConnectionError, Timeout) as e:
+            attempts = max(message.attempts for message in batch)
+            self._retry(channel, batch, min(2 ** attempts, self.max_retry_interval), e)
+            return
+        except Exception as e:
+            # Slack rejected the message (e.g. channel_not_found), sending it again will not help
+            self._fail(channel, batch, e)
+            return
+        finally:
+            self.requests += 1
+            self.total_request_seconds += time.monotonic() - started
+
+        sent_time = time.monotonic()
+        for message in batch:
+            latency = sent_time - message.queued_time
+            self.total_latency += latency * message.count
+            self.max_latency = max(self.max_latency, latency)
+            self.sent_messages += message.count
+        self.sent_posts += 1
+        logger.info(f'Slack message sent to {channel}: {log_text}')
+
+    def _retry(self, channel, batch, retry_after, error):
+        with self.condition:
+            retried = []
+            for message in batch:
+                message.attempts += 1
+                if message.attempts >= self.max_attempts or self.stopped:
+                    self.failed_messages += message.count
+                    logger.error(f'Gave up sending Slack message to {channel}: {message.get_text()} ({error})')
+                else:
+                    retried.append(message)
+            if not retried:
+                return
+            self.retries += 1
+            logger.warning(f'Could not send Slack message to {channel}, retrying in {retry_after} seconds: {error}')
+            # Back in front of the queue, the messages keep their order
+            self.channels[channel].extendleft(reversed(retried))
+            self.not_before[channel] = time.monotonic() + retry_after
+
+    def _fail(self, channel, batch, error):
+        self.failed_messages += sum(message.count for message in batch)
+        logger.error(f'Failed sending message to Slack {channel}: {error}')
+
+    def stop(self, timeout=None):
+        """Send the queued messages right away (without coalescing or retrying them) and stop"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.join(timeout)
+
+    def get_stats(self):
+        with self.condition:
+            depth = {channel: len(messages) for channel, messages in self.channels.items() if messages}
+        return {
+            'queue_depth': sum(depth.values()),
+            'queue_depth_per_channel': depth,
+            'queued': self.queued_messages,
+            'sent': self.sent_messages,
+            'posts': self.sent_posts,
+            'collapsed': self.collapsed_messages,
+            'dropped': self.dropped_messages,
+            'failed': self.failed_messages,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'average_latency': self.total_latency / self.sent_messages if self.sent_messages else 0.0,
+            'max_latency': self.max_latency,
+            'requests': self.requests,
+            'average_request_seconds': self.total_request_seconds / self.requests if self.requests else 0.0
+        }
@@ -0,0 +1,132 @@
+import math
+from collections import namedtuple
+
+import trueskill
+
+from app.utils.elo_rating import get_session_layers, import_numpy
+
+TrueSkillTrajectories = namedtuple('TrueSkillTrajectories', [
+    'winner_mus_before', 'winner_mus', 'winner_sigmas', 'loser_mus_before', 'loser_mus', 'loser_sigmas', 'qualities',
+    'final_mus', 'final_sigmas'
+])
+
+
+class TrueSkill1vs1:
+    """
+    Closed form TrueSkill for a game between two players, used when replaying many sessions.
+
+    trueskill.rate_1vs1() runs the generic factor graph for every game, which is two orders of magnitude slower. The
+    results are the same as the library up to floating point rounding (around 1e-13), as long as the same environment
+    (and therefore the same cdf/pdf implementation) is used.
+    """
+
+    def __init__(self, env=None):
+        self.env = env or trueskill.global_env()
+        self.beta_squared = self.env.beta ** 2
+        self.tau_squared = self.env.tau ** 2
+        self.draw_margin = trueskill.calc_draw_margin(self.env.draw_probability, 2, self.env)
+
+    def rate(self, winner_mu, winner_sigma, loser_mu, loser_sigma):
+        """Returns the new (winner_mu, winner_sigma, loser_mu, loser_sigma) after the winner beat the loser"""
+        # The dynamics factor adds tau to the uncertainty of both players before the game
+        winner_variance = winner_sigma ** 2 + self.tau_squared
+        loser_variance = loser_sigma ** 2 + self.tau_squared
+        c_squared = 2 * self.beta_squared + winner_variance + loser_variance
+        c = math.sqrt(c_squared)
+
+        x = (winner_mu - loser_mu - self.draw_margin) / c
+        denominator = self.env.cdf(x)
+        v = self.env.pdf(x) / denominator if denominator else -x
+        w = v * (v + x)
+
+        return (
+            winner_mu + winner_variance / c * v,
+            math.sqrt(winner_variance * (1 - winner_variance / c_squared * w)),
+            loser_mu - loser_variance / c * v,
+            math.sqrt(loser_variance * (1 - loser_variance / c_squared * w))
+        )
+
+    def quality(self, mu_1, sigma_1, mu_2, sigma_2):
+        """Same as trueskill.quality_1vs1(), the probability of a draw between the two players"""
+        c_squared = 2 * self.beta_squared + sigma_1 ** 2 + sigma_2 ** 2
+        return math.sqrt(2 * self.beta_squared / c_squared) * math.exp(-(mu_1 - mu_2) ** 2 / (2 * c_squared))
+
+
+def _erfc(np, x):
+    """trueskill.backends.erfc() for arrays, the approximation of the default backend of the library"""
+    z = np.abs(x)
+    t = 1. / (1. + z / 2.)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    return np.where(x < 0, 2. - r, r)
+
+
+def calculate_trueskill_trajectories(winners, losers, player_count, envs):
+    """
+    Calculate the TrueSkill ratings of a whole history of 1 vs 1 sessions, for several TrueSkill environments (e.g.
+    different betas or draw probabilities) at once.
+
+    `winners` and `losers` are the player indices of the sessions in chronological order, see
+    calculate_rating_trajectories(). Returns TrueSkillTrajectories with the mu of the players before and the mu and
+    sigma after every session, and the quality of every session, as arrays of (environment, session), and the final mu
+    and sigma as arrays of (environment, player). The results are the same as TrueSkill1vs1 with the default backend, up
+    to floating point rounding.
+    """
+    np = import_numpy()
+    winners = np.asarray(winners, dtype=np.int64)
+    losers = np.asarray(losers, dtype=np.int64)
+
+    def column(values):
+        return np.array(values, dtype=np.float64)[:, np.newaxis]
+
+    beta_squared = column([env.beta ** 2 for env in envs])
+    tau_squared = column([env.tau ** 2 for env in envs])
+    draw_margin = column([trueskill.calc_draw_margin(env.draw_probability, 2, env) for env in envs])
+    mus = np.repeat(column([env.mu for env in envs]), player_count, axis=1)
+    sigmas = np.repeat(column([env.sigma for env in envs]), player_count, axis=1)
+    shape = (len(envs), len(winners))
+    trajectories = TrueSkillTrajectories(*[np.empty(shape) for _ in range(7)], final_mus=mus, final_sigmas=sigmas)
+
+    for layer in get_session_layers(winners, losers):
+        winner_mu = mus[:, winners[layer]]
+        winner_sigma = sigmas[:, winners[layer]]
+        loser_mu = mus[:, losers[layer]]
+        loser_sigma = sigmas[:, losers[layer]]
+
+        quality_c_squared = 2 * beta_squared + winner_sigma ** 2 + loser_sigma ** 2
+        trajectories.qualities[:, layer] = np.sqrt(2 * beta_squared / quality_c_squared) * \
+            np.exp(-(winner_mu - loser_mu) ** 2 / (2 * quality_c_squared))
+
+        # The same calculation as TrueSkill1vs1.rate()
+        winner_variance = winner_sigma ** 2 + tau_squared
+        loser_variance = loser_sigma ** 2 + tau_squared
+        c_squared = 2 * beta_squared + winner_variance + loser_variance
+        c = np.sqrt(c_squared)
+        x = (winner_mu - loser_mu - draw_margin) / c
+        denominator = 0.5 * _erfc(np, -x / math.sqrt(2))
+        pdf = 1 / math.sqrt(2 * math.pi) * np.exp(-(x ** 2 / 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = np.where(denominator != 0, pdf / denominator, -x)
+        w = v * (v + x)
+
+        new_winner_mu = winner_mu + winner_variance / c * v
+        new_winner_sigma = np.sqrt(winner_variance * (1 - winner_variance / c_squared * w))
+        new_loser_mu = loser_mu - loser_variance / c * v
+        new_loser_sigma = np.sqrt(loser_variance * (1 - loser_variance / c_squared * w))
+
+        mus[:, winners[layer]] = new_winner_mu
+        sigmas[:, winners[layer]] = new_winner_sigma
+        mus[:, losers[layer]] = new_loser_mu
+        sigmas[:, losers[layer]] = new_loser_sigma
+        trajectories.winner_mus_before[:, layer] = winner_mu
+        trajectories.winner_mus[:, layer] = new_winner_mu
+        trajectories.winner_sigmas[:, layer] = new_winner_sigma
+        trajectories.loser_mus_before[:, layer] = loser_mu
+        trajectories.loser_mus[:, layer] = new_loser_mu
+        trajectories.loser_sigmas[:, layer] = new_loser_sigma
+    return trajectories
@@ -0,0 +1,94 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def get_deep_size(value):
+    """Approximate amount of bytes used by value, including the dicts, lists and strings it contains"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(get_deep_size(key) + get_deep_size(child) for key, child in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(get_deep_size(child) for child in value)
+    return size
+
+
+class TTLCache:
+    """Thread safe LRU cache where every entry expires `ttl` seconds after it was last written"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f'<TTLCache size={len(self.entries)} max_size={self.max_size} ttl={self.ttl} ' \
+               f'hits={self.hits} misses={self.misses} evictions={self.evictions}>'
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """Same as get(), but does not touch the hit/miss counters or the LRU order"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key, value):
+        if value is None:
+            self.delete(key)
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def get_memory_usage(self):
+        """Approximate amount of bytes used by the cached keys and values (walks every entry, do not call per read)"""
+        with self.lock:
+            entries = list(self.entries.items())
+        return sum(get_deep_size(key) + get_deep_size(value) for key, (value, expires_at) in entries)
+
+    def get_stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
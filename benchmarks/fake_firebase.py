@@ -0,0 +1,284 @@
+import copy
+import json
+import queue
+import random
+import socketserver
+import string
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Characters of Firebase push keys, in sort order
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+# Seconds between keep-alive comments on idle streams, so closed connections are noticed
+STREAM_KEEP_ALIVE_INTERVAL = 1.0
+
+
+def _split_path(path):
+    return [key for key in path.split('/') if key]
+
+
+class FakeFirebaseDatabase:
+    """
+    In-memory Firebase Realtime Database with the semantics of the REST API the client uses.
+
+    Supports get (with shallow and orderBy="$key" queries), set, update (multi-path), push, remove and event streams.
+    Every write is sent to the streams below or above the written path as put events, like Firebase does.
+    """
+
+    def __init__(self, data=None):
+        self.data = copy.deepcopy(data) if data is not None else {}
+        self.lock = threading.Lock()
+        self.streams = []
+
+    def get(self, path):
+        with self.lock:
+            return copy.deepcopy(self._get(_split_path(path)))
+
+    def _get(self, keys):
+        node = self.data
+        for key in keys:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node
+
+    def _set(self, keys, value):
+        if not keys:
+            self.data = value if isinstance(value, dict) else {}
+            return
+        node = self.data
+        parents = []
+        for key in keys[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            parents.append((node, key))
+            node = node[key]
+        if value is None:
+            node.pop(keys[-1], None)
+            # Firebase does not keep empty objects
+            for parent, key in reversed(parents):
+                if parent[key]:
+                    break
+                del parent[key]
+        else:
+            node[keys[-1]] = copy.deepcopy(value)
+
+    def set(self, path, value):
+        self.update(path, {'': value})
+
+    def update(self, path, updates):
+        base_keys = _split_path(path)
+        with self.lock:
+            written = []
+            for child_path, value in updates.items():
+                keys = base_keys + _split_path(child_path)
+                self._set(keys, value)
+                written.append((keys, value))
+            self._notify(written)
+
+    def push(self, path, value):
+        key = generate_push_key()
+        self.update(path, {key: value})
+        return key
+
+    def _notify(self, written):
+        for stream_keys, events in self.streams:
+            for keys, value in written:
+                if keys[:len(stream_keys)] == stream_keys:
+                    # A write at or below the stream
+                    events.put(('put', '/' + '/'.join(keys[len(stream_keys):]), value))
+                elif stream_keys[:len(keys)] == keys:
+                    # A write above the stream replaces everything it streams
+                    events.put(('put', '/', copy.deepcopy(self._get(stream_keys))))
+
+    def subscribe(self, path):
+        """Returns the queue of (event, path, data) events of the node at path, starting with its current value"""
+        events = queue.Queue()
+        keys = _split_path(path)
+        with self.lock:
+            events.put(('put', '/', copy.deepcopy(self._get(keys))))
+            self.streams.append((keys, events))
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.streams = [stream for stream in self.streams if stream[1] is not events]
+
+
+def generate_push_key():
+    timestamp = int(time.time() * 1000)
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[timestamp % 64])
+        timestamp //= 64
+    return ''.join(reversed(time_chars)) + ''.join(random.choice(string.ascii_letters) for _ in range(12))
+
+
+def _apply_query(value, query):
+    if query.get('shallow') == 'true':
+        if isinstance(value, dict):
+            # Objects are truncated to True, primitives are returned as they are
+            return {key: True if isinstance(child, dict) else child for key, child in value.items()}
+        return value
+    if not isinstance(value, dict) or 'orderBy' not in query:
+        return value
+    if json.loads(query['orderBy']) != '$key':
+        raise ValueError(f'Only orderBy="$key" is supported, got {query["orderBy"]}')
+    items = sorted(value.items())
+    if 'startAt' in query:
+        items = [(key, child) for key, child in items if key >= json.loads(query['startAt'])]
+    if 'endAt' in query:
+        items = [(key, child) for key, child in items if key <= json.loads(query['endAt'])]
+    if 'equalTo' in query:
+        items = [(key, child) for key, child in items if key == json.loads(query['equalTo'])]
+    if 'limitToFirst' in query:
+        items = items[:int(query['limitToFirst'])]
+    if 'limitToLast' in query:
+        items = items[-int(query['limitToLast']):]
+    return OrderedDict(items)
+
+
+class FakeFirebaseRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, like the Firebase REST API
+    protocol_version = 'HTTP/1.1'
+    # Without it small responses wait for the delayed ACK of the client (40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        url = urlparse(self.path)
+        path = url.path[:-len('.json')] if url.path.endswith('.json') else url.path
+        # pyrebase quotes string parameters before encoding the query string, they arrive quoted once more
+        query = {key: unquote(values[0]) for key, values in parse_qs(url.query).items()}
+        return path, query
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+    def _respond(self, value, status=200):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        path, query = self._parse()
+        server = self.server
+        is_stream = method == 'GET' and 'text/event-stream' in self.headers.get('Accept', '')
+        server.count_request('STREAM' if is_stream else method, path, query)
+        if server.latency:
+            time.sleep(server.get_latency())
+        try:
+            if is_stream:
+                self._stream(path)
+            elif method == 'GET':
+                self._respond(_apply_query(server.database.get(path), query))
+            elif method == 'PUT':
+                value = self._read_body()
+                server.database.set(path, value)
+                self._respond(value)
+            elif method == 'PATCH':
+                updates = self._read_body()
+                server.database.update(path, updates)
+                self._respond(updates)
+            elif method == 'POST':
+                self._respond({'name': server.database.push(path, self._read_body())})
+            elif method == 'DELETE':
+                server.database.set(path, None)
+                self._respond(None)
+        except ValueError as e:
+            self._respond({'error': str(e)}, status=400)
+
+    def _stream(self, path):
+        events = self.server.database.subscribe(path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        # The stream ends when the client closes the connection
+        self.close_connection = True
+        try:
+            while not self.server.stopped.is_set():
+                try:
+                    event, event_path, data = events.get(timeout=STREAM_KEEP_ALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b'event: keep-alive\ndata: null\n\n')
+                    self.wfile.flush()
+                    continue
+                message = json.dumps({'path': event_path, 'data': data})
+                self.wfile.write(f'event: {event}\ndata: {message}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            self.server.database.unsubscribe(events)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeFirebaseServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Serves a FakeFirebaseDatabase over HTTP on localhost, with an injected latency per request.
+
+    Every request is counted by kind (e.g. "GET", "GET shallow", "PATCH", "STREAM"), so a benchmark can tell how many
+    round trips an operation takes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data=None, latency=0.0, jitter=0.0, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeFirebaseRequestHandler)
+        self.database = FakeFirebaseDatabase(data)
+        self.latency = latency
+        self.jitter = jitter
+        self.stopped = threading.Event()
+        self.requests = Counter()
+        self.requests_lock = threading.Lock()
+        self.thread = None
+
+    def get_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def get_latency(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def count_request(self, method, path, query):
+        kind = f'{method} shallow' if query.get('shallow') == 'true' else method
+        with self.requests_lock:
+            self.requests[kind] += 1
+
+    def get_request_counts(self):
+        with self.requests_lock:
+            return Counter(self.requests)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='FakeFirebaseServer')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from collections import Counter
+
+from slacker import Response
+
+
+class FakeSlackUser:
+    def __init__(self, slack_user_id, username, first_name):
+        self.slack_user_id = slack_user_id
+        self.username = username
+        self.first_name = first_name
+
+    def to_slack_user(self):
+        return {
+            'id': self.slack_user_id,
+            'name': self.username,
+            'profile': {
+                'first_name': self.first_name,
+                'image_72': f'https://avatars.example.com/{self.slack_user_id}.png'
+            }
+        }
+
+
+class FakeSlack:
+    """
+    In-process stand-in for the Slacker client, only the calls the client makes are implemented.
+
+    Every call waits `latency` seconds and is counted by API method, the posted messages are kept in `messages`.
+    """
+
+    def __init__(self, users, latency=0.0):
+        self.users_by_id = {user.slack_user_id: user for user in users}
+        self.latency = latency
+        self.calls = Counter()
+        self.messages = []
+        self.lock = threading.Lock()
+        self.chat = _FakeChat(self)
+        self.users = _FakeUsers(self)
+
+    def call(self, method, body):
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return Response(json.dumps({'ok': True, **body}))
+
+    def get_call_counts(self):
+        with self.lock:
+            return Counter(self.calls)
+
+
+class _FakeChat:
+    def __init__(self, slack):
+        self.slack = slack
+
+    def post_message(self, channel, text=None, username=None, attachments=None, **kwargs):
+        with self.slack.lock:
+            self.slack.messages.append({'channel': channel, 'text': text, 'attachments': attachments})
+        return self.slack.call('chat.postMessage', {'channel': channel})
+
+
+class _FakeUsers:
+    def __init__(self, slack):
+        self.slack = slack
+
+    def info(self, user):
+        return self.slack.call('users.info', {'user': self.slack.users_by_id[user].to_slack_user()})
+
+    def get(self, method, params=None, **kwargs):
+        if method != 'users.list':
+            raise NotImplementedError(method)
+        # One page is enough for a benchmark directory
+        members = [user.to_slack_user() for user in self.slack.users_by_id.values()]
+        return self.slack.call('users.list', {'members': members, 'response_metadata': {'next_cursor': ''}})
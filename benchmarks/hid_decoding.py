@@ -0,0 +1,107 @@
+import time
+from collections import namedtuple
+
+from app.readers.hid.hid_reader import EV_KEY, KEY_DOWN, KEY_ENTER, SCAN_CODE_TABLE, HIDReader
+from app.readers.reader_listener import ReaderListener
+
+# The events a reader sends per key: a scan event, the key event and a sync event, for the key down and the key up
+EV_SYN = 0x00
+EV_MSC = 0x04
+MSC_SCAN = 0x04
+KEY_UP = 0
+# The per event cost with the most readers may be this much higher than with one reader before a run fails
+FLATNESS_TOLERANCE = 1.5
+
+InputEvent = namedtuple('InputEvent', ['type', 'code', 'value'])
+
+SCAN_CODES_BY_CHARACTER = {
+    characters.decode('ascii'): scan_code for scan_code, characters in enumerate(SCAN_CODE_TABLE)
+    if characters is not None and len(characters) == 1
+}
+
+
+def _key_events(scan_code):
+    events = []
+    for value in (KEY_DOWN, KEY_UP):
+        events += [InputEvent(EV_MSC, MSC_SCAN, scan_code), InputEvent(EV_KEY, scan_code, value),
+                   InputEvent(EV_SYN, 0, 0)]
+    return events
+
+
+def card_events(card_uid):
+    """The events of a card read: the keys of the UID followed by enter"""
+    events = []
+    for character in card_uid:
+        events += _key_events(SCAN_CODES_BY_CHARACTER[character])
+    return events + _key_events(KEY_ENTER)
+
+
+class FakeReaderDevice:
+    """Stands in for evdev.InputDevice, every read returns the events of one card read"""
+
+    def __init__(self, fd, events):
+        self.fd = fd
+        self.events = events
+
+    def read(self):
+        return self.events
+
+
+class CountingListener(ReaderListener):
+    def __init__(self):
+        self.cards = 0
+
+    def handle_card_read(self, card):
+        self.cards += 1
+
+    def handle_data(self, message):
+        pass
+
+
+def measure(reader_count, reads, repeats):
+    """Returns the best time per event in nanoseconds, with the reads spread over reader_count readers in turn"""
+    reader = HIDReader([])
+    listener = CountingListener()
+    reader.add_read_listener(listener)
+    fds = []
+    for i in range(reader_count):
+        reader_device = FakeReaderDevice(1000 + i, card_events(f'{i:08X}'))
+        reader.add_reader_device(reader_device)
+        fds.append(reader_device.fd)
+    order = [fds[i % reader_count] for i in range(reads)]
+    event_count = sum(len(reader.reader_states[fd].reader_device.events) for fd in order)
+
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for fd in order:
+            reader._read_device(fd)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    if listener.cards != reads * repeats:
+        raise AssertionError(f'Decoded {listener.cards} cards out of {reads * repeats} reads')
+    return best / event_count * 1e9
+
+
+def format_report(results):
+    lines = [f'{"Readers":>8}{"ns/event":>10}{"vs 1":>8}']
+    baseline = results[0][1]
+    for reader_count, nanoseconds in results:
+        lines.append(f'{reader_count:>8}{nanoseconds:>10.1f}{nanoseconds / baseline:>8.2f}')
+    return '\n'.join(lines)
+
+
+def check_flatness(results, tolerance=FLATNESS_TOLERANCE):
+    """Returns the reader counts where the cost per event grew beyond the tolerance of the first reader count"""
+    baseline = results[0][1]
+    return [
+        f'{reader_count} readers: {nanoseconds:.1f} ns/event ({nanoseconds / baseline:.2f}x, tolerance {tolerance}x)'
+        for reader_count, nanoseconds in results[1:]
+        if nanoseconds > baseline * tolerance
+    ]
+
+
+def run_hid_benchmark(reader_counts=(1, 4, 16, 64, 256), reads=20000, repeats=5):
+    results = [(reader_count, measure(reader_count, reads, repeats)) for reader_count in reader_counts]
+    print(format_report(results))
+    return results
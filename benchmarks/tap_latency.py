@@ -0,0 +1,277 @@
+import logging
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from benchmarks.fake_firebase import FakeFirebaseServer
+from benchmarks.fake_slack import FakeSlack, FakeSlackUser
+
+from app.games.game_services import GameServices
+from app.games.office_game import OfficeGame
+from app.games.player_cache import get_player_profile
+from app.readers.utils.card import NFC_CARD, Card
+from app.settings import GAME_PLAYER_REGISTRATION_TIMEOUT, GAME_START_TIME_BUFFER
+from app.utils.firebase import PooledFirebase
+from app.utils.http import MetricsHTTPAdapter
+from app.utils.metrics import metrics
+from app.utils.time import utc_now
+
+# The operations in the order they are reported
+OPERATIONS = ['register', 'start', 'win', 'timeout', 'unknown_card', 'pending_registration']
+# Maximum average amount of Firebase requests made while a card read is handled (with or without the journal), a
+# benchmark run fails above them
+TAP_REQUEST_BUDGETS = {
+    'register': 1,
+    'start': 2,
+    'win': 1,
+    'timeout': 1,
+    'unknown_card': 1,
+    'pending_registration': 4
+}
+# Amount of players taking part in one round of taps
+PLAYERS_PER_ROUND = 5
+# Seconds to wait for the background work (the journal) of a card read before giving up on counting it
+SETTLE_TIMEOUT = 10.0
+
+
+class CountingHTTPAdapter(MetricsHTTPAdapter):
+    """Counts the requests made from the thread that reads the cards, background requests are left out"""
+
+    def __init__(self, tap_thread, *args, **kwargs):
+        self.tap_thread = tap_thread
+        self.tap_requests = 0
+        super(CountingHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if threading.current_thread() is self.tap_thread:
+            self.tap_requests += 1
+        return super(CountingHTTPAdapter, self).send(request, **kwargs)
+
+
+def _card_uid(i):
+    return f'BENCH{i:06d}'
+
+
+def _slack_user_id(i):
+    return f'UBENCH{i:05d}'
+
+
+def build_fixture(player_count, game_slug):
+    """Returns the database and the Slack users of `player_count` registered players with one card each"""
+    registration_date = utc_now().isoformat()
+    users = [FakeSlackUser(_slack_user_id(i), f'player{i}', f'Player {i}') for i in range(player_count)]
+    data = {'cards': {}, 'players': {}, 'player_profiles': {}, 'games': {game_slug: {'player_statistics': {}}}}
+    for i, user in enumerate(users):
+        slack_user = user.to_slack_user()
+        data['cards'][_card_uid(i)] = {'slack_user_id': user.slack_user_id, 'registration_date': registration_date}
+        data['players'][user.slack_user_id] = {
+            'slack_username': slack_user['name'],
+            'slack_first_name': slack_user['profile']['first_name'],
+            'slack_avatar_url': slack_user['profile']['image_72'],
+            'slack_last_sync': registration_date,
+            'registration_date': registration_date,
+            'cards': {_card_uid(i): True}
+        }
+        data['player_profiles'][user.slack_user_id] = get_player_profile(data['players'][user.slack_user_id])
+        data['games'][game_slug]['player_statistics'][user.slack_user_id] = {
+            'trueskill_rating': {'mu': 25.0, 'sigma': 25.0 / 3},
+            'elo_rating': 1200,
+            'total_games': 0,
+            'games_won': 0,
+            'games_lost': 0,
+            'seconds_played': 0
+        }
+    return data, users
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of the values"""
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class TapLatencyBenchmark:
+    """
+    Reads scripted card sequences with OfficeGame.register_card() against a fake Firebase and Slack.
+
+    Every round registers two players and starts a session, wins it, lets a registration time out, starts and wins a
+    second session, reads an unknown card and registers a new card through a pending registration. The time spent in
+    register_card() (the time until the reader can acknowledge the card) and the Firebase requests it made, in the
+    tap thread and in total (including the journal), are recorded per operation.
+    """
+
+    def __init__(self, rounds=20, players=50, firebase_latency=0.0, slack_latency=0.0, jitter=0.0):
+        self.rounds = rounds
+        self.player_count = max(players, PLAYERS_PER_ROUND)
+        self.firebase_latency = firebase_latency
+        self.slack_latency = slack_latency
+        self.jitter = jitter
+        self.latencies = defaultdict(list)
+        self.tap_requests = defaultdict(list)
+        self.total_requests = defaultdict(list)
+        self.request_kinds = defaultdict(Counter)
+        self.next_player = 0
+        self.next_new_card = 0
+
+    def _setup(self, journal_path):
+        game_slug = 'ping-pong'
+        data, users = build_fixture(self.player_count, game_slug)
+        self.server = FakeFirebaseServer(data, latency=self.firebase_latency, jitter=self.jitter).start()
+        self.slack = FakeSlack(users, latency=self.slack_latency)
+
+        firebase = PooledFirebase({
+            'apiKey': 'benchmark',
+            'authDomain': None,
+            'databaseURL': self.server.get_url(),
+            'storageBucket': None
+        })
+        self.adapter = CountingHTTPAdapter(threading.current_thread(), 'firebase', timeout=10, pool_maxsize=10)
+        firebase.requests.mount('http://', self.adapter)
+
+        self.services = GameServices(firebase=firebase, slack=self.slack, journal_path=journal_path)
+        self.game = OfficeGame('Ping Pong', '0.1.0', services=self.services)
+        self._wait(lambda: self.game.slack_directory_sync.syncs > 0)
+        self._wait(self.game.player_cache.is_pending_registrations_synced)
+
+    @staticmethod
+    def _wait(condition, timeout=SETTLE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def _is_settled(self):
+        return self.game.journal is None or self.game.journal.get_stats()['pending'] == 0
+
+    def _tap(self, operation, card_uid):
+        self._wait(self._is_settled)
+        server_requests = self.server.get_request_counts()
+        tap_requests = self.adapter.tap_requests
+
+        started = time.perf_counter()
+        self.game.register_card(Card(NFC_CARD, card_uid))
+        self.latencies[operation].append(time.perf_counter() - started)
+        self.tap_requests[operation].append(self.adapter.tap_requests - tap_requests)
+
+        self._wait(self._is_settled)
+        requests = self.server.get_request_counts()
+        requests.subtract(server_requests)
+        requests = +requests
+        self.total_requests[operation].append(sum(requests.values()))
+        self.request_kinds[operation].update(requests)
+
+    def _take_player(self):
+        i = self.next_player % self.player_count
+        self.next_player += 1
+        return i
+
+    def _backdate_session_start(self):
+        session = self.game.get_current_session()
+        session.set_start_time(utc_now() - timedelta(seconds=GAME_START_TIME_BUFFER + 1))
+
+    def _backdate_join_times(self):
+        join_times = self.game.get_current_session().join_times
+        for slack_user_id in join_times:
+            join_times[slack_user_id] = utc_now() - timedelta(seconds=GAME_PLAYER_REGISTRATION_TIMEOUT + 1)
+
+    def _run_round(self):
+        a, b, c, d, e = [self._take_player() for _ in range(PLAYERS_PER_ROUND)]
+
+        self._tap('register', _card_uid(a))
+        self._tap('start', _card_uid(b))
+        self._backdate_session_start()
+        self._tap('win', _card_uid(a))
+
+        self._tap('register', _card_uid(c))
+        self._backdate_join_times()
+        self._tap('timeout', _card_uid(d))
+        self._tap('start', _card_uid(e))
+        self._backdate_session_start()
+        self._tap('win', _card_uid(e))
+
+        self._tap('unknown_card', 'UNKNOWN')
+
+        new_card_uid = f'NEW{self.next_new_card:06d}'
+        self.next_new_card += 1
+        self.server.database.set(f'pending_registrations/{new_card_uid}', {
+            'user_id': _slack_user_id(a),
+            'timestamp': int(time.time() * 1000)
+        })
+        # Let the stream deliver the registration, like a registration made some time before the card is read
+        self._wait(lambda: self.game.player_cache.pending_registrations.get(new_card_uid) is not None, timeout=1.0)
+        self._tap('pending_registration', new_card_uid)
+
+    def run(self):
+        metrics.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            self._setup(f'{directory}/journal.sqlite3')
+            try:
+                for _ in range(self.rounds):
+                    self._run_round()
+            finally:
+                self.game.stop()
+                # The game does not stop the services it was given, close the streams before the server goes away
+                self.services.stop()
+                self.server.stop()
+        return self.get_results()
+
+    def get_results(self):
+        results = {}
+        for operation in OPERATIONS:
+            latencies = self.latencies[operation]
+            if not latencies:
+                continue
+            taps = len(latencies)
+            results[operation] = {
+                'taps': taps,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'tap_requests': sum(self.tap_requests[operation]) / taps,
+                'total_requests': sum(self.total_requests[operation]) / taps,
+                'request_kinds': {kind: count / taps for kind, count in sorted(self.request_kinds[operation].items())}
+            }
+        results['slack_calls'] = dict(self.slack.get_call_counts())
+        results['stages'] = [line for line in metrics.get_summary() if line.startswith('tap_stage_seconds')]
+        return results
+
+
+def format_report(results):
+    lines = [f'{"Operation":<22}{"Taps":>6}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"Tap req":>9}{"Total req":>11}'
+             '  Requests per kind']
+    for operation in OPERATIONS:
+        result = results.get(operation)
+        if result is None:
+            continue
+        kinds = ', '.join(f'{kind} {count:.1f}' for kind, count in result['request_kinds'].items())
+        lines.append(
+            f'{operation:<22}{result["taps"]:>6}{result["p50"] * 1000:>10.1f}{result["p95"] * 1000:>10.1f}'
+            f'{result["p99"] * 1000:>10.1f}{result["tap_requests"]:>9.1f}{result["total_requests"]:>11.1f}  {kinds}'
+        )
+    lines.append(f'Slack calls: {results["slack_calls"]}')
+    lines.append('Stages:')
+    lines.extend(f'  {stage}' for stage in results['stages'])
+    return '\n'.join(lines)
+
+
+def check_budgets(results, budgets=TAP_REQUEST_BUDGETS):
+    """Returns the operations that made more Firebase requests while the card was read than their budget allows"""
+    return [
+        f'{operation}: {results[operation]["tap_requests"]:.1f} requests (budget {budget})'
+        for operation, budget in budgets.items()
+        if operation in results and results[operation]['tap_requests'] > budget
+    ]
+
+
+def run_benchmark(rounds=20, players=50, firebase_latency=0.0, slack_latency=0.0, jitter=0.0):
+    # The game logs every card read on debug level
+    logging.basicConfig(level=logging.WARNING)
+    benchmark = TapLatencyBenchmark(rounds, players, firebase_latency, slack_latency, jitter)
+    results = benchmark.run()
+    print(format_report(results))
+    return results
@@ -1,17 +1,117 @@
+import datetime
+import gzip
 import json
 import os
 
-import datetime
+from app.settings import HISTORY_RESUME_MARGIN
+from app.utils.firebase import get_firebase, get_resume_key, iter_children
+
+BACKUP_DIRECTORY = 'backups'
+# High-water marks of the last backup and the keys it read after them minus the margin, used by incremental backups
+BACKUP_STATE_FILE = os.path.join(BACKUP_DIRECTORY, 'backup-state.json')
+# Nodes that only grow (the history), they are fetched in key ordered pages and backed up incrementally
+HISTORY_PATTERNS = [
+    ['games', '*', 'sessions'],
+    ['players', '*', 'sessions', '*']
+]
+
+
+def _matches(keys, pattern):
+    return len(keys) == len(pattern) and all(part == '*' or part == key for key, part in zip(keys, pattern))
+
+
+def _is_history(keys):
+    return any(_matches(keys, pattern) for pattern in HISTORY_PATTERNS)
+
+
+def _contains_history(keys):
+    return any(_matches(keys, pattern[:len(keys)]) for pattern in HISTORY_PATTERNS if len(keys) < len(pattern))
+
+
+def _walk(firebase, keys, state, new_state):
+    """Yields the (path, value) records of the node at keys, without ever fetching a history node as a whole"""
+    path = '/'.join(keys)
+    if _is_history(keys):
+        high_water_mark = state['high_water_marks'].get(path)
+        # Read the last HISTORY_RESUME_MARGIN seconds again for the sessions replayed from a journal since the last
+        # backup, the ones that were backed up already are skipped
+        backed_up_keys = set(state['recent_keys'].get(path, []))
+        read_keys = []
+        for key, value in iter_children(firebase, path,
+                                        start_after=get_resume_key(high_water_mark, HISTORY_RESUME_MARGIN)):
+            read_keys.append(key)
+            if high_water_mark is None or key > high_water_mark:
+                high_water_mark = key
+            if key not in backed_up_keys:
+                yield f'{path}/{key}', value
+        if high_water_mark is not None:
+            new_state['high_water_marks'][path] = high_water_mark
+            resume_key = get_resume_key(high_water_mark, HISTORY_RESUME_MARGIN)
+            new_state['recent_keys'][path] = [key for key in read_keys if key > resume_key]
+    elif _contains_history(keys):
+        # Only fetch the first level, objects are walked and primitives are backed up as they are
+        shallow = firebase.get_shallow(path)
+        if not isinstance(shallow, dict):
+            if shallow is not None:
+                yield path, shallow
+            return
+        for key, value in shallow.items():
+            if value is True:
+                # An object (or the primitive true), it has to be fetched
+                yield from _walk(firebase, keys + [key], state, new_state)
+            else:
+                yield f'{path}/{key}' if path else key, value
+    else:
+        value = firebase.database().child(path).get().val()
+        if value is not None:
+            yield path, value
+
+
+def _load_state():
+    if not os.path.exists(BACKUP_STATE_FILE):
+        return {}
+    with open(BACKUP_STATE_FILE) as state_file:
+        return json.load(state_file)
+
+
+def _save_state(state):
+    with open(f'{BACKUP_STATE_FILE}.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(f'{BACKUP_STATE_FILE}.tmp', BACKUP_STATE_FILE)
+
+
+def backup(incremental=False):
+    """
+    Back up the database as gzipped NDJSON, one {"path": ..., "value": ...} record per line.
 
-from app.utils.firebase import get_firebase
+    The history (sessions) is fetched in pages and the rest of the database per node, so the whole database is never
+    held in memory. An incremental backup only contains the sessions added since the last backup (and a snapshot of
+    everything else), restore it on top of the backups before it.
+    """
+    firebase = get_firebase()
+    if not os.path.exists(BACKUP_DIRECTORY):
+        os.makedirs(BACKUP_DIRECTORY)
 
+    saved_state = _load_state() if incremental else {}
+    state = {
+        'high_water_marks': saved_state.get('high_water_marks', {}),
+        'recent_keys': saved_state.get('recent_keys', {})
+    }
+    new_state = {'high_water_marks': dict(state['high_water_marks']), 'recent_keys': dict(state['recent_keys'])}
+    kind = 'incremental' if incremental else 'full'
+    backup_file = os.path.join(BACKUP_DIRECTORY, f'backup-{datetime.datetime.now():%Y%m%d_%H%M%S}-{kind}.ndjson.gz')
 
-def backup():
-    db = get_firebase().database()
-    if not os.path.exists('backups'):
-        os.makedirs('backups')
-    backup_file = f'backups/backup-{datetime.datetime.now():%Y%m%d_%H%M%S}.json'
-    f = open(backup_file, 'w')
-    f.write(json.dumps(db.get().val()))
-    f.close()
-    print(f'Backup saved: {backup_file}')
+    records = 0
+    with gzip.open(f'{backup_file}.tmp', 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'backup': {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'incremental': incremental,
+            'since': state['high_water_marks']
+        }}) + '\n')
+        for path, value in _walk(firebase, [], state, new_state):
+            f.write(json.dumps({'path': path, 'value': value}) + '\n')
+            records += 1
+    # Only a complete backup gets its final name and moves the high-water marks
+    os.replace(f'{backup_file}.tmp', backup_file)
+    _save_state(dict(new_state, last_backup=backup_file))
+    print(f'Backup saved: {backup_file} ({records} records)')
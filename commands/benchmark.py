@@ -0,0 +1,13 @@
+from benchmarks.tap_latency import check_budgets, run_benchmark
+
+
+def benchmark(rounds=20, players=50, latency=0, slack_latency=0, jitter=0):
+    """
+    Measure the card read (tap) latency against a local fake of Firebase and Slack, with the given latencies in
+    milliseconds. Returns False if an operation made more Firebase requests than its budget.
+    """
+    results = run_benchmark(rounds, players, latency / 1000.0, slack_latency / 1000.0, jitter / 1000.0)
+    exceeded_budgets = check_budgets(results)
+    for exceeded_budget in exceeded_budgets:
+        print(f'Request budget exceeded: {exceeded_budget}')
+    return not exceeded_budgets
@@ -0,0 +1,13 @@
+from benchmarks.hid_decoding import check_flatness, run_hid_benchmark
+
+
+def benchmark_hid(reader_counts=None, reads=20000):
+    """
+    Measure the cost per event of decoding synthetic HID event streams spread over more and more readers. Returns
+    False if the cost grew with the amount of readers.
+    """
+    results = run_hid_benchmark(reader_counts or (1, 4, 16, 64, 256), reads)
+    exceeded_tolerances = check_flatness(results)
+    for exceeded_tolerance in exceeded_tolerances:
+        print(f'Cost per event grew: {exceeded_tolerance}')
+    return not exceeded_tolerances
@@ -0,0 +1,50 @@
+import time
+
+import trueskill
+
+from app.games.rating_replay import iter_sessions
+from app.utils.elo_rating import calculate_rating_trajectories, import_numpy
+from app.utils.firebase import get_firebase
+from app.utils.trueskill_rating import calculate_trueskill_trajectories
+
+DEFAULT_K_FACTORS = [16, 24, 32, 40, 48]
+
+
+def _get_accuracy(np, winner_ratings_before, loser_ratings_before):
+    """Share of the sessions won by the player with the higher rating, sessions between equal ratings count half"""
+    return np.mean(np.sign(winner_ratings_before - loser_ratings_before) * 0.5 + 0.5, axis=1)
+
+
+def compare_ratings(game_slug, k_factors=None, betas=None):
+    """
+    Replay the 1 vs 1 history of the game with several Elo K-factors and TrueSkill betas, and report how well every
+    rating predicted the winners. Nothing is written to Firebase.
+    """
+    np = import_numpy()
+    k_factors = k_factors or DEFAULT_K_FACTORS
+    envs = [trueskill.TrueSkill(beta=beta) for beta in betas] if betas else [trueskill.global_env()]
+    firebase = get_firebase()
+
+    print(f'Grabbing the sessions of {game_slug} from Firebase')
+    player_indexes = {}
+    winners = []
+    losers = []
+    for _, session in iter_sessions(firebase, game_slug):
+        if 'winner' not in session:
+            # Sessions with teams are not part of the 1 vs 1 history
+            continue
+        winners.append(player_indexes.setdefault(session['winner']['slack_user_id'], len(player_indexes)))
+        losers.append(player_indexes.setdefault(session['loser']['slack_user_id'], len(player_indexes)))
+
+    started = time.monotonic()
+    elo = calculate_rating_trajectories(winners, losers, len(player_indexes), k_factors)
+    trueskill_ratings = calculate_trueskill_trajectories(winners, losers, len(player_indexes), envs)
+    print(f'Replayed {len(winners)} sessions of {len(player_indexes)} players with {len(k_factors)} K-factors and '
+          f'{len(envs)} TrueSkill environments in {time.monotonic() - started:.2f} seconds')
+
+    for k, accuracy in zip(k_factors, _get_accuracy(np, elo.winner_ratings_before, elo.loser_ratings_before)):
+        print(f'Elo K={k}: the higher rated player won {accuracy:.1%} of the sessions')
+    trueskill_accuracies = _get_accuracy(np, trueskill_ratings.winner_mus_before, trueskill_ratings.loser_mus_before)
+    for env, accuracy, qualities in zip(envs, trueskill_accuracies, trueskill_ratings.qualities):
+        print(f'TrueSkill beta={env.beta:.3f}: the higher rated player won {accuracy:.1%} of the sessions, '
+              f'average quality {np.mean(qualities) if len(qualities) else 0:.3f}')
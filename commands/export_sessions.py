@@ -0,0 +1,39 @@
+import os
+import time
+
+from app.games.rating_replay import SESSION_PAGE_SIZE, iter_sessions
+from app.games.session_history import SessionHistoryWriter
+from app.settings import HISTORY_RESUME_MARGIN
+from app.utils.firebase import get_firebase, get_resume_key
+
+EXPORT_DIRECTORY = 'exports'
+
+
+def export_sessions(game_slug, directory=None):
+    """
+    Append the sessions of the game that were added since the last export to the columnar export in
+    exports/<game>, see SessionHistory to read it. The sessions of the last HISTORY_RESUME_MARGIN seconds are read
+    again and the ones that are already exported are skipped.
+    """
+    firebase = get_firebase()
+    directory = directory or os.path.join(EXPORT_DIRECTORY, game_slug)
+    writer = SessionHistoryWriter(directory)
+    rows_before = writer.meta['rows']
+    started = time.monotonic()
+
+    # Read the last HISTORY_RESUME_MARGIN seconds again for the sessions replayed from a journal since the last export
+    resume_key = get_resume_key(writer.get_last_key(), HISTORY_RESUME_MARGIN)
+    writer.skip_exported_after(resume_key)
+    if resume_key is None:
+        print(f'Exporting all the sessions of {game_slug}')
+    else:
+        print(f'Exporting the sessions of {game_slug} after {resume_key} (last export at {writer.get_last_key()})')
+    for session_key, session in iter_sessions(firebase, game_slug, start_after=resume_key):
+        writer.append(session_key, session)
+        if len(writer.rows) >= SESSION_PAGE_SIZE:
+            writer.flush()
+    writer.flush()
+
+    print(f'Exported {writer.meta["rows"] - rows_before} sessions to {directory} in '
+          f'{time.monotonic() - started:.2f} seconds ({writer.meta["rows"]} sessions of {len(writer.meta["players"])} '
+          f'players in total, skipped {writer.skipped_sessions} sessions with teams)')
@@ -0,0 +1,67 @@
+from app.readers.utils.canonical import ALIAS_FORMATS, convert_uids
+from app.utils.firebase import get_firebase
+
+# Aliases written per multi-path update
+UPDATE_SIZE = 1000
+
+
+# Lengths of the canonical NFC UIDs in hex characters (single, double and triple size UIDs)
+NFC_UID_LENGTHS = [8, 14, 20]
+# The EM4200 cards are stored under their Wiegand 32 number, at most 10 decimal digits
+MAX_RFID_UID_LENGTH = 10
+
+
+def _is_canonical(card_uid):
+    try:
+        bytes.fromhex(card_uid)
+    except ValueError:
+        return False
+    return len(card_uid) in NFC_UID_LENGTHS and card_uid == card_uid.upper()
+
+
+def _is_rfid(card_uid):
+    # An NFC UID of 8 hex characters that only has digits can not be told apart from a Wiegand 32 number, it is left
+    # out as well (the HID readers still find it under its canonical UID)
+    return card_uid.isdigit() and len(card_uid) <= MAX_RFID_UID_LENGTH
+
+
+def index_card_aliases(dry_run=False):
+    """Write the missing card_aliases of all the registered cards, e.g. after importing cards"""
+    firebase = get_firebase()
+    print('Grabbing cards and card aliases from Firebase')
+    card_uids = set(firebase.get_shallow('cards') or {})
+    existing_aliases = firebase.database().child('card_aliases').get().val() or {}
+    # Only the NFC cards are read in several forms (see get_card_aliases()), an RFID card is always read as Wiegand 32
+    rfid_uids = sorted(card_uid for card_uid in card_uids if _is_rfid(card_uid))
+    canonical_uids = sorted(card_uid for card_uid in card_uids if _is_canonical(card_uid) and not _is_rfid(card_uid))
+
+    aliases = {}
+    conflicts = set()
+    for uid_format in ALIAS_FORMATS:
+        for card_uid, alias in zip(canonical_uids, convert_uids(canonical_uids, uid_format)):
+            if alias == card_uid:
+                continue
+            if alias in card_uids or aliases.get(alias, card_uid) != card_uid:
+                # The alias is another card (or the alias of one), a read of it can not be resolved
+                conflicts.add(alias)
+                continue
+            aliases[alias] = card_uid
+    for alias in conflicts:
+        aliases.pop(alias, None)
+
+    updates = {
+        f'card_aliases/{alias}': card_uid for alias, card_uid in aliases.items()
+        if existing_aliases.get(alias) != card_uid
+    }
+    print(f'{len(canonical_uids)} of {len(card_uids)} cards have an NFC UID, {len(aliases)} aliases, '
+          f'{len(updates)} missing, {len(conflicts)} left out because they match several cards')
+    if rfid_uids:
+        print(f'Skipped {len(rfid_uids)} RFID (Wiegand 32) cards: {", ".join(rfid_uids)}')
+    if dry_run:
+        return updates
+
+    paths = list(updates)
+    for i in range(0, len(paths), UPDATE_SIZE):
+        firebase.database().update({path: updates[path] for path in paths[i:i + UPDATE_SIZE]})
+    print(f'Wrote {len(updates)} card aliases')
+    return updates
@@ -0,0 +1,29 @@
+from app.games.player_cache import get_player_profile
+from app.utils.firebase import get_firebase
+
+# Profiles written per multi-path update
+UPDATE_SIZE = 1000
+
+
+def index_player_profiles(dry_run=False):
+    """Copy the profile fields of all the players to player_profiles, e.g. after upgrading or importing players"""
+    firebase = get_firebase()
+    print('Grabbing players and player profiles from Firebase')
+    slack_user_ids = list(firebase.get_shallow('players') or {})
+    existing_profiles = firebase.database().child('player_profiles').get().val() or {}
+
+    updates = {}
+    for slack_user_id in slack_user_ids:
+        # The shallow query returns the profile fields without the cards and the sessions
+        profile = get_player_profile(firebase.get_shallow(f'players/{slack_user_id}'))
+        if profile and existing_profiles.get(slack_user_id) != profile:
+            updates[f'player_profiles/{slack_user_id}'] = profile
+    print(f'{len(slack_user_ids)} players, {len(updates)} profiles missing or out of date')
+    if dry_run:
+        return updates
+
+    paths = list(updates)
+    for i in range(0, len(paths), UPDATE_SIZE):
+        firebase.database().update({path: updates[path] for path in paths[i:i + UPDATE_SIZE]})
+    print(f'Wrote {len(updates)} player profiles')
+    return updates
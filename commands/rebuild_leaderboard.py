@@ -0,0 +1,21 @@
+from app.games.leaderboard import RANKINGS, Leaderboard
+from app.utils.firebase import get_firebase
+
+
+def rebuild_leaderboard(game_slug):
+    """Rank all the player statistics of the game and write the leaderboard from scratch"""
+    firebase = get_firebase()
+    print('Grabbing player statistics from Firebase')
+    player_statistics = firebase.database()\
+        .child('games')\
+        .child(game_slug)\
+        .child('player_statistics')\
+        .get().val()
+    leaderboard = Leaderboard(game_slug)
+    leaderboard.load(player_statistics)
+    firebase.database().update({leaderboard.get_path(): leaderboard.to_node()})
+    print(f'Ranked {len(leaderboard.entries)} players of {game_slug}')
+    for ranking in RANKINGS:
+        top = ', '.join(entry['slack_user_id'] for entry in leaderboard.get_top(ranking))
+        print(f'Top {leaderboard.size} by {ranking}: {top}')
+    return leaderboard
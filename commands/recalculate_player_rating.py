@@ -0,0 +1,52 @@
+import time
+
+from app.games.rating_replay import RatingReplay, iter_sessions
+from app.utils.firebase import BatchedUpdate, get_firebase
+from commands.rebuild_leaderboard import rebuild_leaderboard
+
+# Amount of paths written to Firebase per request
+WRITE_BATCH_SIZE = 500
+
+
+def replay_player_ratings(game_slug, dry_run=False):
+    """
+    Replay all the sessions of the game and report the discrepancies, unless dry_run is set the sessions and the
+    player statistics are corrected in Firebase. Returns the RatingReplay.
+    """
+    firebase = get_firebase()
+    replay = RatingReplay(game_slug)
+    batch = BatchedUpdate(firebase, WRITE_BATCH_SIZE)
+    started = time.monotonic()
+
+    print(f'Replaying the sessions of {game_slug}')
+    for session_key, session in iter_sessions(firebase, game_slug):
+        session_updates = replay.replay_session(session_key, session)
+        if session_updates and not dry_run:
+            batch.update(session_updates)
+
+    print('Grabbing player statistics from Firebase')
+    stored_player_statistics = firebase.database()\
+        .child('games')\
+        .child(game_slug)\
+        .child('player_statistics')\
+        .get().val()
+    player_statistics_updates = replay.get_player_statistics_updates(stored_player_statistics)
+    if not dry_run:
+        batch.update(player_statistics_updates)
+        batch.flush()
+
+    for discrepancy in replay.discrepancies:
+        print(f'{discrepancy.path}: expected {discrepancy.expected}, but was {discrepancy.actual}')
+    print(f'Replayed {replay.replayed_sessions} sessions of {len(replay.players)} players in '
+          f'{time.monotonic() - started:.2f} seconds, found {len(replay.discrepancies)} discrepancies '
+          f'({replay.corrected_sessions} sessions and {len(player_statistics_updates)} player statistics to correct)')
+    if not dry_run:
+        print(f'Wrote {batch.written_paths} corrected paths in {batch.requests} requests')
+        if player_statistics_updates:
+            # The leaderboard ranks the corrected statistics
+            rebuild_leaderboard(game_slug)
+    return replay
+
+
+def recalculate_player_rating(game_slug, dry_run=False):
+    replay_player_ratings(game_slug, dry_run)
@@ -0,0 +1,54 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.firebase import get_firebase
+
+# Amount of records (paths) written to Firebase per request
+RESTORE_CHUNK_SIZE = 500
+# Amount of requests that are written in parallel
+RESTORE_WORKERS = 4
+
+
+def _iter_chunks(backup_file):
+    with gzip.open(backup_file, 'rt', encoding='utf-8') as f:
+        chunk = {}
+        for line in f:
+            record = json.loads(line)
+            if 'backup' in record:
+                print(f'Restoring {backup_file}: {record["backup"]}')
+                continue
+            chunk[record['path']] = record['value']
+            if len(chunk) >= RESTORE_CHUNK_SIZE:
+                yield chunk
+                chunk = {}
+        if chunk:
+            yield chunk
+
+
+def _write_chunk(firebase, chunk):
+    # database() has to be called from the worker thread, every thread has its own Database object
+    firebase.database().update(chunk)
+
+
+def restore(*backup_files):
+    """
+    Restore backups made by the backup command, in the given order (a full backup followed by its incrementals).
+
+    The records are written as multi-path updates of RESTORE_CHUNK_SIZE paths, RESTORE_WORKERS at a time. Only the
+    backed up paths are written, anything else in the database is left as it is.
+    """
+    firebase = get_firebase()
+    for backup_file in backup_files:
+        records = 0
+        with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as executor:
+            pending = []
+            for chunk in _iter_chunks(backup_file):
+                # Keep a bounded amount of chunks in memory, wait for the oldest write before reading further
+                if len(pending) >= RESTORE_WORKERS * 2:
+                    pending.pop(0).result()
+                pending.append(executor.submit(_write_chunk, firebase, chunk))
+                records += len(chunk)
+            for future in pending:
+                future.result()
+        print(f'Restored {records} records from {backup_file}')
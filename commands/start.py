@@ -1,29 +1,135 @@
-from raven import Client
 import logging
 
-from app.games.implementations.ping_pong import PingPongGame
-from app.settings import READER_VENDOR_ID, READER_PRODUCT_ID, SENTRY_DSN
-from app.readers.hid.hid_reader import HIDReader
+from raven import Client
+
+from app.games.game_services import GameServices
+from app.games.implementations import GAMES
+from app.readers.hid.hid_reader_manager import HIDReaderManager, match_locations, match_vendor_product
+from app.readers.deduplicating_reader_listener import DeduplicatingReaderListener
 from app.readers.reader_listener import ReaderListener
+from app.settings import ASYNC_MODE, READER_PRODUCT_ID, READER_VENDOR_ID, SENTRY_DSN, TABLES
+from app.utils.imports import lazy_import
+from app.utils.metrics import start_metrics
+
+# Only the asyncio mode (OG_ASYNC_MODE) needs it
+asyncio = lazy_import('asyncio')
+
+logger = logging.getLogger(__name__)
+
+
+class CapraNFCReader(ReaderListener):
+    def __init__(self, game):
+        self.game = game
+
+    def handle_card_read(self, card):
+        self.game.register_card(card)
+
+    def handle_data(self, message):
+        pass
+
+
+class AsyncCapraNFCReader(ReaderListener):
+    def __init__(self, game, loop):
+        self.game = game
+        self.loop = loop
+
+    def handle_card_read(self, card):
+        # The readers are read from the event loop, schedule the card read instead of waiting for it
+        asyncio.ensure_future(self.game.register_card(card), loop=self.loop)
+
+    def handle_data(self, message):
+        pass
+
+
+def get_tables(game_slug):
+    """
+    Returns (game slug, reader matcher) per table, see OG_TABLES, every table gets its own HID reader manager which
+    picks up the matching readers, also when they are plugged in later
+    """
+    if TABLES:
+        tables = [(table_game_slug, match_locations(locations)) for table_game_slug, locations in TABLES.items()]
+    else:
+        tables = [(game_slug, match_vendor_product(READER_VENDOR_ID, READER_PRODUCT_ID))]
+    for table_game_slug, _ in tables:
+        if table_game_slug not in GAMES:
+            raise ValueError(f'Unknown game {table_game_slug}, available games: {", ".join(GAMES)}')
+    return tables
+
+
+def check_player_profiles(firebase):
+    """Warn when the players were never copied to player_profiles, every player would be read from players then"""
+    def has_children(path):
+        return bool(firebase.database().child(path).order_by_key().limit_to_first(1).get().val())
+
+    if not has_children('player_profiles') and has_children('players'):
+        logger.warning('player_profiles is empty, every player is read from players (with its cards and session '
+                       'history) until it is copied, run: python run.py index_player_profiles')
 
 
 def start(game_slug):
     sentry_client = Client(SENTRY_DSN)
     logging.basicConfig(level=logging.DEBUG)
+    start_metrics()
+
+    if ASYNC_MODE:
+        start_async(sentry_client, game_slug)
+        return
 
     try:
-        game = PingPongGame()
+        tables = get_tables(game_slug)
+        # The games share the Firebase client, the player cache, the journal and Slack
+        services = GameServices()
+        check_player_profiles(services.firebase)
+        readers = []
+        for table_game_slug, port_matcher in tables:
+            game = GAMES[table_game_slug][0](services=services)
+            reader = HIDReaderManager(port_matcher)
+            logger.info(f'Serving {game.get_name()} with the readers {reader.get_matching_ports()}')
+            # The repeats of a card are dropped before the game looks the card up
+            reader.add_read_listener(DeduplicatingReaderListener(CapraNFCReader(game)))
+            readers.append(reader)
+
+        # One reader thread per table, so a slow card read at one table does not hold up the others
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+    except Exception:
+        sentry_client.captureException()
 
-        class CapraNFCReader(ReaderListener):
-            def handle_card_read(self, card):
-                game.register_card(card)
 
-            def handle_data(self, message):
-                pass
+def start_async(sentry_client, game_slug):
+    loop = asyncio.get_event_loop()
 
-        ports = HIDReader.find_readers(READER_VENDOR_ID, READER_PRODUCT_ID, None)
-        reader = HIDReader(ports)
-        reader.add_read_listener(CapraNFCReader())
-        reader.connect()
+    def handle_exception(loop, context):
+        exception = context.get('exception')
+        if exception is not None:
+            sentry_client.captureException(exc_info=(type(exception), exception, exception.__traceback__))
+        loop.default_exception_handler(context)
+
+    loop.set_exception_handler(handle_exception)
+
+    try:
+        tables = get_tables(game_slug)
+        services = GameServices()
+        check_player_profiles(services.firebase)
+        games = []
+        readers = []
+        for table_game_slug, port_matcher in tables:
+            game = GAMES[table_game_slug][1](loop=loop, services=services)
+            reader = HIDReaderManager(port_matcher)
+            logger.info(f'Serving {game.get_name()} with the readers {reader.get_matching_ports()}')
+            reader.add_read_listener(DeduplicatingReaderListener(AsyncCapraNFCReader(game, loop)))
+            reader.attach(loop)
+            games.append(game)
+            readers.append(reader)
+        try:
+            loop.run_forever()
+        finally:
+            for reader in readers:
+                reader.detach(loop)
+            for game in games:
+                loop.run_until_complete(game.close())
+            services.stop()
     except Exception:
         sentry_client.captureException()
@@ -1,23 +1,69 @@
 #!/usr/bin/python
+import importlib
 import sys
 import os
 from clint.arguments import Args
 
-from commands.backup import backup
-from commands.check_player_statistics import check_player_statistics
-from commands.start import start
+from app.settings import GAME_SLUG
+from app.utils.imports import ImportTimer
 
+# Every command is the function of the same name in commands/<command>.py, only the module of the command that is run
+# is imported
 AVAILABLE_COMMANDS = [
     'backup',
+    'benchmark',
+    'benchmark_hid',
     'check_player_statistics',
+    'compare_ratings',
+    'export_sessions',
+    'index_card_aliases',
+    'index_player_profiles',
+    'rebuild_leaderboard',
     'recalculate_player_rating',
+    'restore',
     'start'
 ]
+# Modules that are slow to import, e.g. on a Raspberry Pi at boot
+HEAVY_MODULES = ['aiohttp', 'asyncio', 'evdev', 'numpy', 'pyrebase', 'raven', 'slacker', 'slugify', 'trueskill']
+# Command -> the heavy modules it may import before it runs, the others have to be deferred to their first use
+STARTUP_BUDGETS = {
+    'backup': ['pyrebase'],
+    'benchmark': ['pyrebase', 'slacker', 'slugify', 'trueskill'],
+    'benchmark_hid': ['evdev'],
+    'check_player_statistics': ['pyrebase', 'trueskill'],
+    'compare_ratings': ['pyrebase', 'trueskill'],
+    'export_sessions': ['pyrebase', 'trueskill'],
+    'index_card_aliases': ['pyrebase'],
+    'index_player_profiles': ['pyrebase'],
+    'rebuild_leaderboard': ['pyrebase'],
+    'recalculate_player_rating': ['pyrebase', 'trueskill'],
+    'restore': ['pyrebase'],
+    'start': ['evdev', 'pyrebase', 'raven', 'slacker', 'slugify', 'trueskill']
+}
+
+
+def load_command(command):
+    return getattr(importlib.import_module(f'commands.{command}'), command)
+
+
+def report_import_times(command):
+    """Import the command, print how long every module took and check the startup budget of the command"""
+    import_timer = ImportTimer.install()
+    load_command(command)
+    import_timer.uninstall()
+    print(import_timer.format_report())
+    exceeded_budget = [
+        module for module in HEAVY_MODULES
+        if module in import_timer.times and module not in STARTUP_BUDGETS[command]
+    ]
+    if exceeded_budget:
+        print(f'{command} imports {", ".join(exceeded_budget)} at startup, defer them to their first use '
+              f'(see app.utils.imports.lazy_import) or add them to its startup budget')
+    return not exceeded_budget
 
 
 if __name__ == '__main__':
-    # TODO: Get from ENV variable
-    game_slug = 'ping-pong'
+    game_slug = GAME_SLUG
     sys.path.insert(0, os.path.abspath('..'))
     args = Args()
     if len(args) == 0 or args.all[0] not in AVAILABLE_COMMANDS:
@@ -26,11 +72,52 @@ if __name__ == '__main__':
 
     command = args.all[0].lower()
 
+    if '--import-times' in args.all:
+        sys.exit(0 if report_import_times(command) else 1)
+
+    run_command = load_command(command)
+
     if command == 'backup':
-        backup()
+        run_command(incremental='--incremental' in args.all)
+    elif command == 'benchmark':
+        if not run_command(
+            rounds=int(args.value_after('--rounds') or 20),
+            players=int(args.value_after('--players') or 50),
+            latency=float(args.value_after('--latency') or 0),
+            slack_latency=float(args.value_after('--slack-latency') or 0),
+            jitter=float(args.value_after('--jitter') or 0)
+        ):
+            sys.exit(1)
+    elif command == 'benchmark_hid':
+        reader_counts = args.value_after('--readers')
+        if not run_command(
+            reader_counts=[int(count) for count in reader_counts.split(',')] if reader_counts else None,
+            reads=int(args.value_after('--reads') or 20000)
+        ):
+            sys.exit(1)
     elif command == 'check_player_statistics':
-        check_player_statistics(game_slug)
+        run_command(game_slug)
+    elif command == 'compare_ratings':
+        k_factors = args.value_after('--k-factors')
+        betas = args.value_after('--betas')
+        run_command(
+            game_slug,
+            k_factors=[float(k) for k in k_factors.split(',')] if k_factors else None,
+            betas=[float(beta) for beta in betas.split(',')] if betas else None
+        )
+    elif command == 'export_sessions':
+        run_command(game_slug)
+    elif command == 'index_card_aliases':
+        run_command(dry_run='--dry-run' in args.all)
+    elif command == 'index_player_profiles':
+        run_command(dry_run='--dry-run' in args.all)
+    elif command == 'rebuild_leaderboard':
+        run_command(game_slug)
+    elif command == 'recalculate_player_rating':
+        run_command(game_slug, dry_run='--dry-run' in args.all)
+    elif command == 'restore':
+        run_command(*args.all[1:])
     elif command == 'start':
-        start(game_slug)
+        run_command(game_slug)
 
     sys.exit(0)